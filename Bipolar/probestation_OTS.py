@@ -14,7 +14,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 
 '''------------------------------------------------------------------------
@@ -165,14 +164,34 @@ HRS_lim = 1e6
 
 ######################## Measurement ###############################
 
-# initialization
+# initialization sweep and read in one SMU protocol, each with the compliance of its profile
 smu_sweep_params['stop_voltage'] = V_sweep
-measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+segment_params = {
+    "segments": [
+        {"start_voltage": 0, "stop_voltage": V_sweep, "points": smu_sweep_params['points'],
+         "compliance_current": smu_sweep_params['compliance_current']},
+        {"start_voltage": V_sweep, "stop_voltage": 0, "points": smu_sweep_params['points'],
+         "compliance_current": smu_sweep_params['compliance_current']},
+        {"start_voltage": 0, "stop_voltage": smu_read_params['stop_voltage'], "points": smu_read_params['points'],
+         "compliance_current": smu_read_params['compliance_current']},
+        {"start_voltage": smu_read_params['stop_voltage'], "stop_voltage": 0, "points": smu_read_params['points'],
+         "compliance_current": smu_read_params['compliance_current']},
+    ],
+    "NPLC": smu_sweep_params['NPLC'],
+}
+relays(esp32, 'measure')
+segments = get_smu_segment_measurement(smu, segment_params)
+smu_segment_compliance(segment_params, segments)
+sweep = tuple(np.concatenate(x) for x in zip(*segments[:2]))
+save_smu_data(generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'), smu_sweep_params, *sweep)
 
 #####################################################################
 
-# read
-R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+# read, the resistance is taken at the apex of the 0 -> V_read -> 0 sweep as in measure_with_smu
+read = tuple(np.concatenate(x) for x in zip(*segments[2:]))
+save_smu_data(generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'), smu_read_params, *read)
+resistance = read[4]
+R_read = np.mean(resistance[len(resistance) // 2 - 5:len(resistance) // 2 + 5])
 print('Resistance after sweep =', R_read)
 record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
@@ -180,7 +199,6 @@ record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 #####################################################################
 # setup relay
 relays(esp32, 'switch')
-time.sleep(1)
 
 for i in range(10):
     setup_oscilloscope(scope, RESET_settings)
@@ -14,7 +14,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 #smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 #esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 
 '''------------------------------------------------------------------------
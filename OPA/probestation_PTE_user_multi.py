@@ -14,7 +14,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -99,6 +98,9 @@ smu_sweep_params = {
 ---------------------------------------------------------------------------
 ---------------------------------------------------------------------------
 ---------------------------------------------------------------------------'''
+# Last read of the device; with the target of the pulse since then it fixes the SMU current range of the next read
+R_last = {}
+
 for i in range(3):
     ###################### sample info ###########################
     File_Root = "C:/Users/lisaadmin/Desktop/data/test"
@@ -175,12 +177,15 @@ for i in range(3):
 
     # initialization
     smu_sweep_params['stop_voltage'] = V_sweep
-    measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+    measure_with_smu_early_abort(smu, esp32, smu_sweep_params,
+                                 generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'),
+                                 switching_resistance=LRS_lim)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+    R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
     print('Resistance after sweep =', R_read)
     record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
@@ -188,14 +193,8 @@ for i in range(3):
 
     # RESET
     sequence_config = [{"number": 1, "waveform": "RESET"}]
-    setup_sequences(awg, sequence_config)
-
-    # setup oscilloscope
-    setup_oscilloscope(scope, RESET_settings)
-
-    # setup relay
-    relays(esp32, 'switch')
-    time.sleep(0.1)
+    # upload sequence, setup oscilloscope and relay in parallel
+    prepare_shot(awg, scope, esp32, sequence_config, RESET_settings)
 
     # Output and Run
     awg.write("OUTPut1:STATe 1")
@@ -204,13 +203,13 @@ for i in range(3):
     # waiting for trigger:
     trigger(scope, awg)
     times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params,
-                     generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'))
+    # the shot is saved while the SMU measures
+    R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'), generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), HRS_lim), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+    R_last['read'] = R_read
     print('Resistance after RESET =', R_read)
     record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
 
@@ -234,9 +233,7 @@ for i in range(3):
             total_time = rise_time + T_SET + fall_time + 2*delay
 
             # write SET waveform
-            awg.waveforms["SET"] = SET
             sequence_config = [{"number": 1, "waveform": "SET"}]
-            setup_sequences(awg, sequence_config)
 
             # setup oscilloscope
             SET_settings['Timebase Scale'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase")
@@ -246,11 +243,8 @@ for i in range(3):
             SET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_SET * 0.4, "voltage")
             SET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_SET * 0.4, "voltage") * 3
             SET_settings['Trigger Level']['Level'] = V_SET*0.8
-            setup_oscilloscope(scope, SET_settings)
-
-            # setup relay
-            relays(esp32, 'switch')
-            time.sleep(0.1)
+            # upload waveform, setup oscilloscope and relay in parallel
+            prepare_shot(awg, scope, esp32, sequence_config, SET_settings, {"SET": SET})
 
             # Output and Run
             awg.write("OUTPut1:STATe 1")
@@ -260,25 +254,30 @@ for i in range(3):
             trigger(scope, awg)
             times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
             #plot_waveform(times,voltages)
-            np.savez_compressed(generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
             #####################################################################
 
             # read
-            R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'))
+            # the shot is saved while the SMU measures
+            R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'), generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+            R_last['read'] = R_read
             print('Resistance after SET =', R_read)
             record_resistance(Record_file, V_SET, R_read, f'after_SET_{tt}')
 
             #####################################################################
 
             # initialization
-            measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+            measure_with_smu_early_abort(smu, esp32, smu_sweep_params,
+                                         generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'),
+                                         switching_resistance=LRS_lim)
 
             #####################################################################
 
             # read
             R_read = measure_with_smu(smu, esp32, smu_read_params,
-                             generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+                             generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'),
+                             last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+            R_last['read'] = R_read
             print('Resistance after sweep =', R_read)
             record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
@@ -286,14 +285,8 @@ for i in range(3):
 
             # RESET
             sequence_config = [{"number": 1, "waveform": "RESET"}]
-            setup_sequences(awg, sequence_config)
-
-            # setup oscilloscope
-            setup_oscilloscope(scope, RESET_settings)
-
-            # setup relay
-            relays(esp32, 'switch')
-            time.sleep(0.1)
+            # upload sequence, setup oscilloscope and relay in parallel
+            prepare_shot(awg, scope, esp32, sequence_config, RESET_settings)
 
             # Output and Run
             awg.write("OUTPut1:STATe 1")
@@ -303,13 +296,13 @@ for i in range(3):
             trigger(scope, awg)
             times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
             #plot_waveform(times,voltages)
-            np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
             #####################################################################
 
             # read
-            R_read = measure_with_smu(smu, esp32, smu_read_params,
-                             generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'))
+            # the shot is saved while the SMU measures
+            R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'), generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), HRS_lim), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+            R_last['read'] = R_read
             print('Resistance after RESET =', R_read)
             record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
 
@@ -8,6 +8,13 @@ import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 import serial
 from pyvisa.errors import VisaIOError
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+import json
+import queue
+import threading
+import weakref
+import zipfile
 
 
 def connect_to_awg(address):
@@ -84,14 +91,40 @@ def connect_to_smu(resource_string):
         return None
 
 
-def connect_to_esp32(port, baud_rate):
+# Open ESP32 connections by port, kept across script runs within one Python session.
+_esp32_connections = {}
+
+
+def ping_esp32(ser, timeout=0.2):
     """
-    Establishes a serial connection to an ESP32 device. Initially connects at 9600 baud to
-    ensure communication, then reconnects at the specified baud rate.
+    Sends a PING to the ESP32 and waits for its answer.
+
+    Parameters:
+    - ser (serial.Serial): The serial connection object.
+    - timeout (float): Maximum time in seconds to wait for the answer.
+
+    Returns:
+    - str or None: The firmware version reported by the board, None if it did not answer.
+    """
+    ser.write(b'PING\n')
+    line = read_esp32_line(ser, lambda x: x.startswith('PONG'), timeout)
+    return None if line is None else line[len('PONG'):].strip()
+
+
+def connect_to_esp32(port, baud_rate, timeout=5.0, reuse=True):
+    """
+    Establishes a serial connection to an ESP32 device and waits until the firmware answers a PING.
+
+    The port is opened once at the given baud rate with DTR/RTS released, so most boards are not reset. If the
+    board does reset, the handshake is retried until the firmware is up, and the function returns as soon as it
+    answers. With reuse=True an open connection to the same port from an earlier run in the same Python session
+    is reused if it still answers.
 
     Parameters:
     - port (str): The COM port to connect to.
-    - baud_rate (int): The baud rate at which the communication should occur after initial setup.
+    - baud_rate (int): The baud rate of the firmware.
+    - timeout (float): Maximum time in seconds to wait for the handshake.
+    - reuse (bool): Reuse a connection opened by an earlier call.
 
     Returns:
     - serial.Serial: The serial connection object if the connection is successful, None otherwise.
@@ -99,18 +132,43 @@ def connect_to_esp32(port, baud_rate):
     Raises:
     - serial.SerialException: Catches and logs any errors related to serial communication.
     """
+    ser = _esp32_connections.get(port) if reuse else None
+    if ser is not None:
+        try:
+            if ser.is_open and ser.baudrate == baud_rate:
+                ser.reset_input_buffer()
+                version = ping_esp32(ser)
+                if version is not None:
+                    print(f"Reusing connection to ESP32 ({version}) at {baud_rate} baud.")
+                    return ser
+            ser.close()
+        except serial.SerialException:
+            pass
+        _esp32_connections.pop(port, None)
+
     try:
-        # Initially open serial port to ensure communication starts correctly
-        with serial.Serial(port, 9600):
-            print("Initial connection to ESP32 established at 9600 baud.")
-        # Reopen with desired baud rate
-        ser = serial.Serial(port, baud_rate)
-        print(f"Connected to ESP32 at {baud_rate} baud.")
-        return ser
+        ser = serial.Serial()
+        ser.port = port
+        ser.baudrate = baud_rate
+        ser.dtr = False
+        ser.rts = False
+        ser.open()
     except serial.SerialException as e:
         print(f"Failed to connect to ESP32: {e}")
         return None
 
+    t_end = time.monotonic() + timeout
+    while time.monotonic() < t_end:
+        version = ping_esp32(ser, timeout=min(0.2, max(t_end - time.monotonic(), 0.01)))
+        if version is not None:
+            ser.reset_input_buffer()
+            _esp32_connections[port] = ser
+            print(f"Connected to ESP32 ({version}) at {baud_rate} baud.")
+            return ser
+    ser.close()
+    print(f"Failed to connect to ESP32: no answer to PING on {port} within {timeout} s")
+    return None
+
 
 def setup_oscilloscope(scope, settings):
     """
@@ -352,6 +410,191 @@ def setup_sequences(awg, sequence_config):
         print(f"Sequence {config['number']} set with waveform {config['waveform']}")
 
 
+# Current measurement ranges of the B29xx SMUs in A.
+SMU_CURRENT_RANGES = [1e-8, 1e-7, 1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1]
+
+
+def predict_smu_current_range(resistance, voltage, margin=2, lower_limit=1e-7):
+    """
+    Predicts the smallest fixed current range that can measure a device of known resistance at a given voltage.
+
+    Parameters:
+    - resistance (float): Last known resistance of the device in Ohm.
+    - voltage (float): Largest absolute voltage applied during the measurement.
+    - margin (float): Headroom factor on the expected current, covering drift since the last measurement.
+    - lower_limit (float): Smallest range to use, the same as the auto-range lower limit.
+
+    Returns:
+    - float or None: The current range in A, None if the resistance is unknown or not physical.
+
+    Examples:
+    - predict_smu_current_range(1e4, 0.1) returns 1e-4 (expected current 10 uA, with margin 20 uA).
+    - predict_smu_current_range(1e6, 0.1) returns 1e-6.
+    """
+    if resistance is None or not np.isfinite(resistance) or resistance <= 0:
+        return None
+    expected = abs(float(voltage)) / float(resistance) * margin
+    for current_range in SMU_CURRENT_RANGES:
+        if current_range >= lower_limit and expected <= current_range:
+            return current_range
+    return SMU_CURRENT_RANGES[-1]
+
+
+def expected_resistance(before, target=None):
+    """
+    Resistance to predict the current range of a read from (see predict_smu_current_range) when a pulse lies
+    between the last read and this one.
+
+    After the pulse the device is either still at the resistance read before it or has switched to about the
+    target of the pulse. The lower of the two draws the larger current, so a range predicted from it holds
+    either outcome; a device that switched beyond the target overflows the range and is read again with auto
+    range.
+
+    Parameters:
+    - before (float): Resistance read just before the pulse, None if unknown.
+    - target (float): Resistance the pulse aims at, e.g. LRS_lim for a SET and HRS_lim for a RESET; None if
+      nothing was applied since the read.
+
+    Returns:
+    - float or None: The resistance to predict from, None (auto range) if the read before is unknown.
+
+    Examples:
+    - expected_resistance(1e6, 2e3) returns 2e3 after a SET from the HRS.
+    - expected_resistance(1e3, 1e6) returns 1e3 after a RESET from the LRS.
+    """
+    if before is None:
+        return None
+    return before if target is None else min(before, target)
+
+
+def configure_smu_current_range(smu, params):
+    """
+    Configures the current measurement range: a fixed range if params contains 'current_range', otherwise the
+    resolution-based auto range with a 100 nA lower limit.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): SMU parameters, optionally with 'current_range' in A.
+    """
+    if params.get('current_range') is not None:
+        smu.write("SENS:CURR:RANG:AUTO OFF")
+        smu.write(f"SENS:CURR:RANG {params['current_range']}")
+    else:
+        smu.write("SENS:CURR:RANG:AUTO ON")
+        smu.write("SENS:CURR:RANG:AUTO:LLIM 1E-7")
+        smu.write("SENS:CURR:RANG:AUTO:MODE RES")
+        smu.write("SENS:CURR:RANG:AUTO:THR 80")
+
+
+def smu_current_out_of_range(current, current_range):
+    """
+    Checks whether a measurement taken on a fixed current range overflowed it.
+
+    Parameters:
+    - current (np.ndarray): Measured currents.
+    - current_range (float): The fixed range the currents were measured on.
+
+    Returns:
+    - bool: True if any reading is not finite or reaches the full scale of the range.
+    """
+    current = np.abs(np.asarray(current, dtype=float))
+    # the B29xx reports overflowed readings as 9.9e37
+    return bool(np.any(~np.isfinite(current)) or np.any(current >= float(current_range)))
+
+
+def configure_smu_sweep(smu, params):
+    """
+    Writes the staircase-sweep configuration described by params to the SMU without starting it.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): A dictionary containing configuration parameters for the SMU.
+
+    Returns:
+    - int: The trigger count programmed into the SMU, i.e. the number of points that will be acquired.
+    """
+    smu.write("SOUR:FUNC VOLT")
+    smu.write(f"SOUR:VOLT:START {params['start_voltage']}")
+    smu.write(f"SOUR:VOLT:STOP {params['stop_voltage']}")
+    smu.write(f"SOUR:VOLT:POIN {params['points']}")
+    smu.write("SOUR:VOLT:MODE SWE")
+    smu.write(f"SOUR:SWE:STA {params['sweep_direction']}")
+    smu.write("SOUR:SWE:RANG AUTO")
+    smu.write("SENS:FUNC 'CURR','VOLT','RES'")
+    smu.write(f"SENS:CURR:NPLC {params['NPLC']}")
+    smu.write(f"SENS:CURR:PROT {params['compliance_current']}")
+    configure_smu_current_range(smu, params)
+    smu.write("TRIG:SOUR AINT")
+    count = int((2 * int(params['points']))) if params['sweep_direction'] == "DOUB" else int(params['points'])
+    smu.write(f"TRIG:COUN {count}")
+    return count
+
+
+def configure_smu_list(smu, params):
+    """
+    Writes a constant-voltage list configuration described by params to the SMU without starting it.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): A dictionary with 'voltage', 'points', 'NPLC' and 'compliance_current'.
+
+    Returns:
+    - int: The trigger count programmed into the SMU, i.e. the number of points that will be acquired.
+    """
+    count = int(params['points'])
+    v = np.ones(count)*float(params['voltage'])
+    v_list = list(v)
+    v_str = ', '.join(f'{x}' for x in v_list)
+    smu.write("SOUR:FUNC VOLT")
+    smu.write("SOUR:VOLT:MODE LIST")
+    smu.write("SOUR:LIST:RANG AUTO")
+    smu.write(f"SOUR:LIST:VOLT {v_str}")
+    smu.write("SENS:FUNC 'CURR','VOLT','RES'")
+    smu.write(f"SENS:CURR:NPLC {params['NPLC']}")
+    smu.write(f"SENS:CURR:PROT {params['compliance_current']}")
+    configure_smu_current_range(smu, params)
+    smu.write("TRIG:SOUR AINT")
+    smu.write(f"TRIG:COUN {count}")
+    return count
+
+
+def hold_smu_output(smu, voltage):
+    """
+    Keeps the SMU output on at a fixed voltage between two acquisitions of one protocol.
+
+    In LIST and SWE mode SOUR:VOLT only sets the level of the fixed mode, so the source is switched to the fixed
+    mode first; the next configure_smu_* call switches it back.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - voltage (float): The voltage to hold, normally the last point of the acquisition that just ended.
+    """
+    smu.write("SOUR:VOLT:MODE FIX")
+    smu.write(f"SOUR:VOLT {voltage}")
+
+
+def fetch_smu_arrays(smu, output_off=True):
+    """
+    Fetches the result arrays of the last completed acquisition and switches the SMU output off.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - output_off (bool): Set to False to keep the output on, e.g. between the chunks of a chunked sweep.
+
+    Returns:
+    - tuple of np.ndarray: Contains arrays for time, source voltage, voltage, current, and resistance.
+    """
+    measure_time = np.array(smu.query_ascii_values("FETC:ARR:TIME?"))
+    source_voltage = np.array(smu.query_ascii_values("FETC:ARR:SOUR?"))
+    voltage = np.array(smu.query_ascii_values("FETC:ARR:VOLT?"))
+    current = np.array(smu.query_ascii_values("FETC:ARR:CURR?"))
+    resistance = np.array(smu.query_ascii_values("FETC:ARR:RES?"))
+    if output_off:
+        smu.write("OUTP1 OFF")
+        smu.write("*WAI")
+    return measure_time, source_voltage, voltage, current, resistance
+
+
 def get_smu_measurement(smu, params):
     """
     Configures the SMU for a voltage sweep according to specified parameters and fetches the measurement data.
@@ -369,32 +612,10 @@ def get_smu_measurement(smu, params):
     - RuntimeError: If there is a failure in setting up the SMU or fetching the data.
     """
     try:
-        smu.write("SOUR:FUNC VOLT")
-        smu.write(f"SOUR:VOLT:START {params['start_voltage']}")
-        smu.write(f"SOUR:VOLT:STOP {params['stop_voltage']}")
-        smu.write(f"SOUR:VOLT:POIN {params['points']}")
-        smu.write("SOUR:VOLT:MODE SWE")
-        smu.write(f"SOUR:SWE:STA {params['sweep_direction']}")
-        smu.write("SOUR:SWE:RANG AUTO")
-        smu.write("SENS:FUNC 'CURR','VOLT','RES'")
-        smu.write("SENS:CURR:RANG:AUTO:LLIM 1E-7")
-        smu.write(f"SENS:CURR:NPLC {params['NPLC']}")
-        smu.write(f"SENS:CURR:PROT {params['compliance_current']}")
-        smu.write("SENS:CURR:RANG:AUTO:MODE RES")
-        smu.write("SENS:CURR:RANG:AUTO:THR 80")
-        smu.write("TRIG:SOUR AINT")
-        count = str(int((2 * int(params['points']))) if params['sweep_direction'] == "DOUB" else params['points'])
-        smu.write(f"TRIG:COUN {count}")
-
+        configure_smu_sweep(smu, params)
         smu.write("INIT")
         smu.write("*WAI")
-        measure_time = np.array(smu.query_ascii_values("FETC:ARR:TIME?"))
-        source_voltage = np.array(smu.query_ascii_values("FETC:ARR:SOUR?"))
-        voltage = np.array(smu.query_ascii_values("FETC:ARR:VOLT?"))
-        current = np.array(smu.query_ascii_values("FETC:ARR:CURR?"))
-        resistance = np.array(smu.query_ascii_values("FETC:ARR:RES?"))
-        smu.write("OUTP1 OFF")
-        smu.write("*WAI")
+        measure_time, source_voltage, voltage, current, resistance = fetch_smu_arrays(smu)
     except Exception as e:
         raise RuntimeError(f"Failed to configure or fetch data from SMU: {e}")
 
@@ -417,64 +638,1044 @@ def get_smu_list_measurement(smu, params):
     - RuntimeError: If there is a failure in setting up the SMU or fetching the data.
     """
     try:
-        count = int(params['points'])
-        v = np.ones(count)*float(params['voltage'])
-        v_list = list(v)
-        v_str = ', '.join(f'{x}' for x in v_list)
-        smu.write("SOUR:FUNC VOLT")
-        smu.write("SOUR:VOLT:MODE LIST")
-        smu.write("SOUR:LIST:RANG AUTO")
-        smu.write(f"SOUR:LIST:VOLT {v_str}")
-        smu.write("SENS:FUNC 'CURR','VOLT','RES'")
-        smu.write("SENS:CURR:RANG:AUTO:LLIM 1E-7")
-        smu.write(f"SENS:CURR:NPLC {params['NPLC']}")
-        smu.write(f"SENS:CURR:PROT {params['compliance_current']}")
-        smu.write("SENS:CURR:RANG:AUTO:MODE RES")
-        smu.write("SENS:CURR:RANG:AUTO:THR 80")
-        smu.write("TRIG:SOUR AINT")
+        configure_smu_list(smu, params)
+        smu.write("INIT")
+        smu.write("*WAI")
+        measure_time, source_voltage, voltage, current, resistance = fetch_smu_arrays(smu)
+    except Exception as e:
+        raise RuntimeError(f"Failed to configure or fetch data from SMU: {e}")
+
+    return measure_time, source_voltage, voltage, current, resistance
+
+
+# Worker threads that wait for running SMU acquisitions. pyvisa releases the GIL while it
+# waits on the bus, so the acquisition thread is free to build waveforms or save data meanwhile.
+_smu_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='smu')
+
+
+def wait_smu_complete(smu, method='poll', timeout=None, poll_interval=0.02):
+    """
+    Blocks until the SMU has finished the running acquisition.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource, armed with 'INIT' followed by '*OPC'.
+    - method (str): 'poll' reads the event status register until the OPC bit is set, 'opc' issues a single
+      blocking '*OPC?' query.
+    - timeout (float): Maximum waiting time in seconds; defaults to the VISA timeout of the SMU.
+    - poll_interval (float): Time interval in seconds between status checks in 'poll' mode.
+
+    Raises:
+    - TimeoutError: If the acquisition does not complete within the timeout.
+    - ValueError: If the method is not recognized.
+    """
+    if timeout is None:
+        timeout = smu.timeout / 1000
+    if method == 'opc':
+        smu.query("*OPC?")
+        return
+    if method != 'poll':
+        raise ValueError(f"Unknown completion method '{method}'. Expected 'poll' or 'opc'.")
+
+    t_end = time.monotonic() + timeout
+    while True:
+        # bit 0 of the standard event status register is set by '*OPC' once INIT has completed
+        if int(smu.query("*ESR?")) & 1:
+            return
+        if time.monotonic() > t_end:
+            raise TimeoutError(f"SMU acquisition did not complete within {timeout} s")
+        time.sleep(poll_interval)
 
-        smu.write(f"TRIG:COUN {count}")
 
+def _start_smu(smu, configure, params, method, timeout, poll_interval, finish=None):
+    # Common body of the start_smu_* functions: configure, arm and hand the wait to a worker thread.
+    # finish, if given, post-processes the fetched arrays in the same worker.
+    try:
+        configure(smu, params)
+        smu.write("*CLS")
         smu.write("INIT")
-        smu.write("*WAI")
-        measure_time = np.array(smu.query_ascii_values("FETC:ARR:TIME?"))
-        source_voltage = np.array(smu.query_ascii_values("FETC:ARR:SOUR?"))
-        voltage = np.array(smu.query_ascii_values("FETC:ARR:VOLT?"))
-        current = np.array(smu.query_ascii_values("FETC:ARR:CURR?"))
-        resistance = np.array(smu.query_ascii_values("FETC:ARR:RES?"))
+        smu.write("*OPC")
+    except Exception as e:
+        raise RuntimeError(f"Failed to configure or start SMU: {e}")
+
+    def wait_and_fetch():
+        try:
+            wait_smu_complete(smu, method, timeout, poll_interval)
+            data = fetch_smu_arrays(smu)
+        except Exception as e:
+            raise RuntimeError(f"Failed to fetch data from SMU: {e}")
+        return finish(*data) if finish else data
+
+    return _smu_executor.submit(wait_and_fetch)
+
+
+def start_smu_measurement(smu, params, method='poll', timeout=None, poll_interval=0.02):
+    """
+    Non-blocking counterpart of get_smu_measurement. Configures and starts the sweep, then returns immediately.
+
+    The caller may do other work (build the next waveform, save the previous scope trace, ...) but must not
+    talk to the SMU until the returned future is done.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): A dictionary containing configuration parameters for the SMU.
+    - method, timeout, poll_interval: Completion detection, see wait_smu_complete.
+
+    Returns:
+    - concurrent.futures.Future: Resolves to the same tuple of arrays as get_smu_measurement.
+
+    Raises:
+    - RuntimeError: If the SMU cannot be configured; fetch errors are raised by future.result().
+    """
+    return _start_smu(smu, configure_smu_sweep, params, method, timeout, poll_interval)
+
+
+def start_smu_list_measurement(smu, params, method='poll', timeout=None, poll_interval=0.02):
+    """
+    Non-blocking counterpart of get_smu_list_measurement, see start_smu_measurement.
+
+    Returns:
+    - concurrent.futures.Future: Resolves to the same tuple of arrays as get_smu_list_measurement.
+    """
+    return _start_smu(smu, configure_smu_list, params, method, timeout, poll_interval)
+
+
+# Maximum number of points accepted by SOUR:LIST:VOLT on the B29xx SMUs.
+SMU_LIST_MAX_POINTS = 2500
+
+
+def build_smu_segments(segments):
+    """
+    Compiles a list of sweep segments into a single voltage list for a LIST-mode acquisition.
+
+    Each segment is a dict and is either a ramp with 'start_voltage', 'stop_voltage' and 'points' (linear, both
+    end points included) or a hold with 'voltage' and 'points'. Every segment may carry its own
+    'compliance_current'.
+
+    Parameters:
+    - segments (list of dicts): The segments in the order they are sourced.
+
+    Returns:
+    - tuple: (voltages, bounds, compliances) where voltages is the concatenated np.ndarray, bounds a list of
+      (start, stop) index pairs, one per segment, and compliances the list of per-segment compliance currents
+      (None where a segment does not define one).
+
+    Raises:
+    - ValueError: If a segment is malformed or the list exceeds SMU_LIST_MAX_POINTS.
+
+    Examples:
+    - build_smu_segments([{'start_voltage': 0, 'stop_voltage': 2, 'points': 51},
+                          {'voltage': 0.1, 'points': 51}]) gives a 102-point list: a ramp followed by a read.
+    """
+    voltages = []
+    bounds = []
+    compliances = []
+    for i, segment in enumerate(segments):
+        points = int(segment['points'])
+        if points <= 0:
+            raise ValueError(f"Segment {i} must have a positive number of points.")
+        if 'voltage' in segment:
+            v = np.full(points, float(segment['voltage']))
+        elif 'start_voltage' in segment and 'stop_voltage' in segment:
+            v = np.linspace(float(segment['start_voltage']), float(segment['stop_voltage']), points)
+        else:
+            raise ValueError(f"Segment {i} needs either 'voltage' or 'start_voltage' and 'stop_voltage'.")
+        start = sum(len(x) for x in voltages)
+        voltages.append(v)
+        bounds.append((start, start + points))
+        compliance = segment.get('compliance_current')
+        compliances.append(float(compliance) if compliance is not None else None)
+
+    voltages = np.concatenate(voltages) if voltages else np.array([])
+    if not 0 < len(voltages) <= SMU_LIST_MAX_POINTS:
+        raise ValueError(f"Segment list has {len(voltages)} points, expected 1 to {SMU_LIST_MAX_POINTS}.")
+    return voltages, bounds, compliances
+
+
+def bipolar_sweep_segments(positive_voltage, negative_voltage, points, compliance_current,
+                           read_voltage=None, read_points=51):
+    """
+    Builds the segment list of a bipolar sweep 0 -> +V -> 0 -> -V -> 0, optionally followed by a read.
+
+    Parameters:
+    - positive_voltage (float): Maximum of the positive branch.
+    - negative_voltage (float): Minimum of the negative branch, given as a negative number.
+    - points (int): Number of points per ramp (four ramps in total).
+    - compliance_current (float or tuple): Compliance of the sweep, or a (positive, negative) pair.
+    - read_voltage (float): If given, a hold segment at this voltage is appended.
+    - read_points (int): Number of points of the read segment.
+
+    Returns:
+    - list of dicts: Segments for build_smu_segments / get_smu_segment_measurement.
+    """
+    if isinstance(compliance_current, (tuple, list)):
+        compliance_pos, compliance_neg = compliance_current
+    else:
+        compliance_pos = compliance_neg = compliance_current
+    segments = [
+        {'start_voltage': 0, 'stop_voltage': positive_voltage, 'points': points, 'compliance_current': compliance_pos},
+        {'start_voltage': positive_voltage, 'stop_voltage': 0, 'points': points, 'compliance_current': compliance_pos},
+        {'start_voltage': 0, 'stop_voltage': negative_voltage, 'points': points, 'compliance_current': compliance_neg},
+        {'start_voltage': negative_voltage, 'stop_voltage': 0, 'points': points, 'compliance_current': compliance_neg},
+    ]
+    if read_voltage is not None:
+        segments.append({'voltage': read_voltage, 'points': read_points, 'compliance_current': compliance_pos})
+    return segments
+
+
+def group_smu_segments(params):
+    """
+    Splits a multi-segment protocol into the acquisitions it is run as.
+
+    The B29xx applies a single current compliance to a whole list, so consecutive segments with the same
+    compliance are sourced as one LIST acquisition and every change of compliance starts a new one.
+
+    Parameters:
+    - params (dict): A dictionary with 'segments', 'NPLC' and optionally a default 'compliance_current'.
+
+    Returns:
+    - list of dicts: The params of each acquisition, holding its segments and their common 'compliance_current'.
+
+    Raises:
+    - ValueError: If a segment has neither its own 'compliance_current' nor a default in params.
+    """
+    groups = []
+    for i, segment in enumerate(params['segments']):
+        compliance = segment.get('compliance_current')
+        if compliance is None:
+            compliance = params.get('compliance_current')
+        if compliance is None:
+            raise ValueError(f"Segment {i} needs a 'compliance_current' or a default in params.")
+        if groups and groups[-1]['compliance_current'] == float(compliance):
+            groups[-1]['segments'].append(segment)
+        else:
+            groups.append(dict(params, segments=[segment], compliance_current=float(compliance)))
+    return groups
+
+
+def configure_smu_segments(smu, params):
+    """
+    Writes a LIST acquisition of segments sharing one compliance current to the SMU without starting it.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): A dictionary with 'segments' (see build_smu_segments), 'NPLC' and an optional
+      'compliance_current' used for segments that do not define their own.
+
+    Returns:
+    - int: The trigger count programmed into the SMU, i.e. the number of points that will be acquired.
+
+    Raises:
+    - ValueError: If the segments have different compliance currents; run them with get_smu_segment_measurement.
+    """
+    groups = group_smu_segments(params)
+    if len(groups) != 1:
+        raise ValueError("The segments of one LIST acquisition must share a compliance current.")
+    voltages, _, _ = build_smu_segments(params['segments'])
+    count = len(voltages)
+    v_str = ', '.join(f'{x}' for x in voltages)
+    smu.write("SOUR:FUNC VOLT")
+    smu.write("SOUR:VOLT:MODE LIST")
+    smu.write("SOUR:LIST:RANG AUTO")
+    smu.write(f"SOUR:LIST:VOLT {v_str}")
+    smu.write("SENS:FUNC 'CURR','VOLT','RES'")
+    smu.write(f"SENS:CURR:NPLC {params['NPLC']}")
+    smu.write(f"SENS:CURR:PROT {groups[0]['compliance_current']}")
+    configure_smu_current_range(smu, params)
+    smu.write("TRIG:SOUR AINT")
+    smu.write(f"TRIG:COUN {count}")
+    return count
+
+
+def split_smu_segments(params, data):
+    """
+    Splits the arrays of a multi-segment acquisition into one tuple per segment.
+
+    Parameters:
+    - params (dict): The parameters the acquisition was run with (see get_smu_segment_measurement).
+    - data (tuple of np.ndarray): time, source voltage, voltage, current and resistance of the whole protocol.
+
+    Returns:
+    - list of tuples: One (time, source voltage, voltage, current, resistance) tuple per segment.
+    """
+    _, bounds, _ = build_smu_segments(params['segments'])
+    return [tuple(array[start:stop] for array in data) for start, stop in bounds]
+
+
+def smu_segment_compliance(params, results):
+    """
+    Tells which segments of a multi-segment measurement ran into their compliance current.
+
+    Parameters:
+    - params (dict): The parameters the measurement was run with.
+    - results (list of tuples): The per-segment data, see split_smu_segments.
+
+    Returns:
+    - list of bool: One flag per segment, True if its current reached the compliance (within 1 %, the SMU
+      clamps the current at the limit).
+    """
+    flags = []
+    for group in group_smu_segments(params):
+        for _ in group['segments']:
+            current = results[len(flags)][3]
+            flags.append(bool(np.any(np.abs(current) >= 0.99 * group['compliance_current'])))
+            if flags[-1]:
+                print(f"Segment {len(flags) - 1} reached its compliance of {group['compliance_current']} A")
+    return flags
+
+
+def get_smu_segment_measurement(smu, params):
+    """
+    Runs a multi-segment protocol (e.g. bipolar sweep followed by a read) without switching the output off.
+
+    Consecutive segments with the same compliance current run as one LIST acquisition (see group_smu_segments),
+    so the SMU enforces the compliance of every segment. Between acquisitions the output stays on and is held at
+    the last voltage of the previous one (see hold_smu_output).
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): A dictionary with 'segments', 'NPLC' and optionally a default 'compliance_current'.
+
+    Returns:
+    - list of tuples: One (time, source voltage, voltage, current, resistance) tuple of arrays per segment.
+
+    Raises:
+    - ValueError: If a segment is malformed or has no compliance current.
+    - RuntimeError: If there is a failure in setting up the SMU or fetching the data.
+    """
+    groups = group_smu_segments(params)
+    chunks = []
+    try:
+        for k, group in enumerate(groups):
+            configure_smu_segments(smu, group)
+            smu.write("INIT")
+            smu.write("*WAI")
+            last = k == len(groups) - 1
+            chunks.append(fetch_smu_arrays(smu, output_off=last))
+            if not last:
+                hold_smu_output(smu, build_smu_segments(group['segments'])[0][-1])
+    except Exception as e:
         smu.write("OUTP1 OFF")
+        raise RuntimeError(f"Failed to configure or fetch data from SMU: {e}")
+
+    return split_smu_segments(params, tuple(np.concatenate(x) for x in zip(*chunks)))
+
+
+def start_smu_segment_measurement(smu, params, method='poll', timeout=None, poll_interval=0.02):
+    """
+    Non-blocking counterpart of get_smu_segment_measurement, see start_smu_measurement. A protocol with several
+    compliance currents is run entirely in the worker thread.
+
+    Returns:
+    - concurrent.futures.Future: Resolves to the list of per-segment tuples.
+    """
+    if len(group_smu_segments(params)) > 1:
+        return _smu_executor.submit(get_smu_segment_measurement, smu, params)
+    return _start_smu(smu, configure_smu_segments, params, method, timeout, poll_interval,
+                      lambda *data: split_smu_segments(params, data))
+
+
+def detect_threshold_switching(voltage, current, switching_resistance=None, current_jump=10, current_floor=1e-6,
+                               compliance_current=None):
+    """
+    Finds the first point of a sweep at which the device has switched into its low-resistance state.
+
+    A point counts as switched if its resistance V/I is at or below switching_resistance, if the current jumps by
+    more than current_jump times the previous point while exceeding current_floor, or if it reaches 90 % of the
+    compliance current.
+
+    Parameters:
+    - voltage, current (np.ndarray): Measured voltage and current of the sweep, in acquisition order.
+    - switching_resistance (float): Resistance below which the device is considered switched; None to disable.
+    - current_jump (float): Minimum ratio between consecutive currents that counts as a switching event.
+    - current_floor (float): Currents below this value are ignored by the jump criterion (noise).
+    - compliance_current (float): Compliance of the sweep; None to disable.
+
+    Returns:
+    - int or None: Index of the first switched point, None if the device did not switch.
+    """
+    current = np.abs(np.asarray(current, dtype=float))
+    voltage = np.abs(np.asarray(voltage, dtype=float))
+    for k in range(len(current)):
+        if compliance_current is not None and current[k] >= 0.9 * float(compliance_current):
+            return k
+        if switching_resistance is not None and current[k] > current_floor \
+                and voltage[k] / current[k] <= switching_resistance:
+            return k
+        if k > 0 and current[k] > current_floor and current[k] > current_jump * max(current[k - 1], 1e-15):
+            return k
+    return None
+
+
+# Time one chunk of an early-abort sweep costs on top of its points: reconfiguring the list, arming, waiting for
+# the completion and the five FETC queries, in seconds (about 0.1 s on the B29xx over USB).
+SMU_CHUNK_OVERHEAD = 0.1
+
+# Mains frequency the NPLC integration time is based on, in Hz.
+SMU_LINE_FREQUENCY = 50
+
+
+def early_abort_chunk_points(params, overhead=SMU_CHUNK_OVERHEAD, line_frequency=SMU_LINE_FREQUENCY):
+    """
+    Number of points per chunk that minimises the expected duration of an early-abort sweep.
+
+    With N up-ramp points of duration t and a chunk overhead o, chunks of c points cost N/c * o in overhead, and
+    on average c/2 points are acquired after the switching point. The sum is smallest for c = sqrt(2 N o / t),
+    e.g. 23 points for 51 points at NPLC 1 and 50 Hz. Without switching the chunking costs N/c * o more than the
+    single sweep; a switch halfway saves the rest of the up-ramp and the whole return branch.
+
+    Parameters:
+    - params (dict): The sweep parameters, with 'points' and 'NPLC'.
+    - overhead (float): Time of one chunk on top of its points, in seconds.
+    - line_frequency (float): Mains frequency, in Hz.
+
+    Returns:
+    - int: Points per chunk, between 2 and the number of points.
+    """
+    points = int(params['points'])
+    point_time = float(params['NPLC']) / line_frequency
+    chunk = int(round(np.sqrt(2 * points * overhead / point_time)))
+    return min(max(chunk, 2), points)
+
+
+def get_smu_sweep_early_abort(smu, params, chunk_points=None, ramp_down_points=5, switching_resistance=None,
+                              current_jump=10, current_floor=1e-6):
+    """
+    Runs the up-ramp of a sweep in chunks and stops as soon as threshold switching is detected.
+
+    Each chunk is a short LIST acquisition; the output stays on and is held at the chunk's end voltage between
+    chunks (see hold_smu_output). Once a chunk shows switching (see detect_threshold_switching, which also sees
+    the last point of the previous chunk so that a jump across two chunks is found) the remaining up-ramp is
+    skipped and the voltage is ramped back to the start in ramp_down_points steps. Without switching the sweep
+    completes as configured, including the return branch of a 'DOUB' sweep.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device resource.
+    - params (dict): The usual sweep parameters ('start_voltage', 'stop_voltage', 'points', 'sweep_direction',
+      'NPLC', 'compliance_current').
+    - chunk_points (int): Number of sweep points acquired per chunk; None sizes the chunks to amortise their
+      overhead, see early_abort_chunk_points.
+    - ramp_down_points (int): Number of points of the ramp back to start_voltage after switching.
+    - switching_resistance, current_jump, current_floor: Detection criteria, see detect_threshold_switching.
+
+    Returns:
+    - tuple: (data, switching_index) where data is the (time, source voltage, voltage, current, resistance) tuple
+      of everything that was acquired and switching_index the index of the first switched point or None.
+
+    Raises:
+    - RuntimeError: If there is a failure in setting up the SMU or fetching the data.
+    """
+    start = float(params['start_voltage'])
+    stop = float(params['stop_voltage'])
+    up_ramp = np.linspace(start, stop, int(params['points']))
+    compliance = params['compliance_current']
+    if chunk_points is None:
+        chunk_points = early_abort_chunk_points(params)
+
+    def run_ramp(v_from, v_to, points, output_off):
+        chunk_params = {'segments': [{'start_voltage': v_from, 'stop_voltage': v_to, 'points': points}],
+                        'NPLC': params['NPLC'], 'compliance_current': compliance}
+        configure_smu_segments(smu, chunk_params)
+        smu.write("INIT")
         smu.write("*WAI")
+        data = fetch_smu_arrays(smu, output_off=output_off)
+        if not output_off:
+            hold_smu_output(smu, v_to)
+        return data
+
+    chunks = []
+    switching_index = None
+    try:
+        for a in range(0, len(up_ramp), chunk_points):
+            b = min(a + chunk_points, len(up_ramp))
+            data = run_ramp(up_ramp[a], up_ramp[b - 1], b - a, output_off=False)
+            # the last point of the previous chunk, if any, comes first
+            carried = 1 if chunks else 0
+            voltage = np.concatenate([chunks[-1][2][-1:], data[2]]) if carried else data[2]
+            current = np.concatenate([chunks[-1][3][-1:], data[3]]) if carried else data[3]
+            chunks.append(data)
+            k = detect_threshold_switching(voltage, current, switching_resistance, current_jump, current_floor,
+                                           compliance)
+            if k is not None:
+                switching_index = a + k - carried
+                print(f"Threshold switching detected at {voltage[k]:.3f} V, ramping down")
+                chunks.append(run_ramp(up_ramp[b - 1], start, max(int(ramp_down_points), 2), output_off=True))
+                break
+        else:
+            if params['sweep_direction'] == "DOUB":
+                chunks.append(run_ramp(stop, start, len(up_ramp), output_off=True))
+            else:
+                smu.write("OUTP1 OFF")
+                smu.write("*WAI")
     except Exception as e:
+        smu.write("OUTP1 OFF")
         raise RuntimeError(f"Failed to configure or fetch data from SMU: {e}")
 
-    return measure_time, source_voltage, voltage, current, resistance
+    data = tuple(np.concatenate(x) for x in zip(*chunks))
+    return data, switching_index
 
 
-def relays(ser, status):
+# Relay commands of each device. The four relay pins of RF_switch.ino drive two latching relays: pins 0/1 route
+# device 0 to the AWG ('switch') or the SMU ('measure'), pins 2/3 do the same for device 1.
+RELAY_DEVICE_MAP = {
+    0: {'switch': 'ON0', 'measure': 'ON1', 'off': 'OFF0'},
+    1: {'switch': 'ON2', 'measure': 'ON3', 'off': 'OFF2'},
+}
+
+# Time the relays need to switch and settle, waited after every command on firmware without acknowledgements.
+RELAY_SETTLE_TIME = 0.5
+
+# Connections that did not acknowledge a relay command, see relays().
+_relays_without_ack = weakref.WeakSet()
+
+
+def relays(ser, status, timeout=1.0, device=None):
     """
     Control the on/off status of relays connected to various devices.
 
+    ser may also be a RelayController, which skips the command if the relay is already in the requested position.
+
+    The command is terminated with a newline and the function blocks until the ESP32 acknowledges that the relay
+    has switched and settled ('ACK <command>'). Replies still waiting in the input buffer are discarded before the
+    command is sent, so a late acknowledgement of an earlier command cannot acknowledge this one.
+
+    If no acknowledgement arrives within the timeout (e.g. firmware without acknowledgements), a warning is printed
+    and the function returns False. From then on the connection falls back to waiting RELAY_SETTLE_TIME after
+    every command and the relay counts as switched once that time has passed, until an acknowledgement shows up
+    again.
+
     Args:
         ser (serial.Serial): The serial connection object.
         status (str): The operation mode for the relays ('switch', 'measure').
+        timeout (float): Maximum time in seconds to wait for the acknowledgement.
+        device (int): Device whose relay is switched, a key of RELAY_DEVICE_MAP; defaults to device 0, or to the
+            device a RelayController is bound to.
+
+    Returns:
+        bool: True if the relay is in the requested position: the command was acknowledged, or the connection is in
+            the fallback and RELAY_SETTLE_TIME has passed.
 
     Raises:
-        ValueError: If an unknown status is passed.
+        ValueError: If an unknown status or device is passed.
     """
-    commands = {
-        'switch': ['ON0'],
-        'measure': ['ON1'],
-        'off':['OFF0']
-    }
+    if isinstance(ser, RelayController):
+        return ser.set(status, timeout, device)
+    if device is None:
+        device = 0
+    if device not in RELAY_DEVICE_MAP:
+        raise ValueError("Unknown device: '{}'".format(device))
+    commands = RELAY_DEVICE_MAP[device]
 
     if status not in commands:
         raise ValueError("Unknown status: '{}'".format(status))
-    
-    for command in commands[f'{status}']:
-        if status != 'off':
-            ser.write(command.encode())
+
+    command = commands[status]
+    acknowledged = True
+    if status != 'off':
+        if hasattr(ser, 'reset_input_buffer'):
+            ser.reset_input_buffer()
+        ser.write(f'{command}\n'.encode())
+        if ser in _relays_without_ack:
+            time.sleep(RELAY_SETTLE_TIME)
+            # firmware that acknowledges again leaves the fallback
+            if wait_relay_ack(ser, command, 0.01, warn=False):
+                _relays_without_ack.discard(ser)
+        else:
+            acknowledged = wait_relay_ack(ser, command, timeout)
+            if not acknowledged:
+                print(f"Waiting {RELAY_SETTLE_TIME} s after every relay command from now on")
+                _relays_without_ack.add(ser)
+    if not isinstance(ser, SerialWorker):
+        # a SerialWorker records the relay events in its event log instead
         print(f"Relay status set to '{status}' with {command}")
-        time.sleep(0.5)
+    return acknowledged
+
+
+def relays_to_smu(ser, retries=1):
+    """
+    Switches the relays to the SMU before a measurement, sending the command again if it is not acknowledged.
+
+    On firmware without acknowledgements the first command times out and puts the connection into the fallback of
+    relays(), so the command sent again is accepted once RELAY_SETTLE_TIME has passed.
+
+    Parameters:
+    - ser (serial.Serial or RelayController): The connection to the ESP32, see relays(); None for a setup without
+      relays, where the SMU is always connected and nothing is switched.
+    - retries (int): Number of times the command is sent again.
+
+    Raises:
+    - RuntimeError: If the relay is not in position after the retries; the device may still be connected to the
+      AWG.
+    """
+    if ser is None:
+        return
+    for attempt in range(retries + 1):
+        if relays(ser, 'measure'):
+            return
+        if attempt < retries:
+            print("Relay did not acknowledge the switch to the SMU, sending the command again")
+    raise RuntimeError("Relay did not acknowledge the switch to the SMU, the measurement is not started")
+
+
+def read_esp32_line(ser, accept, timeout):
+    """
+    Reads lines from the ESP32 until one satisfies accept, discarding all others.
+
+    Parameters:
+    - ser (serial.Serial): The serial connection object.
+    - accept (callable): Called with each stripped line, returns True for the awaited reply.
+    - timeout (float): Maximum time in seconds to wait.
+
+    Returns:
+    - str or None: The accepted line, None on timeout.
+    """
+    old_timeout = ser.timeout
+    t_end = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = t_end - time.monotonic()
+            if remaining <= 0:
+                return None
+            ser.timeout = remaining
+            line = ser.readline().decode(errors='replace').strip()
+            if line and accept(line):
+                return line
+    finally:
+        ser.timeout = old_timeout
+
+
+def wait_relay_ack(ser, command, timeout=1.0, warn=True):
+    """
+    Reads lines from the ESP32 until it acknowledges command.
+
+    Parameters:
+    - ser (serial.Serial): The serial connection object.
+    - command (str): The command that was sent, e.g. 'ON0'.
+    - timeout (float): Maximum time in seconds to wait.
+    - warn (bool): Print a warning on timeout.
+
+    Returns:
+    - bool: True if 'ACK <command>' was received, False on timeout.
+
+    Raises:
+    - ValueError: If the firmware rejected the command.
+    """
+    line = read_esp32_line(ser, lambda x: x in (f'ACK {command}', f'ERR {command}'), timeout)
+    if line is None:
+        if warn:
+            print(f"No acknowledgement for relay command {command} within {timeout} s")
+        return False
+    if line.startswith('ERR'):
+        raise ValueError(f"ESP32 rejected relay command {command}")
+    return True
+
+
+# Relay program actions and their firmware step codes, see runProgram() in RF_switch.ino.
+RELAY_PROGRAM_ACTIONS = {'pulse': 'ON', 'high': 'HI', 'low': 'LO'}
+RELAY_PROGRAM_MAX_STEPS = 32
+
+
+def build_relay_program(steps):
+    """
+    Encodes a list of relay actions as a PRG frame for the ESP32.
+
+    Parameters:
+    - steps (list of tuples): ('pulse', i) pulses relay i like relays() does, ('high', i) / ('low', i) set pin i,
+      ('wait', seconds) waits with microsecond resolution. A wait is counted from the end of the previous wait, or
+      from the moment the last pulse has settled (pulses take 120 ms), so waits add up without drift.
+
+    Returns:
+    - str: The frame, e.g. 'PRG ON0;W2000;HI1;W50;LO1'.
+
+    Raises:
+    - ValueError: If a step is unknown or the program is too long.
+
+    Examples:
+    - build_relay_program([('pulse', 0), ('wait', 2e-3), ('pulse', 1)]) returns 'PRG ON0;W2000;ON1'.
+    """
+    if not 0 < len(steps) <= RELAY_PROGRAM_MAX_STEPS:
+        raise ValueError(f"A relay program needs 1 to {RELAY_PROGRAM_MAX_STEPS} steps, got {len(steps)}.")
+    codes = []
+    for action, value in steps:
+        if action == 'wait':
+            if value < 0:
+                raise ValueError("Relay program waits must be non-negative.")
+            codes.append(f'W{int(round(value * 1e6))}')
+        elif action in RELAY_PROGRAM_ACTIONS:
+            if int(value) not in range(4):
+                raise ValueError(f"Unknown relay channel {value}, expected 0 to 3.")
+            codes.append(f'{RELAY_PROGRAM_ACTIONS[action]}{int(value)}')
+        else:
+            raise ValueError(f"Unknown relay program action '{action}'.")
+    return 'PRG ' + ';'.join(codes)
+
+
+def run_relay_program(ser, steps, timeout=None):
+    """
+    Sends a relay program to the ESP32, which executes it with its own timer, and waits for completion.
+
+    Parameters:
+    - ser (serial.Serial or RelayController): The serial connection object.
+    - steps (list of tuples): The program, see build_relay_program.
+    - timeout (float): Maximum time in seconds to wait for completion; by default the programmed duration
+      plus one second.
+
+    Returns:
+    - list of float: Start time of every step on the ESP32 clock, in seconds after the program start.
+
+    Raises:
+    - TimeoutError: If the ESP32 does not report completion in time.
+    - ValueError: If the program is invalid or was rejected by the firmware.
+    """
+    frame = build_relay_program(steps)
+    if timeout is None:
+        timeout = sum(v for a, v in steps if a == 'wait') + 0.15 * sum(a == 'pulse' for a, v in steps) + 1
+    ser.write(f'{frame}\n'.encode())
+    line = read_esp32_line(ser, lambda x: x.startswith('DONE') or x.startswith('ERR PRG'), timeout)
+    if line is None:
+        raise TimeoutError(f"ESP32 did not complete the relay program within {timeout} s")
+    if line.startswith('ERR'):
+        raise ValueError(f"ESP32 rejected the relay program: {line}")
+    if isinstance(ser, RelayController):
+        # the latched positions follow the last pulse of each relay in the program
+        for action, channel in steps:
+            for device, commands in RELAY_DEVICE_MAP.items():
+                for status in ('switch', 'measure'):
+                    if action == 'pulse' and commands[status] == f'ON{int(channel)}':
+                        ser.positions[device] = status
+    print(f"Relay program executed: {frame}")
+    return [int(t) * 1e-6 for t in line[len('DONE'):].strip().split(',')]
+
+
+class RelayController:
+    """
+    Wraps the ESP32 serial connection and tracks the position of the latching relays, so that repeated requests
+    for the position a relay is already in cost nothing.
+
+    It can be passed to relays(), measure_with_smu() etc. wherever the serial connection is expected; all other
+    attributes are forwarded to the serial connection. A controller created with parent (see for_device()) is bound
+    to another device of RELAY_DEVICE_MAP and shares the connection, the tracked positions, the lock and the
+    counters of its parent.
+
+    Skipping repeated requests makes consecutive operations that need the same position free. RelayScheduler
+    orders pulses and reads so that they come together, within the order each device needs: the pulses with no
+    read between them run as one batch, and a pulse on one device shares the relay positions with a read on
+    another.
+
+    Usage:
+    - esp32 = RelayController(connect_to_esp32('COM4', 115200))
+    - relays(esp32, 'switch')  # pulses the relay
+    - relays(esp32, 'switch')  # free, the relay is already in the switch position
+    - measure_with_smu(smu, esp32.for_device(1), smu_read_params, filename)  # read device 1
+
+    Parameters:
+    - ser (serial.Serial): The ESP32 connection; ignored if parent is given.
+    - position (str): Known position of the device, None if unknown.
+    - device (int): The device the controller is bound to, a key of RELAY_DEVICE_MAP.
+    - parent (RelayController): Controller whose connection and state are shared.
+
+    Attributes:
+    - position (str or None): Position of the bound device, 'switch' or 'measure', None while unknown (the first
+      request always switches).
+    - positions (dict): Positions of all devices.
+    - switch_count (int): Number of relay commands actually sent.
+    - skipped_count (int): Number of requests answered from the tracked position.
+    """
+
+    def __init__(self, ser=None, position=None, device=0, parent=None):
+        if device not in RELAY_DEVICE_MAP:
+            raise ValueError("Unknown device: '{}'".format(device))
+        self.device = device
+        if parent is None:
+            self.ser = ser
+            self.positions = {}
+            self._counts = {'switch': 0, 'skipped': 0}
+            self._lock = threading.RLock()
+        else:
+            self.ser = parent.ser
+            self.positions = parent.positions
+            self._counts = parent._counts
+            self._lock = parent._lock
+        if position is not None or device not in self.positions:
+            self.positions[device] = position
+
+    @property
+    def switch_count(self):
+        return self._counts['switch']
+
+    @property
+    def skipped_count(self):
+        return self._counts['skipped']
+
+    @property
+    def position(self):
+        return self.positions.get(self.device)
+
+    @position.setter
+    def position(self, value):
+        self.positions[self.device] = value
+
+    def for_device(self, device):
+        """Returns a controller for device sharing this one's connection, tracked positions and counters."""
+        return RelayController(device=device, parent=self)
+
+    def set(self, status, timeout=1.0, device=None):
+        """
+        Moves the relay of device (default: the bound device) to status ('switch', 'measure' or 'off') unless it
+        is already there.
+
+        Returns:
+        - bool: True if the relay is known to be in the requested position.
+        """
+        device = self.device if device is None else device
+        with self._lock:
+            if status == 'off' or status != self.positions.get(device):
+                acknowledged = relays(self.ser, status, timeout, device)
+                if status != 'off':
+                    self._counts['switch'] += 1
+                    # without acknowledgement the position is uncertain, so the next request switches again
+                    self.positions[device] = status if acknowledged else None
+                return acknowledged
+            self._counts['skipped'] += 1
+            return True
+
+    def relay_async(self, status, device=None):
+        """
+        Non-blocking set() for a connection through a SerialWorker. The position of the device is unknown until
+        the ESP32 acknowledges the command, so a request made meanwhile switches again rather than assuming it.
+
+        Returns:
+        - concurrent.futures.Future: Resolves to True once the relay is in the requested position.
+        """
+        device = self.device if device is None else device
+        with self._lock:
+            if status != 'off' and status == self.positions.get(device):
+                self._counts['skipped'] += 1
+                future = Future()
+                future.set_result(True)
+                return future
+            future = self.ser.relay_async(status, device)
+            if status == 'off':
+                return future
+            self._counts['switch'] += 1
+            self.positions[device] = None
+
+        def acknowledged(done):
+            # a later request that has already set the position wins
+            if done.exception() is None and self.positions.get(device) is None:
+                self.positions[device] = status
+
+        future.add_done_callback(acknowledged)
+        return future
+
+    def invalidate(self):
+        """Forgets the tracked positions, e.g. after the board was reset or a relay was switched by hand."""
+        self.positions.clear()
+
+    def __getattr__(self, name):
+        if name in ('ser', 'positions', '_counts', '_lock'):
+            raise AttributeError(name)
+        return getattr(self.ser, name)
+
+
+class SerialWorker:
+    """
+    Owns the ESP32 serial port in background threads: commands are queued without blocking, replies are parsed
+    as they arrive and every relay actuation is recorded with timestamps in an event log.
+
+    The worker offers the write()/readline() interface of serial.Serial, so it can be passed to relays(),
+    RelayController, run_relay_program() and the measure_with_smu functions unchanged. relay_async() switches a
+    relay without blocking at all (through RelayController.relay_async to keep the tracked position); its
+    acknowledgement only resolves the returned future and never reaches readline().
+
+    Events are kept in self.events as (timestamp, source, event, detail) tuples and, if event_file is given,
+    appended to that file with record_event. The events are
+    - 'sent' when a command has been written to the port,
+    - 'ack' / 'err' when the firmware acknowledges or rejects it, with the latency since 'sent' in ms,
+    - 'rx' for any other line from the firmware (READY, DONE, PONG, ...),
+    plus whatever the acquisition code logs with mark(), e.g. the start of the following SMU read.
+
+    Usage:
+    - esp32 = RelayController(SerialWorker(connect_to_esp32('COM4', 115200), File_Path + 'events.csv'))
+    - relays(esp32, 'switch')
+    - esp32.mark('trigger')
+
+    Parameters:
+    - ser (serial.Serial): The open serial connection; it must not be used directly while the worker runs.
+    - event_file (str): Optional CSV file the events are appended to.
+    """
+
+    def __init__(self, ser, event_file=None):
+        self.ser = ser
+        self.event_file = event_file
+        self.events = []
+        self.timeout = None
+        self._outgoing = queue.Queue()
+        self._lines = deque(maxlen=1000)
+        self._line_ready = threading.Condition()
+        self._pending = []   # (command, sent time, future, echo) waiting for their ACK
+        self._pending_lock = threading.Lock()
+        self._running = True
+        ser.timeout = 0.05
+        self._writer = threading.Thread(target=self._write_loop, name='esp32-writer', daemon=True)
+        self._reader = threading.Thread(target=self._read_loop, name='esp32-reader', daemon=True)
+        self._writer.start()
+        self._reader.start()
+
+    def mark(self, event, detail='', source='host'):
+        """Records an event of the acquisition code on the same clock as the relay events."""
+        entry = (time.time(), source, event, detail)
+        self.events.append(entry)
+        if self.event_file:
+            record_event(self.event_file, *entry)
+
+    def send(self, command, echo=False):
+        """
+        Queues command and returns at once.
+
+        Parameters:
+        - command (str): The command, without newline.
+        - echo (bool): Also pass the reply to readline(), for callers that wait for it like a serial port. Without
+          echo the reply only resolves the future.
+
+        Returns:
+        - concurrent.futures.Future: Resolves to True on 'ACK <command>'; raises ValueError on 'ERR <command>'.
+          Commands without acknowledgement (PING, PRG) are resolved with the reply line instead.
+        """
+        future = Future()
+        self._outgoing.put((command, future, echo))
+        return future
+
+    def relay_async(self, status, device=0):
+        """
+        Switches the relay of device to status without waiting; returns the future of the command. Use
+        RelayController.relay_async instead when the worker is wrapped in a RelayController, so that it tracks
+        the position.
+        """
+        return self.send(RELAY_DEVICE_MAP[device][status])
+
+    def write(self, data):
+        for line in bytes(data).decode().splitlines():
+            if line.strip():
+                self.send(line.strip(), echo=True)
+        return len(data)
+
+    def readline(self):
+        t_end = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._line_ready:
+            while not self._lines:
+                remaining = None if t_end is None else t_end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return b''
+                self._line_ready.wait(remaining)
+            return self._lines.popleft()
+
+    def reset_input_buffer(self):
+        with self._line_ready:
+            self._lines.clear()
+
+    @property
+    def is_open(self):
+        return self._running and self.ser.is_open
+
+    def close(self):
+        """Stops the worker threads once the queued commands are written; the serial port stays open."""
+        self._outgoing.put(None)
+        self._writer.join()
+        self._running = False
+        self._reader.join()
+
+    def _write_loop(self):
+        while True:
+            item = self._outgoing.get()
+            if item is None:
+                return
+            command, future, echo = item
+            sent = time.monotonic()
+            with self._pending_lock:
+                self._pending.append((command, sent, future, echo))
+            self.ser.write(f'{command}\n'.encode())
+            self.mark('sent', command, source='esp32')
+
+    def _read_loop(self):
+        while self._running:
+            line = self.ser.readline().decode(errors='replace').strip()
+            if not line or not self._dispatch(line):
+                continue
+            with self._line_ready:
+                self._lines.append((line + '\r\n').encode())
+                self._line_ready.notify_all()
+
+    def _dispatch(self, line):
+        # resolves the future the line answers; returns True if readline() should see the line
+        kind, _, detail = line.partition(' ')
+        with self._pending_lock:
+            match = None
+            for entry in self._pending:
+                command = entry[0]
+                if (kind in ('ACK', 'ERR') and detail == command) \
+                        or (kind == 'ERR' and command.startswith('PRG') and detail.startswith('PRG')) \
+                        or (kind == 'PONG' and command == 'PING') \
+                        or (kind == 'DONE' and command.startswith('PRG')):
+                    match = entry
+                    break
+            if match is not None:
+                self._pending.remove(match)
+        if match is None:
+            self.mark('rx', line, source='esp32')
+            return True
+        command, sent, future, echo = match
+        latency = f'{command} {(time.monotonic() - sent) * 1e3:.1f} ms'
+        if kind == 'ERR':
+            self.mark('err', latency, source='esp32')
+            future.set_exception(ValueError(f"ESP32 rejected command {command}"))
+        else:
+            self.mark('ack' if kind == 'ACK' else 'rx', latency if kind == 'ACK' else line, source='esp32')
+            future.set_result(True if kind == 'ACK' else line)
+        return echo
+
+
+# One worker per instrument prepared before a shot: the AWG upload, the scope setup and the relay switch.
+_shot_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix='shot')
+
+
+def prepare_shot(awg, scope, ser, sequence_config, scope_settings, waveforms=None, relay='switch'):
+    """
+    Prepares the next shot on the AWG, the oscilloscope and the relays in parallel, and returns once all three are
+    ready to fire. The preparation takes as long as the slowest of them instead of their sum.
+
+    Parameters:
+    - awg (ActiveTechnologiesAWG4000): The AWG, the waveforms are uploaded and the sequence is set up on it.
+    - scope (visa.Resource): The oscilloscope, configured with setup_oscilloscope.
+    - ser (serial.Serial): The ESP32 connection, or a RelayController.
+    - sequence_config (list): Sequence entries for setup_sequences.
+    - scope_settings (dict): Settings for setup_oscilloscope; None keeps the current ones.
+    - waveforms (dict): Waveforms to upload by name, e.g. {"SET": SET}; None if they are already on the AWG.
+    - relay (str): Relay status, 'switch' to route the AWG to the device.
+
+    Raises:
+    - RuntimeError: If any of the preparations failed; the others have finished by then.
+
+    Examples:
+    - prepare_shot(awg, scope, esp32, [{"number": 1, "waveform": "SET"}], SET_settings, {"SET": SET})
+    """
+    def prepare_awg():
+        for name, waveform in (waveforms or {}).items():
+            awg.waveforms[name] = waveform
+        setup_sequences(awg, sequence_config)
+
+    futures = {'AWG': _shot_executor.submit(prepare_awg),
+               'relay': _shot_executor.submit(relays, ser, relay)}
+    if scope_settings is not None:
+        futures['oscilloscope'] = _shot_executor.submit(setup_oscilloscope, scope, scope_settings)
+    errors = []
+    for name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    if errors:
+        print(f"Error preparing the shot: {'; '.join(errors)}")
+        raise RuntimeError(f"Failed to prepare the shot: {'; '.join(errors)}")
 
 
 def trigger(scope, awg, timeout=0.2, poll_interval=0.05):
@@ -529,13 +1730,17 @@ def trigger_endurance(scope, awg, timeout=0.2, poll_interval=0.05):
             break
 
 
-def measure_with_smu(smu, ser, params, filename):
+def measure_with_smu(smu, ser, params, filename, last_resistance=None):
     """
     Activates relays for measurement, configures the SMU based on provided parameters, and retrieves measurement data.
 
+    If last_resistance is given, the current range is fixed to the one predicted from it and the stop voltage
+    (no range changes during the read); the measurement is repeated with auto range only if a reading overflows.
+
     Parameters:
     - smu (visa.Resource): The SMU device to be used for the measurements.
     - params (dict): A dictionary containing parameters for the SMU configuration.
+    - last_resistance (float): Last known resistance of the device, e.g. the previous verify read.
 
     Returns:
     - pandas.DataFrame: DataFrame containing the measurement data retrieved from the SMU.
@@ -544,11 +1749,20 @@ def measure_with_smu(smu, ser, params, filename):
     - Exception: Generic exceptions caught from underlying functions with an explanation.
     """
     try:
-        relays(ser, 'measure')
-        time.sleep(0.1)
-        measure_time, source_voltage, voltage, current, resistance = get_smu_measurement(smu, params)
-        np.savez_compressed(filename, time=measure_time, source_voltage=source_voltage, voltage=voltage,
-                            current=current, resistance=resistance)
+        relays_to_smu(ser)
+        current_range = None
+        if last_resistance is not None:
+            v_max = max(abs(float(params['start_voltage'])), abs(float(params['stop_voltage'])))
+            current_range = predict_smu_current_range(last_resistance, v_max)
+        if current_range is not None:
+            measure_time, source_voltage, voltage, current, resistance = get_smu_measurement(
+                smu, dict(params, current_range=current_range))
+            if smu_current_out_of_range(current, current_range):
+                print(f"Reading out of the {current_range} A range, repeating with auto range")
+                current_range = None
+        if current_range is None:
+            measure_time, source_voltage, voltage, current, resistance = get_smu_measurement(smu, params)
+        save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance)
         
         # Calculate the average of the middle 10 resistance values
         mid_index = len(resistance) // 2
@@ -575,11 +1789,10 @@ def measure_with_smu_list(smu, ser, params, filename):
     - Exception: Generic exceptions caught from underlying functions with an explanation.
     """
     try:
-        relays(ser, 'measure')
+        relays_to_smu(ser)
         time_now = datetime.now()
         measure_time, source_voltage, voltage, current, resistance = get_smu_list_measurement(smu, params)
-        np.savez_compressed(filename, time=measure_time, source_voltage=source_voltage, voltage=voltage,
-                            current=current, resistance=resistance)
+        save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance)
 
         # Calculate the average of the middle 10 resistance values
         mid_index = len(resistance) // 2
@@ -590,6 +1803,296 @@ def measure_with_smu_list(smu, ser, params, filename):
         print(f"An error occurred during SMU measurement: {e}")
         raise
 
+def measure_with_smu_async(smu, ser, params, filename, method='poll', timeout=None, last_resistance=None):
+    """
+    Non-blocking counterpart of measure_with_smu. Switches the relays, starts the sweep and returns at once;
+    saving the data and averaging the resistance happen when the acquisition completes.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device to be used for the measurements.
+    - ser (serial.Serial): The serial connection to the relay controller.
+    - params (dict): A dictionary containing parameters for the SMU configuration.
+    - filename (str): Path of the .npz file the measurement data are saved to.
+    - method, timeout: Completion detection, see wait_smu_complete.
+    - last_resistance (float): Fixes the current range as in measure_with_smu; a reading that overflows it is
+      repeated with auto range in the worker thread.
+
+    Returns:
+    - concurrent.futures.Future: Resolves to the average resistance of the middle 10 points.
+    """
+    relays_to_smu(ser)
+    current_range = None
+    if last_resistance is not None:
+        v_max = max(abs(float(params['start_voltage'])), abs(float(params['stop_voltage'])))
+        current_range = predict_smu_current_range(last_resistance, v_max)
+
+    def finish(measure_time, source_voltage, voltage, current, resistance):
+        if current_range is not None and smu_current_out_of_range(current, current_range):
+            print(f"Reading out of the {current_range} A range, repeating with auto range")
+            measure_time, source_voltage, voltage, current, resistance = get_smu_measurement(smu, params)
+        save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance)
+        mid_index = len(resistance) // 2
+        middle_values = resistance[mid_index - 5:mid_index + 5]
+        return np.mean(middle_values)
+
+    run_params = params if current_range is None else dict(params, current_range=current_range)
+    return _start_smu(smu, configure_smu_sweep, run_params, method, timeout, 0.02, finish)
+
+def measure_and_save(smu, ser, params, filename, shot_file=None, last_resistance=None, **traces):
+    """
+    Reads the resistance after a shot and saves the traces of the shot while the SMU measures, so that saving
+    adds no time to the shot.
+
+    Parameters:
+    - smu, ser, params, filename, last_resistance: See measure_with_smu_async.
+    - shot_file (str): Path of the .npz file the shot traces are saved to; None if there is nothing to save.
+    - traces: The arrays of the shot, e.g. times_v=times_v, voltages_v=voltages_v, times_i=times_i,
+      voltages_i=voltages_i.
+
+    Returns:
+    - float: The average resistance of the middle 10 points, as measure_with_smu.
+
+    Examples:
+    - R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename('read_after_SET', File_Path, '.npz'),
+      generate_filename('SET', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v, times_i=times_i,
+      voltages_i=voltages_i)
+    """
+    future = measure_with_smu_async(smu, ser, params, filename, last_resistance=last_resistance)
+    try:
+        if shot_file is not None:
+            np.savez_compressed(shot_file, **traces)
+    finally:
+        # the read is completed even if saving failed, so the SMU is free again
+        resistance = future.result()
+    return resistance
+
+def measure_with_smu_segments(smu, ser, params, filename):
+    """
+    Switches the relays to the SMU once and runs a whole multi-segment protocol, see get_smu_segment_measurement.
+
+    The data are saved with save_smu_data together with a 'segment' array holding the segment index of every point
+    and a 'compliance_reached' array with one flag per segment (see smu_segment_compliance).
+
+    Parameters:
+    - smu (visa.Resource): The SMU device to be used for the measurements.
+    - ser (serial.Serial): The serial connection to the relay controller.
+    - params (dict): A dictionary with 'segments', 'NPLC' and optionally a default 'compliance_current'.
+    - filename (str or store entry): Where the measurement data are saved, see save_smu_data.
+
+    Returns:
+    - list of tuples: One (time, source voltage, voltage, current, resistance) tuple of arrays per segment.
+    """
+    try:
+        relays_to_smu(ser)
+        results = get_smu_segment_measurement(smu, params)
+        measure_time, source_voltage, voltage, current, resistance = (np.concatenate(x) for x in zip(*results))
+        segment = np.concatenate([np.full(len(r[0]), i) for i, r in enumerate(results)])
+        compliance_reached = np.array(smu_segment_compliance(params, results))
+        save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance,
+                      segment=segment, compliance_reached=compliance_reached)
+        return results
+    except Exception as e:
+        print(f"An error occurred during SMU measurement: {e}")
+        raise
+
+def measure_with_smu_early_abort(smu, ser, params, filename, chunk_points=None, ramp_down_points=5,
+                                 switching_resistance=None, current_jump=10, current_floor=1e-6):
+    """
+    Initialization sweep that returns as soon as the device switches, see get_smu_sweep_early_abort.
+
+    The data are saved like in measure_with_smu, with the additional entry 'switching_voltage' (NaN if the device
+    did not switch), so filename may also be a store entry.
+
+    Parameters:
+    - smu (visa.Resource): The SMU device to be used for the measurements.
+    - ser (serial.Serial): The serial connection to the relay controller.
+    - params (dict): A dictionary containing parameters for the SMU sweep.
+    - filename (str or store entry): Where the measurement data are saved, see save_smu_data.
+    - chunk_points, ramp_down_points, switching_resistance, current_jump, current_floor:
+      See get_smu_sweep_early_abort.
+
+    Returns:
+    - float or None: The voltage at which switching occurred, None if the sweep ran to completion.
+    """
+    try:
+        relays_to_smu(ser)
+        data, switching_index = get_smu_sweep_early_abort(smu, params, chunk_points, ramp_down_points,
+                                                          switching_resistance, current_jump, current_floor)
+        measure_time, source_voltage, voltage, current, resistance = data
+        switching_voltage = None if switching_index is None else float(voltage[switching_index])
+        save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance,
+                      switching_voltage=np.nan if switching_voltage is None else switching_voltage)
+        return switching_voltage
+    except Exception as e:
+        print(f"An error occurred during SMU measurement: {e}")
+        raise
+
+class SMUResultStore:
+    """
+    Run-level store for SMU reads and sweeps, replacing one .npz file per measurement.
+
+    Every distinct SMU profile (the params dict, number of points and names of the extra columns) is recorded
+    once, together with its time and source voltage arrays. Each measurement then only appends its measured
+    voltage, current and resistance columns as float32 to the profile's table, plus its extra columns (e.g. the
+    segment index of measure_with_smu_segments), a label and a timestamp. The tables are buffered and written
+    in blocks into a single zip/npz file, so it can be read back with load_smu_results or np.load.
+
+    Usage:
+    - store = SMUResultStore(File_Path + 'smu_results.npz')
+    - R_read = measure_with_smu(smu, esp32, smu_read_params, store.entry('read_after_SET'))
+    - store.close()
+    """
+
+    def __init__(self, filename, flush_every=100):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.flush_every = flush_every
+        self._profiles = {}
+        self._buffers = {}
+        self._chunks = {}
+        self._lock = threading.Lock()
+        if os.path.exists(filename):
+            # continue an existing run: re-register its profiles and chunk counters
+            for profile_id, profile in load_smu_results(filename).items():
+                self._profiles[profile['key']] = profile_id
+                self._chunks[profile_id] = profile['chunks']
+
+    def entry(self, label):
+        """Returns a save target for measure_with_smu & co. that records the measurement under label."""
+        return _SMUStoreEntry(self, label)
+
+    def add(self, params, measure_time, source_voltage, voltage, current, resistance, label='', **extra):
+        """
+        Appends one measurement to the table of its profile, registering the profile on first use. The keyword
+        arguments extra are stored as additional columns, one entry per measurement.
+        """
+        key = json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True) + f'/{len(voltage)}' + \
+            ''.join(f'+{name}' for name in sorted(extra))
+        with self._lock:
+            if key not in self._profiles:
+                profile_id = len(self._profiles)
+                self._profiles[key] = profile_id
+                self._chunks[profile_id] = 0
+                self._write({f'p{profile_id}_key': np.array(key),
+                             f'p{profile_id}_time': np.asarray(measure_time, dtype=float),
+                             f'p{profile_id}_source_voltage': np.asarray(source_voltage, dtype=float)})
+            profile_id = self._profiles[key]
+            buffer = self._buffers.setdefault(profile_id, [])
+            buffer.append((np.asarray(voltage, dtype=np.float32), np.asarray(current, dtype=np.float32),
+                           np.asarray(resistance, dtype=np.float32), label, time.time(),
+                           {name: np.asarray(value) for name, value in extra.items()}))
+            if len(buffer) >= self.flush_every:
+                self._flush_profile(profile_id)
+
+    def flush(self):
+        """Writes all buffered measurements to the file."""
+        with self._lock:
+            for profile_id in list(self._buffers):
+                self._flush_profile(profile_id)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush_profile(self, profile_id):
+        buffer = self._buffers.pop(profile_id, [])
+        if not buffer:
+            return
+        voltage, current, resistance, labels, timestamps, extras = zip(*buffer)
+        chunk = self._chunks[profile_id]
+        self._chunks[profile_id] = chunk + 1
+        name = f'p{profile_id}_c{chunk:05d}'
+        arrays = {f'{name}_voltage': np.stack(voltage), f'{name}_current': np.stack(current),
+                  f'{name}_resistance': np.stack(resistance), f'{name}_label': np.array(labels, dtype=str),
+                  f'{name}_timestamp': np.array(timestamps)}
+        for column in extras[0]:
+            arrays[f'{name}_{column}'] = np.stack([extra[column] for extra in extras])
+        self._write(arrays)
+
+    def _write(self, arrays):
+        with zipfile.ZipFile(self.filename, mode='a', compression=zipfile.ZIP_DEFLATED) as zf:
+            for name, array in arrays.items():
+                with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                    np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+class _SMUStoreEntry:
+    # Save target handed out by SMUResultStore.entry, carrying the label of the measurement.
+    def __init__(self, store, label):
+        self.store = store
+        self.label = label
+
+    def add(self, *args, **extra):
+        self.store.add(*args, label=self.label, **extra)
+
+
+def load_smu_results(filename):
+    """
+    Reads a file written by SMUResultStore.
+
+    Parameters:
+    - filename (str): Path of the store file.
+
+    Returns:
+    - dict: Maps each profile id to a dict with 'params' (dict of str), 'time' and 'source_voltage' (1D arrays),
+      'voltage', 'current' and 'resistance' (2D float32 arrays, one row per measurement), 'label' and 'timestamp'
+      (1D arrays, one entry per measurement), the extra columns passed to SMUResultStore.add (one row per
+      measurement), plus the internal 'key' and 'chunks'.
+    """
+    profiles = {}
+    with np.load(filename) as data:
+        names = sorted(data.files)
+        for name in names:
+            if name.endswith('_key'):
+                profile_id = int(name[1:-len('_key')])
+                key = str(data[name])
+                profiles[profile_id] = {
+                    'key': key,
+                    'params': json.loads(key.rsplit('/', 1)[0]),
+                    'time': data[f'p{profile_id}_time'],
+                    'source_voltage': data[f'p{profile_id}_source_voltage'],
+                }
+        for profile_id, profile in profiles.items():
+            chunks = sorted({'_'.join(name.split('_')[:2]) for name in names if name.startswith(f'p{profile_id}_c')})
+            profile['chunks'] = len(chunks)
+            n = len(profile['time'])
+            extra = [(column, float) for column in profile['key'].rsplit('/', 1)[1].split('+')[1:]]
+            for column, dtype in [('voltage', np.float32), ('current', np.float32), ('resistance', np.float32),
+                                  ('label', str), ('timestamp', float)] + extra:
+                parts = [data[f'{chunk}_{column}'] for chunk in chunks]
+                if parts:
+                    profile[column] = np.concatenate(parts)
+                elif column in ('voltage', 'current', 'resistance'):
+                    profile[column] = np.empty((0, n), dtype=dtype)
+                else:
+                    profile[column] = np.empty(0, dtype=dtype)
+    return profiles
+
+
+def save_smu_data(filename, params, measure_time, source_voltage, voltage, current, resistance, **extra):
+    """
+    Saves the arrays of one SMU measurement either to their own .npz file or to an SMUResultStore.
+
+    Parameters:
+    - filename (str, SMUResultStore or store entry): A file path, a store, or store.entry(label).
+    - params (dict): The SMU parameters of the measurement, identifying its profile in a store.
+    - measure_time, source_voltage, voltage, current, resistance (np.ndarray): The measurement data.
+    - extra: Additional arrays or values saved under their keyword, e.g. segment=... (an extra column in a store).
+    """
+    if hasattr(filename, 'add'):
+        filename.add(params, measure_time, source_voltage, voltage, current, resistance, **extra)
+    else:
+        np.savez_compressed(filename, time=measure_time, source_voltage=source_voltage, voltage=voltage,
+                            current=current, resistance=resistance, **extra)
+
+
 def generate_filename(prefix, directory, extension=".csv"):
     """
     Generates a filename with a timestamp, prefix, and specified file extension, placed in the given directory.
@@ -648,6 +2151,27 @@ def record_resistance(file_name, voltage, resistance, event):
     except Exception as e:
         print(f'Failed to record data: {e}')
 
+def record_event(file_name, timestamp, source, event, detail=''):
+    """
+    Appends one event to a CSV event log in the format "timestamp,source,event,detail".
+
+    Parameters:
+    - file_name (str): The path to the CSV file where the event will be recorded.
+    - timestamp (float): Time of the event as returned by time.time(); written with microsecond resolution.
+    - source (str): Where the event comes from, e.g. 'esp32' or 'host'.
+    - event (str): Short name of the event.
+    - detail (str): Free text, e.g. the command and its latency.
+    """
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    stamp = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d_%H%M%S.%f")
+    try:
+        with open(file_name, "a") as file:
+            file.write(f"{stamp},{source},{event},{detail}\n")
+    except Exception as e:
+        print(f'Failed to record event: {e}')
+
 def generate_logscale_integers(n, m):
     # Initially generate m points on a logarithmic scale
     log_space = np.logspace(0, n, num=m, base=10)
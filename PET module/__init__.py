@@ -1 +1,14 @@
 from .PET_module import *
+from .scheduler import *
+from .multiplex import *
+from .engine import *
+from .adaptive import *
+from .journal import *
+from .planner import *
+from .asynchronous import *
+from .pipeline import *
+from .campaign import *
+from .health import *
+from .analog import *
+from .profiles import *
+from .budget import *
@@ -0,0 +1,297 @@
+import numpy as np
+
+
+def threshold_search(measure, low, high, resolution, seed=None, step=None, digits=2):
+    """
+    Locates the switching threshold of a monotonic pulse parameter (e.g. V_SET at fixed T_SET) with few probes.
+
+    Starting from seed, the search steps up (if the device did not switch) or down (if it did) with a doubling
+    step until the transition is bracketed, then bisects the bracket until it is no wider than resolution.
+
+    Parameters:
+    - measure (callable): measure(value) applies one probe at value (pulse, read, restore) and returns True if the
+      device switched.
+    - low, high (float): Range of the parameter, e.g. the 0.2 to 2.5 V of the PTE grids.
+    - resolution (float): Width of the final bracket.
+    - seed (float): First probe, typically the threshold found for the previous pulse width; defaults to low.
+    - step (float): Initial bracketing step; defaults to a tenth of the range.
+    - digits (int): Probe values are rounded to this many digits, like the '{:.2f}' V_SET of the scripts.
+
+    Returns:
+    - tuple: (threshold, probes) where threshold is the lowest probed value at which the device switched with the
+      highest value at which it did not switch at most resolution below it (None if it did not switch up to high,
+      low if it already switched at low), and probes is the list of (value, switched) in probe order.
+
+    Examples:
+    - threshold_search(lambda v: v >= 1.234, 0.2, 2.5, 0.02, seed=1.0) returns a threshold within 0.02 above
+      1.234 after about 8 probes instead of the 30 of a full V_SET column.
+    """
+    probes = []
+    results = {}
+
+    def probe(value):
+        value = round(min(max(value, low), high), digits)
+        if value not in results:
+            results[value] = bool(measure(value))
+            probes.append((value, results[value]))
+        return value, results[value]
+
+    step = (high - low) / 10 if step is None else step
+    value, switched = probe(low if seed is None else seed)
+
+    # bracket: below is the highest value without switching, above the lowest value with switching
+    below = above = None
+    if switched:
+        above = value
+        while above > low:
+            value, switched = probe(above - step)
+            if not switched:
+                below = value
+                break
+            above = value
+            step *= 2
+        if below is None:
+            return low, probes
+    else:
+        below = value
+        while below < high:
+            value, switched = probe(below + step)
+            if switched:
+                above = value
+                break
+            below = value
+            step *= 2
+        if above is None:
+            return None, probes
+
+    while above - below > resolution:
+        middle = round((above + below) / 2, digits)
+        if middle in (above, below):
+            break
+        value, switched = probe(middle)
+        if switched:
+            above = value
+        else:
+            below = value
+    return above, probes
+
+
+class StepPolicy:
+    """
+    Base class of the step policies of write_verify: they choose the pulse parameter (e.g. V_RESET) of every try.
+
+    next(history, direction) returns the value of the next try, or None when the policy is exhausted. history is
+    the list of (value, resistance) of the tries so far and direction is +1 if the pulse has to be stronger (the
+    target was not reached) and -1 if it has to be weaker (the target was overshot).
+
+    Parameters:
+    - start (float): Value of the first try.
+    - limit (float): Strongest value allowed, e.g. the 3 V of the RESET ramps.
+    - floor (float): Weakest value allowed; defaults to start.
+    - digits (int): Values are rounded to this many digits.
+    """
+
+    def __init__(self, start, limit, floor=None, digits=3):
+        self.start = start
+        self.limit = limit
+        self.floor = start if floor is None else floor
+        self.digits = digits
+
+    def first(self):
+        return self.start
+
+    def next(self, history, direction):
+        raise NotImplementedError
+
+    def _clip(self, value, history):
+        """Limits a value to [floor, limit]; None if that only repeats the last try."""
+        value = round(min(max(value, self.floor), self.limit), self.digits)
+        return None if value == history[-1][0] else value
+
+
+class LinearPolicy(StepPolicy):
+    """
+    Fixed steps, like the np.linspace(V_RESET_0, 3, 10) ramp or the V_RESET += 0.01 of the endurance script.
+
+    Examples:
+    - LinearPolicy(V_RESET_0, 3, step=(3 - V_RESET_0) / 9) tries the same values as the RESET ramp.
+    """
+
+    def __init__(self, start, limit, step, floor=None, digits=3):
+        super().__init__(start, limit, floor, digits)
+        self.step = step
+
+    def next(self, history, direction):
+        return self._clip(history[-1][0] + direction * self.step, history)
+
+
+class ISPPPolicy(StepPolicy):
+    """
+    Incremental step pulse programming: the step grows by increment with every try in the same direction, and is
+    halved when the direction changes, i.e. the target window was overshot.
+    """
+
+    def __init__(self, start, limit, step, increment, floor=None, digits=3):
+        super().__init__(start, limit, floor, digits)
+        self.step = step
+        self.increment = increment
+
+    def first(self):
+        self._step, self._direction = self.step, None
+        return self.start
+
+    def next(self, history, direction):
+        if self._direction == direction:
+            self._step += self.increment
+        elif self._direction is not None:
+            self._step = max(self._step / 2, 10 ** -self.digits)
+        self._direction = direction
+        return self._clip(history[-1][0] + direction * self._step, history)
+
+
+class BinaryPolicy(StepPolicy):
+    """
+    Bisection between the strongest value that fell short and the weakest one that overshot (the floor and the
+    limit until there is one), until they are no more than resolution apart.
+    """
+
+    def __init__(self, start, limit, resolution, floor=None, digits=3):
+        super().__init__(start, limit, floor, digits)
+        self.resolution = resolution
+
+    def first(self):
+        self._weak, self._strong = [], []
+        return self.start
+
+    def next(self, history, direction):
+        (self._weak if direction > 0 else self._strong).append(history[-1][0])
+        low = max(self._weak, default=self.floor)
+        high = min(self._strong, default=self.limit)
+        if high - low <= self.resolution:
+            return None
+        return self._clip((low + high) / 2, history)
+
+
+class ModelPolicy(StepPolicy):
+    """
+    Model-predicted steps towards the target resistance.
+
+    With a model, model(value, resistance, target) predicts the value of the next try (e.g. a learned pulse to
+    delta R model). Without, the step comes from the secant of log10(R) over the last two tries, limited to
+    max_step; the first step is step. A step is never smaller than min_step, so a prediction that would repeat
+    the last try still moves in the required direction.
+
+    The target is the geometric middle of a two-sided window and lies margin decades inside the bound of a
+    one-sided one, e.g. 10 ** 0.1 * HRS_lim for a RESET to low=HRS_lim.
+    """
+
+    def __init__(self, start, limit, step, max_step=None, min_step=None, model=None, margin=0.1, floor=None,
+                 digits=3):
+        super().__init__(start, limit, floor, digits)
+        self.step = step
+        self.max_step = 4 * step if max_step is None else max_step
+        self.min_step = max(step / 4 if min_step is None else min_step, 10 ** -digits)
+        self.model = model
+        self.margin = margin
+        self.target = None
+
+    def aim(self, low=None, high=None):
+        """Sets the target resistance for the window [low, high] unless one was given."""
+        if self.target is not None:
+            return
+        if low is not None and high is not None:
+            self.target = float(np.sqrt(low * high))
+        elif low is not None:
+            self.target = low * 10 ** self.margin
+        elif high is not None:
+            self.target = high / 10 ** self.margin
+
+    def next(self, history, direction):
+        value, resistance = history[-1]
+        if self.model is not None:
+            proposal = self.model(value, resistance, self.target)
+        else:
+            proposal = value + direction * self.step
+            if len(history) > 1 and self.target is not None:
+                (v0, r0), (v1, r1) = history[-2], history[-1]
+                slope = (np.log10(r1) - np.log10(r0)) / (v1 - v0) if v1 != v0 and r0 > 0 and r1 > 0 else 0
+                if slope != 0:
+                    delta = (np.log10(self.target) - np.log10(r1)) / slope
+                    if np.sign(delta) == direction:
+                        proposal = value + float(np.clip(delta, -self.max_step, self.max_step))
+        if (proposal - value) * direction < self.min_step:
+            proposal = value + direction * self.min_step
+        return self._clip(proposal, history)
+
+
+class RepeatPolicy(StepPolicy):
+    """
+    The same value on every try, like the initialization sweep repeated until the device is in LRS. The number of
+    tries is bounded by the max_tries of write_verify.
+
+    Examples:
+    - write_verify(sweep, RepeatPolicy(V_sweep), high=LRS_lim, polarity='decrease', max_tries=3) replaces the
+      count >= 3 initialization loop of the PTE scripts.
+    """
+
+    def __init__(self, start, digits=3):
+        super().__init__(start, start, digits=digits)
+
+    def next(self, history, direction):
+        return self.start
+
+
+STEP_POLICIES = {'linear': LinearPolicy, 'ispp': ISPPPolicy, 'binary': BinaryPolicy, 'model': ModelPolicy,
+                 'repeat': RepeatPolicy}
+
+
+def write_verify(attempt, policy, low=None, high=None, polarity='increase', max_tries=None, restore=None):
+    """
+    Closed-loop write-verify: tries pulse values chosen by the policy until the resistance is in [low, high].
+
+    Parameters:
+    - attempt (callable): attempt(value) applies one pulse with the value and returns the resistance read after it.
+    - policy (StepPolicy): Chooses the value of every try, see LinearPolicy, ISPPPolicy, BinaryPolicy, ModelPolicy
+      and RepeatPolicy.
+    - low, high (float): Target window of the resistance; None leaves that side open, e.g. low=HRS_lim for RESET.
+    - polarity (str): 'increase' if a stronger pulse raises the resistance (RESET), 'decrease' if it lowers it
+      (SET).
+    - max_tries (int): Budget of tries; None runs until the policy is exhausted, which a RepeatPolicy never is.
+    - restore (callable): Called before every try but the first, e.g. the initialization sweep before a RESET retry.
+
+    Returns:
+    - tuple: (reached, value, resistance, history) with the last try and the list of (value, resistance) of all
+      tries.
+
+    Raises:
+    - ValueError: For an unknown polarity, or a RepeatPolicy without max_tries.
+
+    Examples:
+    - write_verify(reset, LinearPolicy(V_RESET, 2.1, step=0.01), low=HRS_lim, restore=sweep) replaces the
+      V_RESET += 0.01 loop of the endurance script.
+    """
+    if polarity not in ('increase', 'decrease'):
+        raise ValueError(f"Unknown polarity '{polarity}'. Expected 'increase' or 'decrease'.")
+    if isinstance(policy, RepeatPolicy) and max_tries is None:
+        raise ValueError("A RepeatPolicy never runs out of values, write_verify needs max_tries with it")
+    sign = 1 if polarity == 'increase' else -1
+    if isinstance(policy, ModelPolicy):
+        policy.aim(low, high)
+
+    history = []
+    value = policy.first()
+    while value is not None and (max_tries is None or len(history) < max_tries):
+        if history and restore is not None:
+            restore()
+        resistance = attempt(value)
+        history.append((value, resistance))
+        if low is not None and not resistance >= low:
+            direction = sign
+        elif high is not None and resistance > high:
+            direction = -sign
+        else:
+            return True, value, resistance, history
+        value = policy.next(history, direction)
+    print(f"write-verify stopped after {len(history)} tries without reaching the target")
+    value, resistance = history[-1] if history else (None, None)
+    return False, value, resistance, history
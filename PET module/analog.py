@@ -0,0 +1,218 @@
+import itertools
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+# Direction in which each kind of pulse moves the resistance.
+KIND_DIRECTION = {'SET': -1, 'RESET': 1}
+
+# Pulse width at the end of an event, as written by the PTE scripts (f'after_SET_{T_SET:.1e}').
+_EVENT_WIDTH = re.compile(r'_(\d\.\d+e[-+]\d+)s?$')
+
+
+class PulseResponseModel:
+    """
+    Learned response of a device to programming pulses: the change of log10(R) caused by a pulse as a function of
+    the resistance before it and the pulse amplitude, width and fall time, one linear model per kind of pulse
+    ('SET', 'RESET').
+
+    The features are 1, L, V, V^2, V*L, log10(width) and log10(fall_time), with L = log10(R) - 4. The fit is a
+    ridge regression kept as sufficient statistics, so it is updated online after every shot at no cost, and can
+    be saved and loaded as JSON. The prediction error of every shot before it is learned gives the spread used to
+    rank the pulses in propose().
+
+    Parameters:
+    - filename (str): JSON cache of the model; loaded if it exists, and the default of save().
+    - ridge (float): Regularization of the fit.
+
+    Usage:
+    - model = PulseResponseModel('pulse_model.json')
+    - model.fit_resistance_log(Record_file, fall_time=2e-9)
+    - kind, V, width, fall_time, p = model.propose(R_read, 5e4, pulse_candidates('RESET', amplitudes, widths, falls))
+    """
+
+    n_features = 7
+
+    def __init__(self, filename=None, ridge=1e-3):
+        self.filename = filename
+        self.ridge = ridge
+        self.stats = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as file:
+                data = json.load(file)
+            for kind, stats in data['stats'].items():
+                self.stats[kind] = {'xtx': np.array(stats['xtx']), 'xty': np.array(stats['xty']), 'n': stats['n'],
+                                    'sse': stats['sse'], 'n_err': stats['n_err']}
+
+    def features(self, resistance, amplitude, width, fall_time):
+        level = math.log10(resistance) - 4
+        return np.array([1.0, level, amplitude, amplitude ** 2, amplitude * level, math.log10(width),
+                         math.log10(fall_time)])
+
+    def _stats(self, kind):
+        if kind not in self.stats:
+            self.stats[kind] = {'xtx': np.zeros((self.n_features, self.n_features)),
+                                'xty': np.zeros(self.n_features), 'n': 0, 'sse': 0.0, 'n_err': 0}
+        return self.stats[kind]
+
+    def samples(self, kind):
+        """Number of shots the model of a kind has learned from."""
+        return self.stats[kind]['n'] if kind in self.stats else 0
+
+    def coefficients(self, kind):
+        stats = self._stats(kind)
+        return np.linalg.solve(stats['xtx'] + self.ridge * np.eye(self.n_features), stats['xty'])
+
+    def predict(self, kind, resistance, amplitude, width, fall_time):
+        """Predicted resistance after the pulse."""
+        change = float(self.features(resistance, amplitude, width, fall_time) @ self.coefficients(kind))
+        return resistance * 10 ** change
+
+    def spread(self, kind):
+        """Standard deviation of the prediction error in decades (0.3 until there are errors to estimate it)."""
+        stats = self._stats(kind)
+        return math.sqrt(stats['sse'] / stats['n_err']) if stats['n_err'] >= 3 else 0.3
+
+    def update(self, kind, resistance_before, amplitude, width, fall_time, resistance_after):
+        """Learns from one shot."""
+        if not (resistance_before > 0 and resistance_after > 0):
+            return
+        stats = self._stats(kind)
+        x = self.features(resistance_before, amplitude, width, fall_time)
+        y = math.log10(resistance_after) - math.log10(resistance_before)
+        if stats['n'] >= self.n_features:
+            stats['sse'] += (float(x @ self.coefficients(kind)) - y) ** 2
+            stats['n_err'] += 1
+        stats['xtx'] += np.outer(x, x)
+        stats['xty'] += x * y
+        stats['n'] += 1
+
+    def fit_resistance_log(self, file_name, kinds=None, width=5e-8, fall_time=2e-9):
+        """
+        Learns from the shots of a resistance log written by record_resistance: every record with an event of a
+        kind (e.g. 'after_SET_5.0e-08') is a shot of the recorded voltage. The resistance before the shot is that of
+        the record directly before it if it is an explicit pre-pulse read (event 'before_...', see
+        program_resistance) or the read of another kind of event (e.g. the 'after_sweep' or 'after_SET' read
+        before a RESET). Two shots of the same kind in a row are skipped: the verify ramps restore the device
+        between such tries without always logging it, so the earlier read is not the state the pulse started from.
+
+        Parameters:
+        - kinds (dict): Event prefix of each kind; defaults to {'SET': 'after_SET', 'RESET': 'after_RESET'}.
+        - width (float): Pulse width of the events that do not end with one, like the PTE events do.
+        - fall_time (float): Fall time of the pulses, which the log does not record.
+
+        Returns:
+        - int: Number of shots learned.
+        """
+        kinds = kinds or {'SET': 'after_SET', 'RESET': 'after_RESET'}
+        learned = 0
+        previous = previous_kind = None
+        with open(file_name) as file:
+            for line in file:
+                parts = line.strip().split(',')
+                try:
+                    event, voltage, resistance = parts[1], float(parts[2]), float(parts[3])
+                except (IndexError, ValueError):
+                    continue
+                kind = next((k for k, prefix in kinds.items() if event.startswith(prefix)), None)
+                if kind is not None and previous is not None and kind != previous_kind:
+                    match = _EVENT_WIDTH.search(event)
+                    self.update(kind, previous, voltage, float(match.group(1)) if match else width, fall_time,
+                                resistance)
+                    learned += 1
+                previous = resistance
+                previous_kind = None if event.startswith('before_') else kind
+        return learned
+
+    def probability(self, kind, resistance, candidate, target, tolerance):
+        """Probability that a pulse lands within the relative tolerance of the target, from the prediction spread."""
+        amplitude, width, fall_time = candidate
+        predicted = math.log10(self.predict(kind, resistance, amplitude, width, fall_time))
+        window = math.log10(1 + tolerance)
+        sigma = self.spread(kind) * math.sqrt(2)
+        centre = math.log10(target) - predicted
+        return 0.5 * (math.erf((centre + window) / sigma) - math.erf((centre - window) / sigma))
+
+    def propose(self, resistance, target, candidates, tolerance=0.05):
+        """
+        Chooses the pulse most likely to reach the target in one shot.
+
+        Parameters:
+        - resistance (float): Current resistance.
+        - target (float): Target resistance.
+        - candidates (list): (kind, amplitude, width, fall_time) tuples, see pulse_candidates.
+        - tolerance (float): Relative tolerance of the target, e.g. 0.05 for +-5 %.
+
+        Returns:
+        - tuple: (kind, amplitude, width, fall_time, probability); the probability is None for a kind the model has
+          not learned enough about yet, in which case the weakest pulse of the kind that moves the resistance
+          towards the target is returned.
+        """
+        direction = 1 if target > resistance else -1
+        candidates = [c for c in candidates if KIND_DIRECTION.get(c[0], direction) == direction]
+        if not candidates:
+            raise ValueError(f"No candidate pulse moves the resistance {'up' if direction > 0 else 'down'}")
+        learned = [c for c in candidates if self.samples(c[0]) > self.n_features]
+        if not learned:
+            kind, amplitude, width, fall_time = min(candidates, key=lambda c: abs(c[1]))
+            return kind, amplitude, width, fall_time, None
+        best = max(learned, key=lambda c: (self.probability(c[0], resistance, c[1:], target, tolerance), -abs(c[1])))
+        return (*best, self.probability(best[0], resistance, best[1:], target, tolerance))
+
+    def save(self, filename=None):
+        """Writes the model as JSON."""
+        data = {'stats': {kind: {'xtx': stats['xtx'].tolist(), 'xty': stats['xty'].tolist(), 'n': stats['n'],
+                                 'sse': stats['sse'], 'n_err': stats['n_err']}
+                          for kind, stats in self.stats.items()}}
+        with open(filename or self.filename, 'w') as file:
+            json.dump(data, file)
+
+
+def pulse_candidates(kind, amplitudes, widths, fall_times):
+    """All (kind, amplitude, width, fall_time) combinations for PulseResponseModel.propose."""
+    return [(kind, float(a), float(w), float(f)) for a, w, f in itertools.product(amplitudes, widths, fall_times)]
+
+
+def program_resistance(pulse, read, model, target, candidates, tolerance=0.05, max_tries=10):
+    """
+    Programs an intermediate resistance level: proposes a pulse with the model, applies it, reads, learns from the
+    shot and repeats until the resistance is within the tolerance of the target.
+
+    While a kind of pulse is not learned yet, its candidates are explored from the weakest, one amplitude up after
+    every shot that did not move the resistance past the target.
+
+    Parameters:
+    - pulse (callable): pulse(kind, amplitude, width, fall_time) applies one programming pulse.
+    - read (callable): read() returns the resistance.
+    - model (PulseResponseModel): The model, updated after every shot.
+    - target (float): Target resistance.
+    - candidates (list): Allowed pulses, see pulse_candidates.
+    - tolerance (float): Relative tolerance of the target.
+    - max_tries (int): Budget of pulses.
+
+    Returns:
+    - tuple: (reached, resistance, shots) with the list of (kind, amplitude, width, fall_time, resistance before,
+      resistance after).
+    """
+    shots = []
+    resistance = read()
+    explored = set()
+    while abs(resistance / target - 1) > tolerance and len(shots) < max_tries:
+        kind, amplitude, width, fall_time, probability = model.propose(resistance, target, candidates, tolerance)
+        if probability is None:
+            # exploration: the weakest amplitude of the kind not tried yet
+            untried = [c for c in candidates if c[0] == kind and c[1] > amplitude and c not in explored]
+            choice = (kind, amplitude, width, fall_time)
+            if choice in explored and untried:
+                choice = min(untried, key=lambda c: c[1])
+            kind, amplitude, width, fall_time = choice
+            explored.add(choice)
+        pulse(kind, amplitude, width, fall_time)
+        after = read()
+        model.update(kind, resistance, amplitude, width, fall_time, after)
+        shots.append((kind, amplitude, width, fall_time, resistance, after))
+        resistance = after
+    return abs(resistance / target - 1) <= tolerance, resistance, shots
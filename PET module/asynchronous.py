@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .PET_module import (RelayController, connect_to_awg, connect_to_esp32, connect_to_scope, connect_to_smu,
+                         get_smu_measurement, get_waveform_data, measure_with_smu, prepare_shot, relays,
+                         setup_oscilloscope, setup_sequences, trigger)
+
+# Instruments of a session, in the order their locks are taken.
+INSTRUMENTS = ('awg', 'scope', 'smu', 'esp32')
+
+
+class AsyncSession:
+    """
+    Asyncio counterparts of the blocking instrument functions, so that operations on independent instruments can be
+    awaited concurrently.
+
+    The VISA and serial I/O runs in worker threads. Every instrument has its own lock, so calls to one instrument
+    are serialized while calls to different instruments overlap. A call that needs several instruments (trigger
+    uses the AWG and the scope, measure_with_smu the SMU and the relay) holds all their locks.
+
+    Parameters:
+    - awg, scope, smu, esp32: Connected instruments, as returned by the connect_to_* functions (or None).
+
+    Usage:
+    - async def main():
+    -     async with await AsyncSession.connect(awg_ip, scope_address, smu_address, 'COM4') as session:
+    -         await session.prepare_shot({'SET': SET}, [{"number": 1, "waveform": "SET"}], SET_settings)
+    -         await session.fire()
+    -         R = await session.measure_with_smu(smu_read_params, filename)
+    - asyncio.run(main())
+    """
+
+    def __init__(self, awg=None, scope=None, smu=None, esp32=None):
+        self.awg = awg
+        self.scope = scope
+        self.smu = smu
+        self.esp32 = esp32 if isinstance(esp32, RelayController) or esp32 is None else RelayController(esp32)
+        self._executor = ThreadPoolExecutor(max_workers=len(INSTRUMENTS), thread_name_prefix='instrument')
+        self._locks = {name: asyncio.Lock() for name in INSTRUMENTS}
+
+    @classmethod
+    async def connect(cls, awg_address=None, scope_address=None, smu_address=None, esp32_port=None,
+                      baud_rate=115200):
+        """Connects the given instruments concurrently and returns the session."""
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=len(INSTRUMENTS)) as executor:
+            async def connect(func, *args):
+                return await loop.run_in_executor(executor, func, *args) if args[0] is not None else None
+            awg, scope, smu, esp32 = await asyncio.gather(
+                connect(connect_to_awg, awg_address), connect(connect_to_scope, scope_address),
+                connect(connect_to_smu, smu_address), connect(connect_to_esp32, esp32_port, baud_rate))
+        return cls(awg, scope, smu, esp32)
+
+    async def call(self, instruments, func, *args, **kwargs):
+        """
+        Runs a blocking function in a worker thread while holding the locks of the named instruments.
+
+        Examples:
+        - await session.call(['awg'], setup_sequences, session.awg, sequence_config)
+        """
+        names = [name for name in INSTRUMENTS if name in instruments]
+        for name in names:
+            await self._locks[name].acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+        finally:
+            for name in reversed(names):
+                self._locks[name].release()
+
+    async def upload_waveform(self, name, waveform):
+        """Uploads a waveform, as awg.waveforms[name] = waveform."""
+        def upload():
+            self.awg.waveforms[name] = waveform
+        await self.call(['awg'], upload)
+
+    async def setup_sequences(self, sequence_config):
+        await self.call(['awg'], setup_sequences, self.awg, sequence_config)
+
+    async def setup_oscilloscope(self, settings):
+        await self.call(['scope'], setup_oscilloscope, self.scope, settings)
+
+    async def relays(self, status):
+        return await self.call(['esp32'], relays, self.esp32, status)
+
+    async def trigger(self):
+        return await self.call(['awg', 'scope'], trigger, self.scope, self.awg)
+
+    async def get_waveform_data(self):
+        return await self.call(['scope'], get_waveform_data, self.scope)
+
+    async def get_smu_measurement(self, params):
+        return await self.call(['smu'], get_smu_measurement, self.smu, params)
+
+    async def measure_with_smu(self, params, filename, last_resistance=None):
+        return await self.call(['smu', 'esp32'], measure_with_smu, self.smu, self.esp32, params, filename,
+                               last_resistance)
+
+    async def prepare_shot(self, waveforms, sequence_config, scope_settings, relay='switch'):
+        """
+        Awaitable prepare_shot: uploads the waveforms and the sequence to the AWG, configures the scope and switches
+        the relay in parallel, holding the locks of the three instruments until all are done.
+
+        Parameters:
+        - waveforms (dict): Waveforms to upload by name; may be empty if they are already on the AWG.
+        - sequence_config (list): Sequence entries for setup_sequences.
+        - scope_settings (dict): Settings for setup_oscilloscope; None keeps the current ones.
+        - relay (str): Relay status, 'switch' to route the AWG to the device.
+        """
+        await self.call(['awg', 'scope', 'esp32'], prepare_shot, self.awg, self.scope, self.esp32, sequence_config,
+                        scope_settings, waveforms, relay)
+
+    async def fire(self):
+        """Turns the AWG output on, triggers and returns the acquired waveforms, like the shots of the scripts."""
+        def output_on():
+            self.awg.write("OUTPut1:STATe 1")
+            self.awg.enabled = True
+        await self.call(['awg'], output_on)
+        await self.trigger()
+        return await self.get_waveform_data()
+
+    def close(self):
+        """Stops the worker threads; the instrument connections stay open."""
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,101 @@
+import time
+
+import numpy as np
+
+
+def coarse_to_fine(shape):
+    """
+    Indices of a grid in coarse-to-fine order: first the corners, then the grids with 3, 5, 9, ... values per axis
+    (evenly spaced, always including both ends), each level adding only the points not measured yet, until the
+    full grid. Within a level, every next point is the one farthest from those already measured, so a level cut
+    short is still spread over the whole map.
+
+    Parameters:
+    - shape (tuple): Number of values of each axis, e.g. (30, 30) for the PTE grid.
+
+    Returns:
+    - list: (level, index) tuples, index being a tuple with one index per axis.
+
+    Examples:
+    - coarse_to_fine((3, 3)) gives the corners (0, 0), (2, 2), (0, 2), (2, 0) at level 0, then the
+      centre (1, 1) and the middles of the edges.
+    """
+    scale = np.array([max(n - 1, 1) for n in shape], dtype=float)
+    measured = np.zeros(shape, dtype=bool)
+    order = []
+    points = np.zeros((0, len(shape)))
+    level = 0
+    while not measured.all():
+        divisions = 2 ** level
+        axes = [np.unique(np.round(np.linspace(0, n - 1, min(divisions, n - 1) + 1)).astype(int)) if n > 1
+                else np.array([0]) for n in shape]
+        candidates = np.array([index for index in np.ndindex(*shape) if not measured[index]
+                               and all(i in axis for i, axis in zip(index, axes))])
+        if len(candidates):
+            coordinates = candidates / scale
+            if len(points):
+                distance = np.min(np.linalg.norm(coordinates[:, None] - points[None], axis=2), axis=1)
+            else:
+                distance = np.full(len(candidates), np.inf)
+            remaining = np.ones(len(candidates), dtype=bool)
+            for _ in range(len(candidates)):
+                choice = int(np.argmax(np.where(remaining, distance, -1)))
+                remaining[choice] = False
+                index = tuple(int(i) for i in candidates[choice])
+                measured[index] = True
+                order.append((level, index))
+                distance = np.minimum(distance, np.linalg.norm(coordinates - coordinates[choice], axis=1))
+            points = np.vstack([points, coordinates])
+        level += 1
+    return order
+
+
+class TimeBudget:
+    """
+    Wall-clock budget of a measurement: the time left and the estimated duration of a point, the mean of the
+    points measured so far and of the prior estimate (which counts as prior_weight points).
+
+    A budget can be shared with nested measurements, e.g. the PTE maps of the repetitions of a pad: with pending
+    set to the number of points still to run, share() is the time each of them may take.
+
+    Parameters:
+    - seconds (float): The budget.
+    - estimate (float): Expected duration of a point, e.g. measured in earlier runs; None until the first point.
+    - clock (callable): Returns the current time in seconds; time.monotonic by default.
+    - prior_weight (float): Number of points the prior estimate is worth.
+
+    Usage:
+    - budget = TimeBudget(7200, costs.cost('point_3') or None)
+    - while budget.fits(): ...; budget.add(seconds)
+    """
+
+    def __init__(self, seconds, estimate=None, clock=time.monotonic, prior_weight=1):
+        self.seconds = seconds
+        self.estimate = estimate
+        self.clock = clock
+        self.start = clock()
+        self.points = 0
+        self.prior = estimate
+        self.prior_weight = prior_weight if estimate is not None else 0
+        self.total = 0.0
+        self.pending = None
+
+    def elapsed(self):
+        return self.clock() - self.start
+
+    def remaining(self):
+        return self.seconds - self.elapsed()
+
+    def fits(self, points=1):
+        """True if the points are expected to finish within the budget."""
+        return points * (self.estimate or 0.0) <= self.remaining()
+
+    def share(self):
+        """The time left for each of the pending points, all of it if pending is not set."""
+        return self.remaining() / max(self.pending, 1) if self.pending is not None else self.remaining()
+
+    def add(self, seconds):
+        """Adds the duration of a completed point to the estimate."""
+        self.total += seconds
+        self.points += 1
+        self.estimate = ((self.prior or 0.0) * self.prior_weight + self.total) / (self.prior_weight + self.points)
@@ -0,0 +1,158 @@
+import copy
+import os
+
+from .engine import Experiment, InstrumentSession, load_experiment_spec
+from .health import AbortPad, NextJob
+from .journal import unit_key
+from .PET_module import relays
+
+
+class CampaignJob:
+    """
+    One job of a campaign: a protocol (experiment spec) run on one pad.
+
+    Parameters:
+    - sample (str): Sample name, e.g. '3-DIE-25'; replaces 'sample' in the sample section of the spec.
+    - pad (str): Pad name, e.g. 'D1-3'; replaces 'pad'.
+    - protocol (dict, str or Experiment): The experiment spec or its file.
+    - variables (dict): Overrides of the spec variables, e.g. {'i': 1} for the second repetition.
+    - sample_settings (dict): Further overrides of the sample section, e.g. {'sub_folder': '{i+4}th_SET'}.
+    """
+
+    def __init__(self, sample, pad, protocol, variables=None, sample_settings=None):
+        self.sample = sample
+        self.pad = pad
+        self.protocol = protocol
+        self.variables = dict(variables or {})
+        self.sample_settings = dict(sample_settings or {})
+
+    def experiment(self):
+        """
+        Compiles the protocol for this pad. The job variables become the 'job' of the sample section, so every
+        repetition keeps its own run journal.
+        """
+        if isinstance(self.protocol, Experiment):
+            spec = self.protocol.spec
+        elif isinstance(self.protocol, str):
+            spec = load_experiment_spec(self.protocol)
+            spec.setdefault('name', os.path.splitext(os.path.basename(self.protocol))[0])
+        else:
+            spec = self.protocol
+        spec = copy.deepcopy(spec)
+        sample = spec.setdefault('sample', {})
+        if self.variables:
+            sample.setdefault('job', unit_key(**self.variables))
+        sample.update(self.sample_settings, sample=self.sample, pad=self.pad)
+        return Experiment(spec)
+
+    def __repr__(self):
+        return f"CampaignJob({self.sample!r}, {self.pad!r}, {self.variables})"
+
+
+class Campaign:
+    """
+    Queue of jobs run back to back with a single instrument session, instead of editing and rerunning a script for
+    every pad.
+
+    The session is shared by all jobs, so waveforms already on the AWG and unchanged scope settings are not set up
+    again. The operator is only prompted when the next job is on another pad: the relays are switched off and the
+    campaign waits until the probe has been moved. A failing job is reported and the campaign goes on with the
+    next one. A health rule can end a job early (NextJob) or also skip the other jobs on its pad (AbortPad).
+
+    Parameters:
+    - session (InstrumentSession): Shared instruments; connected from the instruments section of the first job's
+      spec if not given.
+    - prompt (callable): prompt(message) waits for the operator; input by default.
+    - profiles (ProfileRegistry): Device profiles; jobs with a 'material' start from the priors of their die and
+      teach it what they measured, so the later jobs of a die start warm.
+
+    Usage:
+    - campaign = Campaign()
+    - campaign.add('3-DIE-25', 'D1-3', 'experiments/PTE_write-verify.yaml', repeat=3)
+    - campaign.add('3-DIE-25', 'D1-4', 'experiments/PTE_write-verify.yaml')
+    - results = campaign.run(resume=True)
+    """
+
+    def __init__(self, session=None, prompt=input, profiles=None):
+        self.session = session
+        self.prompt = prompt
+        self.profiles = profiles
+        self.jobs = []
+
+    def add(self, sample, pad, protocol, variables=None, repeat=1, **sample_settings):
+        """
+        Queues a protocol on a pad. With repeat > 1, the job is queued repeat times with the variable i counting
+        the repetitions, like the 'for i in range(3)' loops of the scripts.
+        """
+        for i in range(repeat):
+            job_variables = dict(variables or {})
+            if repeat > 1:
+                job_variables['i'] = i
+            self.jobs.append(CampaignJob(sample, pad, protocol, job_variables, sample_settings))
+
+    @classmethod
+    def from_spec(cls, spec, session=None, prompt=input, profiles=None):
+        """
+        Builds a campaign from a dict or a YAML/TOML/JSON file with a 'jobs' list of {'sample', 'pad', 'protocol',
+        'variables', 'repeat', ...} entries (other keys override the sample section). Protocol files are relative
+        to the campaign file. Without a session, the instruments are connected from its 'instruments' section.
+        """
+        directory = ''
+        if isinstance(spec, str):
+            directory = os.path.dirname(os.path.abspath(spec))
+            spec = load_experiment_spec(spec)
+        if session is None and 'instruments' in spec:
+            session = InstrumentSession.connect(spec['instruments'])
+        campaign = cls(session, prompt, profiles)
+        for job in spec['jobs']:
+            job = dict(job)
+            protocol = job.pop('protocol')
+            if isinstance(protocol, str):
+                protocol = os.path.join(directory, protocol)
+            campaign.add(job.pop('sample'), job.pop('pad'), protocol, job.pop('variables', None),
+                         job.pop('repeat', 1), **job)
+        return campaign
+
+    def run(self, resume=None):
+        """
+        Runs all jobs in order.
+
+        Parameters:
+        - resume (bool): Run journal of every job, see Experiment.run.
+
+        Returns:
+        - list: (job, context, error) for every job, with the final ExperimentContext or the exception it failed
+          or was ended with (both None for jobs skipped after an AbortPad).
+        """
+        # compile every protocol first, so that a broken spec fails before any probe time is spent
+        experiments = [job.experiment() for job in self.jobs]
+        results = []
+        position = None
+        aborted = set()
+        for number, (job, experiment) in enumerate(zip(self.jobs, experiments), 1):
+            if (job.sample, job.pad) in aborted:
+                print(f"Job {number}/{len(self.jobs)}: {job} skipped, the pad was aborted")
+                results.append((job, None, None))
+                continue
+            if self.session is None:
+                self.session = InstrumentSession.connect(experiment.spec['instruments'])
+            if (job.sample, job.pad) != position:
+                if position is not None:
+                    relays(self.session.esp32, 'off')
+                    self.prompt(f"Move the probe to sample {job.sample}, pad {job.pad} and press Enter ")
+                position = (job.sample, job.pad)
+            print(f"Job {number}/{len(self.jobs)}: {job}")
+            try:
+                context = experiment.run(self.session, job.variables, resume, self.profiles)
+                results.append((job, context, None))
+            except NextJob as e:
+                print(f"Job {job} ended by the health rules: {e}")
+                if isinstance(e, AbortPad):
+                    aborted.add((job.sample, job.pad))
+                results.append((job, None, e))
+            except Exception as e:
+                print(f"Job {job} failed: {e}")
+                results.append((job, None, e))
+        if self.session is not None:
+            relays(self.session.esp32, 'off')
+        return results
@@ -0,0 +1,895 @@
+import ast
+import contextlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from .adaptive import STEP_POLICIES, threshold_search, write_verify
+from .budget import TimeBudget, coarse_to_fine
+from .health import HEALTH_RULES, HealthMonitor, SkipRow
+from .journal import RunJournal, unit_key
+from .PET_module import (RelayController, adjust_oscilloscope_scale, connect_to_awg, connect_to_esp32,
+                         connect_to_scope, connect_to_smu, create_waveform, expected_resistance, generate_filename,
+                         get_waveform_data, measure_and_save, measure_with_smu_early_abort, record_resistance,
+                         relays, setup_oscilloscope, setup_sequences, trigger)
+
+# Names available in the expressions of an experiment spec, besides its variables.
+EXPRESSION_NAMESPACE = {'np': np, 'min': min, 'max': max, 'abs': abs, 'round': round, 'int': int, 'float': float}
+
+# Attributes of np an expression may use; anything else (e.g. np.load) is rejected.
+EXPRESSION_NUMPY = {'pi', 'e', 'inf', 'nan', 'sqrt', 'exp', 'log', 'log2', 'log10', 'floor', 'ceil', 'round', 'abs',
+                    'minimum', 'maximum', 'clip', 'linspace', 'logspace', 'arange', 'geomspace'}
+
+# Syntax an expression may use: arithmetic, comparisons, conditionals, calls and literals.
+_EXPRESSION_NODES = (ast.Expression, ast.Constant, ast.Name, ast.Load, ast.BinOp, ast.UnaryOp, ast.BoolOp,
+                     ast.Compare, ast.IfExp, ast.Call, ast.keyword, ast.Attribute, ast.Subscript, ast.Slice,
+                     ast.List, ast.Tuple, ast.operator, ast.unaryop, ast.boolop, ast.cmpop)
+
+_FIELD = re.compile(r'\{([^{}:!]+)(?::([^{}]+))?\}')
+
+
+def evaluate(value, variables):
+    """
+    Evaluates a value of an experiment spec: strings are expressions over the variables (and np, min, max, abs,
+    round, int, float), lists are evaluated element-wise, everything else is returned unchanged.
+
+    Expressions are restricted to arithmetic, comparisons, conditionals, indexing and calls of the names above;
+    of np only the attributes in EXPRESSION_NUMPY are available. Plain strings such as SCPI tokens are not
+    expressions and must not be passed here.
+
+    Raises:
+    - ValueError: If the expression uses other syntax or a name that is not defined.
+
+    Examples:
+    - evaluate('V_SET * 0.7', {'V_SET': 1.0}) returns 0.7.
+    - evaluate(2.3, {}) returns 2.3.
+    """
+    if isinstance(value, str):
+        namespace = {**EXPRESSION_NAMESPACE, **variables}
+        try:
+            tree = ast.parse(value.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid expression '{value}': {e}")
+        for node in ast.walk(tree):
+            if not isinstance(node, _EXPRESSION_NODES):
+                raise ValueError(f"Invalid expression '{value}': {type(node).__name__} is not allowed")
+            if isinstance(node, ast.Name) and node.id not in namespace:
+                raise ValueError(f"Invalid expression '{value}': '{node.id}' is not defined")
+            if isinstance(node, ast.Attribute) and not (isinstance(node.value, ast.Name) and node.value.id == 'np'
+                                                        and node.attr in EXPRESSION_NUMPY):
+                raise ValueError(f"Invalid expression '{value}': attribute '{node.attr}' is not allowed")
+        return eval(compile(tree, '<spec>', 'eval'), {'__builtins__': {}}, namespace)
+    if isinstance(value, list):
+        return [evaluate(v, variables) for v in value]
+    return value
+
+
+def render(template, variables):
+    """
+    Fills the {expression} or {expression:format} fields of a label, file name or event template.
+
+    Examples:
+    - render('SET_{V_SET}V_{T_SET:.1e}s', {'V_SET': 1.2, 'T_SET': 5e-8}) returns 'SET_1.2V_5.0e-08s'.
+    - render('{i+4}th_SET', {'i': 0}) returns '4th_SET'.
+    """
+    def field(match):
+        result = evaluate(match.group(1), variables)
+        return format(result, match.group(2) or '')
+    return _FIELD.sub(field, str(template))
+
+
+def expand_values(spec, variables):
+    """
+    Expands the value specification of a grid or verify variable into a list.
+
+    The specification is a list (of values or expressions), or a dict with one of 'linspace': [start, stop, num],
+    'logspace': [start, stop, num], 'range': [args] or 'values': expression, and optionally 'round': digits
+    (rounding like the '{:.2f}' formatting in the scripts).
+
+    Examples:
+    - expand_values({'linspace': [0.2, 2.5, 30], 'round': 2}, {}) gives the V_SET values of the PTE scripts.
+    """
+    if isinstance(spec, list):
+        values = evaluate(spec, variables)
+    elif isinstance(spec, dict):
+        if 'linspace' in spec:
+            values = np.linspace(*evaluate(spec['linspace'], variables))
+        elif 'logspace' in spec:
+            values = np.logspace(*evaluate(spec['logspace'], variables))
+        elif 'range' in spec:
+            values = range(*[int(v) for v in evaluate(spec['range'], variables)])
+        elif 'values' in spec:
+            values = evaluate(spec['values'], variables)
+        else:
+            raise ValueError(f"Unknown value specification {spec}")
+        if 'round' in spec:
+            values = [round(float(v), int(spec['round'])) for v in values]
+    else:
+        values = [evaluate(spec, variables)]
+    return [v.item() if isinstance(v, np.generic) else v for v in values]
+
+
+def load_experiment_spec(path):
+    """
+    Loads an experiment spec from a YAML, TOML or JSON file.
+
+    YAML needs PyYAML and TOML needs Python 3.11 (tomllib) or the tomli package.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ImportError("Loading YAML experiment specs requires PyYAML (pip install pyyaml).")
+        with open(path) as file:
+            return yaml.safe_load(file)
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError("Loading TOML experiment specs requires Python 3.11 or tomli (pip install tomli).")
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    if extension == '.json':
+        with open(path) as file:
+            return json.load(file)
+    raise ValueError(f"Unknown experiment spec format '{extension}'. Expected .yaml, .toml or .json.")
+
+
+class InstrumentSession:
+    """
+    Instruments of an experiment together with the state shared across its steps.
+
+    The session remembers what was last uploaded to the AWG and configured on the scope, so repeated pulses with
+    the same waveform skip the upload and sequence setup, and unchanged scope settings only re-arm the trigger.
+    The ESP32 connection is wrapped in a RelayController so that relay requests are free when nothing changes.
+    The scope traces of a shot are saved while the SMU measures the read that follows it (see save_traces and
+    measure_and_save).
+
+    Parameters:
+    - awg, scope, smu, esp32: Connected instruments, as returned by the connect_to_* functions. esp32 is None for a
+      setup without relays: the pulses and the SMU measurements then run without switching (see relays_to_smu).
+    - costs (CostProfile): If given, the duration of every instrument operation is recorded in it, to calibrate
+      the run-time estimates of plan_experiment.
+    """
+
+    dry_run = False
+
+    def __init__(self, awg, scope, smu, esp32, costs=None):
+        self.costs = costs
+        self.awg = awg
+        self.scope = scope
+        self.smu = smu
+        self.esp32 = esp32 if isinstance(esp32, RelayController) or esp32 is None else RelayController(esp32)
+        self.sample_rate = awg.sampling_rate if awg is not None else None
+        self._waveforms = {}
+        self._sequence = None
+        self._scope_settings = None
+        self._pending_traces = []
+
+    @classmethod
+    def connect(cls, instruments, costs=None):
+        """
+        Connects the instruments of the 'instruments' section of a spec and puts the AWG in single-burst mode.
+
+        Parameters:
+        - instruments (dict): 'awg' (IP address), 'scope' and 'smu' (VISA resource strings) and 'esp32'
+          ({'port': ..., 'baud_rate': ...}).
+        - costs (CostProfile): Records the operation durations, see InstrumentSession.
+        """
+        awg = connect_to_awg(instruments['awg'])
+        scope = connect_to_scope(instruments['scope'])
+        smu = connect_to_smu(instruments['smu'])
+        esp32 = connect_to_esp32(instruments['esp32']['port'], instruments['esp32'].get('baud_rate', 115200))
+        awg.setting_ch[1].enable = True
+        awg.run_mode = "BURST"
+        awg.trigger_source = 'MAN'  # Manual
+        awg.burst_count = int(1)
+        return cls(awg, scope, smu, esp32, costs)
+
+    def timed(self, category):
+        """Context manager that records the duration of an operation in the cost profile, if there is one."""
+        return self.costs.timed(category) if self.costs is not None else contextlib.nullcontext()
+
+    def load_waveform(self, name, rise_time, hold_time, fall_time, amplitude, delay_time):
+        """Uploads a waveform and selects it as the only sequence entry, unless that is already the case."""
+        key = (rise_time, hold_time, fall_time, amplitude, delay_time)
+        uploaded = self._waveforms.get(name) != key
+        if uploaded:
+            with self.timed('upload'):
+                self.awg.waveforms[name] = create_waveform(rise_time, hold_time, fall_time, amplitude, delay_time,
+                                                           self.sample_rate)
+            self._waveforms[name] = key
+        if uploaded or self._sequence != name:
+            with self.timed('sequence'):
+                setup_sequences(self.awg, [{"number": 1, "waveform": name}])
+            self._sequence = name
+
+    def configure_scope(self, settings):
+        """Applies the scope settings, or only re-arms the trigger if they did not change since the last shot."""
+        if settings == self._scope_settings:
+            with self.timed('scope_arm'):
+                self.scope.write(settings['Trigger Mode'])
+        else:
+            with self.timed('scope_setup'):
+                setup_oscilloscope(self.scope, settings)
+            self._scope_settings = json.loads(json.dumps(settings))
+
+    def fire(self):
+        """Routes the relay to the AWG, fires the loaded sequence and returns the acquired waveforms."""
+        self.flush()
+        if self.esp32 is not None and self.esp32.position != 'switch':
+            with self.timed('relay'):
+                relays(self.esp32, 'switch')
+        with self.timed('trigger'):
+            self.awg.write("OUTPut1:STATe 1")
+            self.awg.enabled = True
+            trigger(self.scope, self.awg)
+        with self.timed('transfer'):
+            return get_waveform_data(self.scope)
+
+    def measure(self, profile, params, filename, last_resistance=None):
+        """
+        Measures with the SMU (see measure_with_smu); profile is the name of the SMU parameters in the spec, under
+        which the duration is recorded ('smu_<profile>'). The traces of the last shot are saved while the SMU
+        measures (see measure_and_save).
+        """
+        if self.esp32 is not None and self.esp32.position != 'measure':
+            with self.timed('relay'):
+                relays(self.esp32, 'measure')
+        shot_file, traces = self._pending_traces.pop() if self._pending_traces else (None, {})
+        self.flush()
+        with self.timed(f'smu_{profile}'):
+            return measure_and_save(self.smu, self.esp32, params, filename, shot_file, last_resistance, **traces)
+
+    def sweep_early_abort(self, profile, params, filename, options):
+        """
+        Runs a sweep that stops once the device switches (see measure_with_smu_early_abort), with the keyword
+        arguments options; timed like measure. Returns the switching voltage, None if the device did not switch.
+        """
+        if self.esp32 is not None and self.esp32.position != 'measure':
+            with self.timed('relay'):
+                relays(self.esp32, 'measure')
+        self.flush()
+        with self.timed(f'smu_{profile}'):
+            return measure_with_smu_early_abort(self.smu, self.esp32, params, filename, **options)
+
+    def save_traces(self, filename, times_i, voltages_i, times_v, voltages_v):
+        """
+        Queues the scope traces of a shot. They are saved during the next SMU measurement, before the next shot, or
+        by flush().
+        """
+        self._pending_traces.append((filename, dict(times_v=times_v, voltages_v=voltages_v, times_i=times_i,
+                                                    voltages_i=voltages_i)))
+
+    def flush(self):
+        """Saves the queued scope traces."""
+        while self._pending_traces:
+            filename, traces = self._pending_traces.pop(0)
+            with self.timed('save'):
+                np.savez_compressed(filename, **traces)
+
+    def record(self, file_name, voltage, resistance, event):
+        """Appends a line to the resistance log (see record_resistance)."""
+        with self.timed('record'):
+            record_resistance(file_name, voltage, resistance, event)
+
+
+class Step:
+    """Base class of the compiled steps of an experiment."""
+
+    kind = None
+    index = 0
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def run(self, context):
+        raise NotImplementedError
+
+    def children(self):
+        return []
+
+
+class SetStep(Step):
+    """{'set': {'V_RESET': 'V_RESET_0'}} assigns variables."""
+
+    kind = 'set'
+
+    def run(self, context):
+        for name, value in self.spec['set'].items():
+            context.variables[name] = evaluate(value, context.variables)
+
+
+class SweepStep(Step):
+    """
+    {'sweep': 'sweep', 'stop_voltage': 'V_sweep', 'label': 'sweep_{V_sweep}V'} runs the SMU profile 'sweep' with
+    the given parameters overridden and saves the data; nothing is recorded in the resistance log.
+
+    'early_abort': {'switching_resistance': 'LRS_lim'} stops the up-ramp as soon as the device switches (see
+    measure_with_smu_early_abort, whose keyword arguments it takes; true for the defaults) and stores the
+    switching voltage in the variable V_switch (None if the device did not switch).
+    """
+
+    kind = 'sweep'
+
+    def _params(self, context):
+        params = dict(context.spec['smu'][self.spec[self.kind]])
+        for key in ('start_voltage', 'stop_voltage', 'points', 'NPLC', 'compliance_current'):
+            if key in self.spec:
+                params[key] = evaluate(self.spec[key], context.variables)
+        if 'sweep_direction' in self.spec:
+            # an SCPI token ('SING', 'DOUB'), not an expression
+            params['sweep_direction'] = render(self.spec['sweep_direction'], context.variables)
+        return params
+
+    def _filename(self, context, default_label):
+        label = render(self.spec.get('label', default_label), context.variables)
+        return generate_filename(label, context.file_path(), '.npz')
+
+    def _measure(self, context, default_label):
+        target = self.spec.get('predict_range')
+        last = None
+        if target:
+            target = None if target is True else evaluate(target, context.variables)
+            last = expected_resistance(context.variables.get('R'), target)
+        return context.session.measure(self.spec[self.kind], self._params(context),
+                                       self._filename(context, default_label), last_resistance=last)
+
+    def run(self, context):
+        options = self.spec.get('early_abort')
+        if not options:
+            self._measure(context, f'{self.spec[self.kind]}')
+            return
+        options = {} if options is True else {k: evaluate(v, context.variables) for k, v in options.items()}
+        context.variables['V_switch'] = context.session.sweep_early_abort(
+            self.spec[self.kind], self._params(context), self._filename(context, f'{self.spec[self.kind]}'), options)
+
+
+class ReadStep(SweepStep):
+    """
+    {'read': 'read', 'label': 'read_after_SET_{V_SET}V', 'event': 'after_SET_{T_SET:.1e}', 'voltage': 'V_SET'}
+    reads the resistance with the SMU profile 'read' and records it in the resistance log with the given voltage
+    and event. The result is stored in the variable R and, with 'as': name, also under that name.
+    'predict_range': True fixes the current range from the previous R (see measure_with_smu); after a pulse give its
+    target instead, e.g. 'predict_range': 'LRS_lim', to cover the switched state too (see expected_resistance).
+    """
+
+    kind = 'read'
+
+    def run(self, context):
+        resistance = self._measure(context, 'read')
+        print(f"Resistance {render(self.spec.get('event', ''), context.variables)} =", resistance)
+        if self.spec.get('record', True):
+            context.record(evaluate(self.spec.get('voltage', 0), context.variables), resistance,
+                           render(self.spec.get('event', 'read'), context.variables))
+        context.variables['R'] = resistance
+        if 'as' in self.spec:
+            context.variables[self.spec['as']] = resistance
+
+
+class PulseStep(Step):
+    """
+    {'pulse': 'SET', 'amplitude': 'V_SET', 'width': 'T_SET', 'scope': 'SET', 'label': 'SET_{V_SET}V_{T_SET:.1e}s'}
+    fires a trapezoidal pulse through the AWG and saves the scope traces.
+
+    'rise_time', 'fall_time' and 'delay' default to the 'waveform' section of the spec. 'scope' names the scope
+    settings; 'autoscale' adapts them to the pulse like the PTE scripts do, with the factors 'current' (0.033),
+    'current_offset' (2.8), 'voltage' (0.33), 'trigger' (0.7) and 'timebase' (True) as keys.
+    """
+
+    kind = 'pulse'
+
+    def scope_settings(self, context, amplitude, pulse_time):
+        settings = json.loads(json.dumps(context.spec['scope'][self.spec['scope']]))
+        autoscale = self.spec.get('autoscale')
+        if autoscale:
+            autoscale = {} if autoscale is True else autoscale
+            if autoscale.get('timebase', True):
+                settings['Timebase Scale'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase")
+                settings['Timebase Position'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase") * 2
+            current = adjust_oscilloscope_scale(amplitude * autoscale.get('current', 0.033), "voltage")
+            voltage = adjust_oscilloscope_scale(amplitude * autoscale.get('voltage', 0.33), "voltage")
+            settings['Channel 1 Scale'] = current
+            settings['Channel 1 Offset'] = current * autoscale.get('current_offset', 2.8)
+            settings['Channel 2 Scale'] = voltage
+            settings['Channel 2 Offset'] = voltage * 3
+            settings['Trigger Level']['Level'] = amplitude * autoscale.get('trigger', 0.7)
+        return settings
+
+    def waveform(self, context):
+        defaults = context.spec.get('waveform', {})
+        values = {}
+        for key, default in (('rise_time', 2e-9), ('fall_time', 2e-9), ('delay', 1e-6)):
+            values[key] = float(evaluate(self.spec.get(key, defaults.get(key, default)), context.variables))
+        values['amplitude'] = float(evaluate(self.spec['amplitude'], context.variables))
+        values['width'] = float(evaluate(self.spec['width'], context.variables))
+        return values
+
+    def run(self, context):
+        w = self.waveform(context)
+        session = context.session
+        session.load_waveform(self.spec['pulse'], w['rise_time'], w['width'], w['fall_time'], w['amplitude'],
+                              w['delay'])
+        pulse_time = w['rise_time'] + w['width'] + w['fall_time']
+        session.configure_scope(self.scope_settings(context, w['amplitude'], pulse_time))
+        times_i, voltages_i, times_v, voltages_v = session.fire()
+        label = render(self.spec.get('label', f"{self.spec['pulse']}_{w['amplitude']}V"), context.variables)
+        context.session.save_traces(generate_filename(label, context.file_path(), '.npz'), times_i, voltages_i,
+                                    times_v, voltages_v)
+
+
+class BlockStep(Step):
+    """Base class of the steps that contain other steps."""
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.steps = [compile_step(s) for s in spec.get('steps', [])]
+
+    def children(self):
+        return self.steps
+
+    def run_steps(self, context, steps=None):
+        for step in self.steps if steps is None else steps:
+            step.run(context)
+
+
+class GridStep(BlockStep):
+    """
+    {'grid': {'T_SET': {'logspace': [-8.7, -5, 30]}, 'V_SET': {'linspace': [0.2, 2.5, 30], 'round': 2}},
+     'steps': [...]} runs the steps for every combination, the first variable being the outer loop.
+
+    With a run journal, every combination is a unit of work: completed ones are skipped on resume. A health rule
+    with the action 'skip_row' ends the innermost loop, e.g. the remaining V_SET of a T_SET.
+
+    With a 'budget' (seconds, an expression), the grid stops once the next point is not expected to finish in time,
+    from the duration of a point measured in earlier runs (the 'point_<index>' entry of the cost profile) and in
+    this run. If the whole grid does not fit, it is measured coarse to fine instead of row by row (see
+    coarse_to_fine), so that whenever it stops the map covers the whole grid uniformly, only at a lower density.
+    'order' ('auto', 'raster' or 'coarse_to_fine') overrides that choice.
+
+    The budget is shared with the grids nested in it: each gets the time left divided by the points of the
+    enclosing grid still to run (or its own budget, if smaller), e.g. the PTE map of each repetition of a pad an
+    equal share of the pad's budget. A grid with nested grids runs in raster order until its time is used up.
+    """
+
+    kind = 'grid'
+
+    def run(self, context, axes=None):
+        if axes is None and ('budget' in self.spec or context.budget is not None
+                             or self.spec.get('order', 'raster') != 'raster'):
+            self.run_budgeted(context)
+            return
+        axes = list(self.spec['grid'].items()) if axes is None else axes
+        if not axes:
+            self.run_point(context)
+            return
+        name, values = axes[0]
+        for value in expand_values(values, context.variables):
+            context.variables[name] = value
+            print(f'{name} = {value}')
+            context.units.append(unit_key(**{name: value}))
+            try:
+                self.run(context, axes[1:])
+            except SkipRow:
+                if len(axes) > 1:
+                    raise
+                print(f'rest of the {name} row skipped')
+                return
+            finally:
+                context.units.pop()
+
+    def run_point(self, context):
+        unit = unit_key(self.index, *context.units)
+        if context.journal is not None and context.journal.is_done(unit):
+            print(f'{unit} already completed, skipped')
+            return False
+        self.run_steps(context)
+        if context.journal is not None:
+            # the point is only complete once its traces are on disk
+            context.session.flush()
+            context.journal.complete(unit, **context.state())
+        return True
+
+    def nested_grids(self, steps=None):
+        """True if a grid runs inside the points of this one."""
+        return any(isinstance(step, GridStep) or self.nested_grids(step.children())
+                   for step in (self.steps if steps is None else steps))
+
+    def run_budgeted(self, context):
+        session = context.session
+        names = list(self.spec['grid'])
+        axes = [expand_values(values, context.variables) for values in self.spec['grid'].values()]
+        shape = tuple(len(values) for values in axes)
+        total = int(np.prod(shape))
+        seconds = float(evaluate(self.spec.get('budget', float('inf')), context.variables))
+        parent = context.budget
+        if parent is not None:
+            seconds = min(seconds, parent.share())
+        nested = self.nested_grids()
+        category = f'point_{self.index}'
+        estimate = session.costs.cost(category) if session.costs is not None else 0.0
+        # a dry run spends the estimated time of its operations instead of wall time
+        clock = (lambda: sum(session.seconds.values())) if session.dry_run else time.monotonic
+        budget = TimeBudget(seconds, estimate or None, clock)
+        order = self.spec.get('order', 'auto')
+        if order == 'auto':
+            order = ('raster' if nested or np.isinf(seconds) or (estimate and budget.fits(total))
+                     else 'coarse_to_fine')
+        if order == 'coarse_to_fine':
+            points = coarse_to_fine(shape)
+        else:
+            points = [(0, index) for index in np.ndindex(*shape)]
+        print(f'Grid of {total} points, budget {seconds:.0f} s'
+              + (f', about {min(total, int(seconds / estimate))} points at {estimate:.1f} s' if estimate else '')
+              + f', {order} order')
+        skipped_rows = set()
+        measured = 0
+        level = 0
+        context.budget = budget
+        try:
+            for position, (point_level, index) in enumerate(points):
+                if point_level != level:
+                    print(f'Refinement level {level} completed, {measured} of {total} points')
+                    level = point_level
+                if index[:-1] in skipped_rows:
+                    continue
+                # the points of nested grids fit themselves into their share
+                if not (budget.remaining() > 0 if nested else budget.fits()):
+                    print(f'Time budget reached after {measured} of {total} points (level {level})')
+                    break
+                budget.pending = len(points) - position
+                context.variables.update({name: values[i] for name, values, i in zip(names, axes, index)})
+                context.units.extend(unit_key(**{name: values[i]}) for name, values, i in zip(names, axes, index))
+                print(', '.join(f'{name} = {values[i]}' for name, values, i in zip(names, axes, index)))
+                start = clock()
+                try:
+                    if self.run_point(context):
+                        budget.add(clock() - start)
+                        if session.costs is not None and not session.dry_run:
+                            session.costs.record(category, clock() - start)
+                    measured += 1
+                except SkipRow:
+                    print(f'rest of the {names[-1]} row skipped')
+                    skipped_rows.add(index[:-1])
+                finally:
+                    del context.units[-len(names):]
+        finally:
+            context.budget = parent
+
+
+class VerifyStep(BlockStep):
+    """
+    Closed loop: runs the steps until the condition holds.
+
+    {'verify': {'until': 'R <= LRS_lim', 'max_tries': 3}, 'steps': [...]} repeats the initialization sweep of the
+    write-verify scripts. With 'vary': {'V_RESET': {'linspace': ['V_RESET_0', 3, 10]}} the variable takes the
+    next value on every try, like the RESET ramps. 'retry_steps' run before the steps on every try but the first.
+    After the loop, the variable 'verified' tells whether the condition was met. The health rules see only the
+    last read of the loop (see ExperimentContext.ramp).
+
+    Instead of 'until' and 'vary', a step policy (see write_verify) chooses the values towards a target window of R:
+    {'verify': {'variable': 'V_RESET', 'target': ['HRS_lim', None], 'polarity': 'increase', 'max_tries': 10,
+    'policy': {'ispp': {'start': 'V_RESET_0', 'limit': 3, 'step': 0.05, 'increment': 0.05}}}, 'steps': [...]}
+    with one of the policies 'linear', 'ispp', 'binary', 'model' and 'repeat' and its parameters. A policy loop
+    needs 'max_tries', so every loop on the hardware has a budget.
+    """
+
+    kind = 'verify'
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        verify = spec['verify']
+        if 'policy' in verify and 'max_tries' not in verify:
+            raise ValueError(f"A verify loop with a step policy needs 'max_tries', got {verify}")
+        self.retry_steps = [compile_step(s) for s in spec.get('retry_steps', [])]
+
+    def children(self):
+        return self.retry_steps + self.steps
+
+    def run(self, context):
+        with context.ramp():
+            if 'policy' in self.spec['verify']:
+                self.run_policy(context)
+            else:
+                self.run_ramp(context)
+
+    def run_ramp(self, context):
+        verify = self.spec['verify']
+        (name, values), = verify['vary'].items() if 'vary' in verify else ((None, None),)
+        values = expand_values(values, context.variables) if name else None
+        max_tries = int(verify.get('max_tries', len(values) if values else 1))
+        context.variables['verified'] = False
+        attempt = -1
+        for attempt in range(max_tries if values is None else min(max_tries, len(values))):
+            if name:
+                context.variables[name] = values[attempt]
+            if attempt > 0:
+                self.run_steps(context, self.retry_steps)
+            self.run_steps(context)
+            if evaluate(verify['until'], context.variables):
+                context.variables['verified'] = True
+                return
+        print(f"verify loop stopped after {attempt + 1} tries without reaching {verify['until']}")
+
+    def run_policy(self, context):
+        verify = self.spec['verify']
+        variables = context.variables
+        (kind, parameters), = verify['policy'].items()
+        policy = STEP_POLICIES[kind](**{key: evaluate(value, variables) for key, value in parameters.items()})
+        low, high = evaluate(verify['target'], variables)
+        max_tries = int(evaluate(verify['max_tries'], variables))
+
+        def attempt(value):
+            variables[verify['variable']] = value
+            self.run_steps(context)
+            return variables['R']
+
+        variables['verified'] = write_verify(
+            attempt, policy, low, high, verify.get('polarity', 'increase'), max_tries,
+            restore=lambda: self.run_steps(context, self.retry_steps))[0]
+
+
+class ThresholdStep(BlockStep):
+    """
+    Adaptive search of a switching threshold instead of a full grid column (see threshold_search).
+
+    {'threshold': {'variable': 'V_SET', 'range': [0.2, 2.5], 'resolution': 0.02, 'switched': 'R <= LRS_lim'},
+     'steps': [...], 'restore_steps': [...]} probes the variable with the steps (e.g. SET pulse and read), tests
+    the 'switched' condition afterwards and then runs the restore_steps (e.g. the initialization and RESET
+    verify loops) to bring the device back to its initial state. Reads inside the steps are recorded as usual, so
+    the resistance log keeps its format.
+
+    The threshold found is stored in the variable '<variable>_threshold' and seeds the next search, e.g. for the
+    next T_SET of an enclosing grid; a seeded search starts with 'step' (default four times the resolution),
+    an unseeded one with 'seed' (default the lower end of the range). With 'event', the threshold is also
+    recorded in the resistance log under that event, with the resistance of the last switched probe.
+    """
+
+    kind = 'threshold'
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.restore_steps = [compile_step(s) for s in spec.get('restore_steps', [])]
+
+    def children(self):
+        return self.steps + self.restore_steps
+
+    def run(self, context):
+        search = self.spec['threshold']
+        variables = context.variables
+        name = search['variable']
+        low, high = (float(v) for v in evaluate(search['range'], variables))
+        resolution = float(evaluate(search['resolution'], variables))
+        seed = variables.get(f'{name}_threshold')
+        step = None
+        if seed is not None:
+            step = float(evaluate(search.get('step', 4 * resolution), variables))
+        elif 'seed' in search:
+            seed = float(evaluate(search['seed'], variables))
+        switched_resistance = {}
+
+        def measure(value):
+            variables[name] = value
+            print(f'{name} = {value}')
+            self.run_steps(context)
+            switched = bool(evaluate(search['switched'], variables))
+            if switched:
+                switched_resistance[value] = variables.get('R')
+            self.run_steps(context, self.restore_steps)
+            return switched
+
+        threshold, probes = threshold_search(measure, low, high, resolution, seed, step, search.get('digits', 2))
+        print(f'{name} threshold = {threshold} after {len(probes)} probes')
+        if threshold is not None:
+            variables[f'{name}_threshold'] = threshold
+        if threshold is not None and 'event' in self.spec:
+            context.record(threshold, switched_resistance.get(threshold), render(self.spec['event'], variables))
+
+
+STEP_TYPES = {cls.kind: cls for cls in (SetStep, SweepStep, ReadStep, PulseStep, GridStep, VerifyStep,
+                                        ThresholdStep)}
+
+
+def compile_step(spec):
+    """Compiles one step of a spec; its type is the key out of STEP_TYPES it contains."""
+    kinds = [kind for kind in STEP_TYPES if kind in spec]
+    if len(kinds) != 1:
+        raise ValueError(f"A step needs exactly one of {list(STEP_TYPES)}, got {spec}")
+    return STEP_TYPES[kinds[0]](spec)
+
+
+class ExperimentContext:
+    """
+    Runtime state of an experiment: its spec, the instrument session, the current variables, the run journal
+    (None if the run is not journaled) and the health monitor (None without health rules).
+
+    The variables are those of the spec, overridden by the priors (see ProfileRegistry.variables), the state of the
+    run journal and the explicit variables, in this order.
+    """
+
+    def __init__(self, spec, session, variables=None, journal=None, health=None, priors=None):
+        self.spec = spec
+        self.session = session
+        self.journal = journal
+        self.health = health
+        self.units = []
+        # last read of every event of the verify loop running, handed to the health rules when the loop ends
+        self._ramp = None
+        # TimeBudget of the innermost budgeted grid running, shared with the grids nested in it
+        self.budget = None
+        self.variables = dict(spec.get('variables', {}))
+        self.variables.update(priors or {})
+        if journal is not None:
+            self.variables.update(journal.state)
+        self.variables.update(variables or {})
+
+    def state(self):
+        """The variables that are saved in the run journal, i.e. all numbers, strings and booleans."""
+        return {name: value for name, value in self.variables.items()
+                if isinstance(value, (int, float, str, bool, np.generic))}
+
+    def file_path(self):
+        """The data folder of the sample section, created on first use, as built by the scripts."""
+        sample = self.spec['sample']
+        path = f"{sample['root']}/{sample['sample']}/{render(sample['pad'], self.variables)}/"
+        sub_folder = render(sample.get('sub_folder', '0'), self.variables)
+        if sub_folder != '0':
+            path += sub_folder + '/'
+        if not self.session.dry_run and not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def record_file(self):
+        """The resistance log of the sample section."""
+        sample = self.spec['sample']
+        return (f"{sample['root']}/{sample['sample']}/{render(sample['pad'], self.variables)}"
+                f"{sample.get('record_ext', '.txt')}")
+
+    def record(self, voltage, resistance, event):
+        """Records a resistance in the resistance log and applies the health rules to it."""
+        self.session.record(self.record_file(), voltage, resistance, event)
+        self._observe(voltage, resistance, event)
+
+    def _observe(self, voltage, resistance, event):
+        if self.health is None:
+            return
+        if self._ramp is not None:
+            self._ramp.pop(event, None)
+            self._ramp[event] = (voltage, resistance, event)
+        else:
+            self.health.observe(voltage, resistance, event)
+
+    @contextlib.contextmanager
+    def ramp(self):
+        """
+        Counts a closed loop once in the health rules: only the last read of every event of the loop is applied to
+        them, when the loop ends, so e.g. a StuckRule on 'after_RESET' counts failed RESET ramps, not their tries.
+        """
+        outer, self._ramp = self._ramp, {}
+        try:
+            yield
+        finally:
+            records, self._ramp = self._ramp, outer
+        for record in records.values():
+            self._observe(*record)
+
+    def journal_file(self):
+        """
+        The run journal of the sample section, next to the resistance log. Its name holds the protocol 'name', the
+        sub folder and the 'job' of the sample section, so that every protocol and every repetition run on the pad
+        (e.g. sub_folder '{i+4}th_SET') resumes only its own grid points and state.
+        """
+        sample = self.spec['sample']
+        sub_folder = render(sample.get('sub_folder', '0'), self.variables)
+        parts = [self.spec.get('name'), sub_folder if sub_folder != '0' else None, sample.get('job')]
+        job = ''.join(f"_{render(str(part), self.variables).replace('/', '_')}" for part in parts if part)
+        return (f"{sample['root']}/{sample['sample']}/{render(sample['pad'], self.variables)}{job}"
+                f"{sample.get('journal_ext', '_journal.jsonl')}")
+
+
+class Experiment:
+    """
+    An experiment compiled from a declarative spec (a dict, or a YAML/TOML/JSON file via load_experiment_spec).
+
+    The spec has the sections
+    - 'instruments': addresses for InstrumentSession.connect (not needed if a session is passed to run()),
+    - 'name': the protocol name, the file name of a spec loaded from a file,
+    - 'sample': 'root', 'sample', 'pad', 'sub_folder' and 'record_ext', laid out like File_Path/Record_file in the
+      scripts; 'pad' and 'sub_folder' may contain {expression} fields; the optional 'material' (e.g. 'GST225')
+      selects the device profile of the sample (see ProfileRegistry) and the optional 'job' tells apart the
+      journals of runs on the same pad (see ExperimentContext.journal_file),
+    - 'scope': named oscilloscope settings dicts, 'smu': named SMU parameter dicts,
+    - 'waveform': defaults for 'rise_time', 'fall_time' and 'delay',
+    - 'variables': initial variables, e.g. limits and voltages,
+    - 'steps': the protocol, made of set, sweep, read, pulse, grid and verify steps (see the Step classes),
+    - 'health': optional health rules applied to every recorded read, e.g. [{'stuck': {'below': 'HRS_lim',
+      'event': 'after_RESET', 'count': 10, 'action': 'abort_pad'}}] (see HEALTH_RULES and HEALTH_ACTIONS).
+
+    Usage:
+    - experiment = Experiment(load_experiment_spec('pte_write_verify.yaml'))
+    - experiment.run()
+    """
+
+    def __init__(self, spec):
+        if isinstance(spec, str):
+            path, spec = spec, load_experiment_spec(spec)
+            spec.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+        self.spec = spec
+        self.steps = [compile_step(s) for s in spec.get('steps', [])]
+        for index, step in enumerate(self.walk()):
+            step.index = index
+
+    def walk(self, steps=None):
+        """Yields all compiled steps, depth first."""
+        for step in self.steps if steps is None else steps:
+            yield step
+            yield from self.walk(step.children())
+
+    def health_monitor(self, variables):
+        """The HealthMonitor of the 'health' section of the spec, None if there is none."""
+        if not self.spec.get('health'):
+            return None
+        rules = []
+        for rule in self.spec['health']:
+            (kind, parameters), = rule.items()
+            # event names and actions are plain strings, the other parameters expressions
+            rules.append(HEALTH_RULES[kind](**{key: value if key in ('event', 'low_event', 'high_event', 'action')
+                                               else evaluate(value, variables)
+                                               for key, value in (parameters or {}).items()}))
+        return HealthMonitor(rules)
+
+    def run(self, session=None, variables=None, resume=None, profiles=None):
+        """
+        Runs the experiment.
+
+        Parameters:
+        - session (InstrumentSession): Shared instruments; connected from the spec if not given.
+        - variables (dict): Overrides of the spec variables.
+        - resume (bool): None runs without journal. Otherwise the completed grid points are journaled (see
+          RunJournal) in the journal file of the sample section; True skips the points completed by an earlier run
+          and restores its variables (e.g. V_RESET or a threshold seed), False starts a new run.
+        - profiles (ProfileRegistry): If the sample section has a 'material', the run starts from the priors of
+          its die (e.g. V_RESET_0, V_SET_threshold) and its resistance log is learned when it completes.
+
+        Raises:
+        - NextJob, AbortPad: If a health rule ended the run (see HealthMonitor).
+
+        Returns:
+        - ExperimentContext: The final state, e.g. context.variables['R'] is the last resistance read.
+        """
+        if session is None:
+            session = InstrumentSession.connect(self.spec['instruments'])
+        material = self.spec.get('sample', {}).get('material')
+        die = self.spec.get('sample', {}).get('sample')
+        priors = None
+        if profiles is not None and material:
+            priors = profiles.variables(material, die, self.spec.get('variables'))
+        journal = None
+        if resume is not None:
+            journal = RunJournal(ExperimentContext(self.spec, session, variables, priors=priors).journal_file(),
+                                 resume)
+        context = ExperimentContext(self.spec, session, variables, journal, priors=priors)
+        if not session.dry_run:
+            context.health = self.health_monitor(context.variables)
+        try:
+            for step in self.steps:
+                step.run(context)
+        finally:
+            session.flush()
+        if priors is not None and not session.dry_run and os.path.exists(context.record_file()):
+            profiles.learn_resistance_log(material, die, context.record_file(), context.variables['LRS_lim'],
+                                          context.variables['HRS_lim'])
+            profiles.save()
+        return context
+
+
+def run_experiment(spec, session=None, variables=None, resume=None, profiles=None):
+    """Compiles and runs an experiment spec, see Experiment."""
+    return Experiment(spec).run(session, variables, resume, profiles)
@@ -0,0 +1,232 @@
+import math
+
+from .PET_module import record_resistance
+
+
+class HealthAbort(Exception):
+    """Raised by a health rule to stop measuring a device that no longer produces useful data."""
+
+    def __init__(self, rule, message):
+        super().__init__(f"{rule.name}: {message}")
+        self.rule = rule
+
+
+class SkipRow(HealthAbort):
+    """Skips the rest of the current grid row (the innermost loop of a grid), e.g. the remaining V_SET of a T_SET."""
+
+
+class NextJob(HealthAbort):
+    """Ends the current job; a campaign goes on with the next queued job."""
+
+
+class AbortPad(NextJob):
+    """Ends the current job and skips the queued jobs on the same pad."""
+
+
+HEALTH_ACTIONS = {'skip_row': SkipRow, 'next_job': NextJob, 'abort_pad': AbortPad}
+
+
+class HealthRule:
+    """
+    Base class of the health rules: check(history) looks at the resistance log so far and returns a message if the
+    device is unhealthy, None otherwise.
+
+    Parameters:
+    - count (int): Number of consecutive offending records before the rule triggers.
+    - event (str): Only records whose event starts with this are considered, e.g. 'after_RESET'; None for all.
+    - action (str): 'skip_row', 'next_job' or 'abort_pad', see HEALTH_ACTIONS.
+    """
+
+    name = 'health'
+
+    def __init__(self, count=3, event=None, action='abort_pad'):
+        if action not in HEALTH_ACTIONS:
+            raise ValueError(f"Unknown health action '{action}'. Expected one of {list(HEALTH_ACTIONS)}.")
+        self.count = count
+        self.event = event
+        self.action = action
+
+    def records(self, history):
+        """The (voltage, resistance, event) records the rule looks at."""
+        return [r for r in history if self.event is None or str(r[2]).startswith(self.event)]
+
+    def offending(self, voltage, resistance):
+        raise NotImplementedError
+
+    def check(self, history):
+        records = self.records(history)[-self.count:]
+        if len(records) == self.count and all(self.offending(v, r) for v, r, _ in records):
+            return f"{self.count} consecutive {self.event or 'reads'} {self.describe()}"
+        return None
+
+    def describe(self):
+        return ''
+
+
+class StuckRule(HealthRule):
+    """
+    The device is stuck: the resistance stays below 'below' (e.g. HRS_lim after RESET, stuck in LRS) or above
+    'above' (e.g. LRS_lim after SET, stuck in HRS).
+    """
+
+    name = 'stuck'
+
+    def __init__(self, below=None, above=None, count=5, event=None, action='abort_pad'):
+        super().__init__(count, event, action)
+        self.below = below
+        self.above = above
+
+    def offending(self, voltage, resistance):
+        return ((self.below is not None and resistance < self.below) or
+                (self.above is not None and resistance > self.above))
+
+    def describe(self):
+        return f"below {self.below:.3g} ohm" if self.below is not None else f"above {self.above:.3g} ohm"
+
+
+class OpenCircuitRule(HealthRule):
+    """The probe lost contact or the device is open: the resistance is above limit, infinite or not a number."""
+
+    name = 'open circuit'
+
+    def __init__(self, limit=1e9, count=3, event=None, action='abort_pad'):
+        super().__init__(count, event, action)
+        self.limit = limit
+
+    def offending(self, voltage, resistance):
+        return resistance is None or math.isnan(resistance) or resistance > self.limit
+
+    def describe(self):
+        return f"above {self.limit:.3g} ohm"
+
+
+class ComplianceRule(HealthRule):
+    """
+    The reads hit the SMU compliance: the resistance is at or below read_voltage / compliance_current, i.e. the
+    device is shorted.
+    """
+
+    name = 'compliance'
+
+    def __init__(self, read_voltage=0.1, compliance_current=0.01, count=3, event=None, action='abort_pad'):
+        super().__init__(count, event, action)
+        self.limit = read_voltage / compliance_current
+
+    def offending(self, voltage, resistance):
+        return resistance is not None and resistance <= self.limit
+
+    def describe(self):
+        return f"at the compliance ({self.limit:.3g} ohm)"
+
+
+class WindowCollapseRule(HealthRule):
+    """
+    The memory window collapses: the ratio of the high-state read (event high_event, e.g. 'after_RESET') to the
+    low-state read (low_event, e.g. 'after_SET') of a cycle stays below min_ratio for count cycles. A cycle ends
+    with the next low-state read and only its last high-state read counts, so the retries of a RESET ramp make up
+    one cycle.
+    """
+
+    name = 'window collapse'
+
+    def __init__(self, min_ratio=10, low_event='after_SET', high_event='after_RESET', count=5, action='abort_pad'):
+        super().__init__(count, None, action)
+        self.min_ratio = min_ratio
+        self.low_event = low_event
+        self.high_event = high_event
+
+    def check(self, history):
+        ratios = []
+        low = high = None
+        for _, resistance, event in history:
+            if str(event).startswith(self.low_event):
+                if low and high is not None:
+                    ratios.append(high / low)
+                low, high = resistance, None
+            elif str(event).startswith(self.high_event):
+                high = resistance
+        ratios = ratios[-self.count:]
+        if len(ratios) == self.count and all(ratio < self.min_ratio for ratio in ratios):
+            return f"HRS/LRS ratio below {self.min_ratio} for {self.count} cycles (last {ratios[-1]:.3g})"
+        return None
+
+
+HEALTH_RULES = {'stuck': StuckRule, 'open': OpenCircuitRule, 'compliance': ComplianceRule,
+                'window': WindowCollapseRule}
+
+
+class HealthMonitor:
+    """
+    Evaluates health rules online over the resistance log of a device and stops the run once one triggers, by
+    raising the exception of the rule's action (SkipRow, NextJob or AbortPad).
+
+    Parameters:
+    - rules (list): HealthRule instances.
+    - raise_errors (bool): If False, the exception is not raised but kept in triggered, for scripts that check
+      it in their loops.
+
+    Usage:
+    - health = HealthMonitor([StuckRule(below=HRS_lim, event='after_RESET', count=10)], raise_errors=False)
+    - health.record(Record_file, V_RESET, R_read, 'after_RESET')  # instead of record_resistance
+    - if health.triggered: break
+
+    Attributes:
+    - triggered (HealthAbort): The action of the last rule that triggered, None while the device is healthy.
+    """
+
+    def __init__(self, rules, raise_errors=True):
+        self.rules = list(rules)
+        self.raise_errors = raise_errors
+        self.history = []
+        self.triggered = None
+
+    def observe(self, voltage, resistance, event):
+        """Adds a record and applies the rules; raises the action of the first rule that triggers."""
+        self.history.append((voltage, resistance, event))
+        for rule in self.rules:
+            message = rule.check(self.history)
+            if message:
+                print(f"Health rule '{rule.name}' triggered ({rule.action}): {message}")
+                # the rules start over, e.g. for the next row after a skip
+                self.history.clear()
+                self.triggered = HEALTH_ACTIONS[rule.action](rule, message)
+                if self.raise_errors:
+                    raise self.triggered
+                return
+
+    def record(self, file_name, voltage, resistance, event):
+        """Records the resistance (see record_resistance), then applies the rules."""
+        record_resistance(file_name, voltage, resistance, event)
+        self.observe(voltage, resistance, event)
+
+    def reset(self):
+        """Forgets the history and the triggered rule, e.g. when a new device is measured."""
+        self.history.clear()
+        self.triggered = None
+
+
+def check_resistance_log(file_name, rules):
+    """
+    Applies health rules offline to a resistance log written by record_resistance.
+
+    Returns:
+    - list: (line number, rule name, message) for every point at which a rule triggered.
+    """
+    findings = []
+    history = []
+    with open(file_name) as file:
+        for number, line in enumerate(file, 1):
+            parts = line.strip().split(',')
+            if len(parts) < 4:
+                continue
+            try:
+                history.append((float(parts[2]), float(parts[3]), parts[1]))
+            except ValueError:
+                continue
+            for rule in rules:
+                message = rule.check(history)
+                if message:
+                    findings.append((number, rule.name, message))
+                    history = []
+                    break
+    return findings
@@ -0,0 +1,104 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+
+def unit_key(*parts, **values):
+    """
+    Builds the journal key of a unit of work from its loop indices and variables.
+
+    Examples:
+    - unit_key(i, T_SET=T_SET, V_SET=V_SET) returns e.g. '0/T_SET=2e-09/V_SET=0.2'.
+    """
+    items = [str(p) for p in parts] + [f'{name}={_plain(value)}' for name, value in values.items()]
+    return '/'.join(items)
+
+
+def _plain(value):
+    """Converts numpy scalars to Python scalars, so they are JSON serializable and print like floats."""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class RunJournal:
+    """
+    Append-only journal of the completed units of work of a campaign, to resume it after a crash or VISA timeout.
+
+    Every completed unit (a PTE grid point, an endurance checkpoint, a drift segment) is written as one JSON line
+    together with the controller state at that point, e.g. the current V_RESET of the endurance script. Each line is
+    flushed to disk before the next unit starts, so at most the unit in progress is lost. On resume, completed units
+    are skipped and the state of the last completed unit is restored.
+
+    Parameters:
+    - filename (str): Journal file, e.g. next to the resistance log (File_PadName + '_journal.jsonl').
+    - resume (bool): If False, a new run starts; earlier entries stay in the file but are ignored.
+
+    Usage:
+    - journal = RunJournal(Record_file.replace('.txt', '_journal.jsonl'))
+    - V_RESET = journal.get('V_RESET', 1.8)
+    - for jj, ii in enumerate(step):
+    -     if journal.is_done(unit_key(jj, cycles=cycles[jj])): continue
+    -     ...
+    -     journal.complete(unit_key(jj, cycles=cycles[jj]), V_RESET=V_RESET)
+    """
+
+    def __init__(self, filename, resume=True):
+        self.filename = filename
+        self.completed = set()
+        self.state = {}
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._terminate_last_line()
+        if resume and os.path.exists(filename):
+            self._load()
+        else:
+            self._append({'start': True})
+        if self.completed:
+            print(f'Resuming from {filename}: {len(self.completed)} completed units, state {self.state}')
+
+    def _terminate_last_line(self):
+        # a crash may leave the last line incomplete; the next entry must not be appended to it
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            with open(self.filename, 'rb+') as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b'\n':
+                    file.write(b'\n')
+
+    def _load(self):
+        with open(self.filename) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the line written during the crash may be incomplete
+                    continue
+                if entry.get('start'):
+                    self.completed.clear()
+                    self.state.clear()
+                elif 'unit' in entry:
+                    self.completed.add(entry['unit'])
+                    self.state.update(entry.get('state', {}))
+
+    def _append(self, entry):
+        entry = {'time': datetime.now().strftime('%Y-%m-%d_%H%M%S'), **entry}
+        with open(self.filename, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+    def is_done(self, unit):
+        """Returns True if the unit was completed in the run being resumed."""
+        return unit in self.completed
+
+    def complete(self, unit, **state):
+        """Records the unit as completed, with the controller state to restore on resume."""
+        state = {name: _plain(value) for name, value in state.items()}
+        self._append({'unit': unit, 'state': state})
+        self.completed.add(unit)
+        self.state.update(state)
+
+    def get(self, name, default=None):
+        """Restored value of a state variable, or default for a new run."""
+        return self.state.get(name, default)
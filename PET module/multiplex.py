@@ -0,0 +1,143 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .PET_module import RELAY_DEVICE_MAP, RelayController
+
+# Instrument each kind of step occupies and the relay position it needs.
+STEP_INSTRUMENTS = {'pulse': 'awg', 'read': 'smu'}
+STEP_POSITIONS = {'pulse': 'switch', 'read': 'measure'}
+OPPOSITE_POSITION = {'switch': 'measure', 'measure': 'switch'}
+
+
+class MultiDeviceExecutor:
+    """
+    Runs measurement protocols on several devices wired to the same AWG, scope and SMU through their own relays
+    (see RELAY_DEVICE_MAP), using the time one device waits to pulse or read another.
+
+    A protocol is a generator function called with a RelayController bound to its device and any extra arguments.
+    It yields steps and receives the result of each step back from the yield:
+    - ('pulse', func): func() fires a pulse through the AWG/scope path; needs the relay in 'switch'.
+    - ('read', func): func() measures with the SMU; needs the relay in 'measure'.
+    - ('wait', seconds): the device idles, e.g. between drift reads; other devices run meanwhile.
+
+    Each instrument runs one step at a time, but a pulse on one device and a read on another run concurrently in
+    worker threads. Before a device is routed to an instrument, every idle device still connected to that
+    instrument is switched away from it, so a pulse never reaches a device it was not meant for. Functions should
+    pass the relay controller they were given (e.g. to measure_with_smu) so that their own relay requests are free.
+
+    Usage:
+    - def drift(relay, V_RESET):
+    -     yield ('pulse', lambda: fire_reset(V_RESET))
+    -     for k in range(100):
+    -         R = yield ('read', lambda: measure_with_smu(smu, relay, smu_read_params, filename))
+    -         yield ('wait', 1)
+    - ex = MultiDeviceExecutor(esp32)
+    - ex.add_device(0, drift, 2.0)
+    - ex.add_device(1, pte, ...)
+    - results = ex.run()
+
+    Attributes:
+    - busy_time (dict): Seconds each instrument spent executing steps during run().
+    - wall_time (float): Duration of the last run() in seconds.
+    """
+
+    def __init__(self, ser, poll_interval=0.002):
+        self.relay = ser if isinstance(ser, RelayController) else RelayController(ser)
+        self.poll_interval = poll_interval
+        self.protocols = {}
+        self.busy_time = {instrument: 0.0 for instrument in STEP_INSTRUMENTS.values()}
+        self.wall_time = 0.0
+
+    def add_device(self, device, protocol, *args, **kwargs):
+        """
+        Registers the protocol to run on device, a key of RELAY_DEVICE_MAP.
+        """
+        if device not in RELAY_DEVICE_MAP:
+            raise ValueError(f"Unknown device '{device}'. Expected one of {list(RELAY_DEVICE_MAP)}.")
+        if device in self.protocols:
+            raise ValueError(f"Device '{device}' already has a protocol.")
+        self.protocols[device] = protocol(self.relay.for_device(device), *args, **kwargs)
+
+    def _can_route(self, device, position, running):
+        # every other device connected (or possibly connected) to position must be idle and movable away
+        for other in self.protocols:
+            if other == device or self.relay.positions.get(other) not in (position, None):
+                continue
+            if other in running:
+                return False
+            for third in running:
+                if third != other and self.relay.positions.get(third) == OPPOSITE_POSITION[position]:
+                    return False
+        return True
+
+    def _route(self, device, position):
+        for other in self.protocols:
+            if other != device and self.relay.positions.get(other) in (position, None):
+                self.relay.set(OPPOSITE_POSITION[position], device=other)
+        self.relay.set(position, device=device)
+
+    def run(self):
+        """
+        Runs all protocols to completion.
+
+        Returns:
+        - dict: The return value of each protocol by device.
+        """
+        steps = {}
+        results = {}
+        wake = {}
+        running = {}   # device -> (instrument, future, start time)
+        busy = set()
+
+        def advance(device, value):
+            try:
+                steps[device] = self.protocols[device].send(value)
+            except StopIteration as stop:
+                steps.pop(device, None)
+                results[device] = stop.value
+
+        t_start = time.monotonic()
+        for device in self.protocols:
+            advance(device, None)
+
+        with ThreadPoolExecutor(max_workers=len(STEP_INSTRUMENTS)) as pool:
+            order = list(self.protocols)
+            while steps or running:
+                progressed = False
+                for device in order:
+                    if device not in steps or device in running:
+                        continue
+                    kind, arg = steps[device]
+                    if kind == 'wait':
+                        now = time.monotonic()
+                        wake.setdefault(device, now + arg)
+                        if now >= wake[device]:
+                            del wake[device]
+                            advance(device, None)
+                            progressed = True
+                        continue
+                    if kind not in STEP_INSTRUMENTS:
+                        raise ValueError(f"Unknown step '{kind}' from device '{device}'.")
+                    instrument = STEP_INSTRUMENTS[kind]
+                    if instrument in busy or not self._can_route(device, STEP_POSITIONS[kind], running):
+                        continue
+                    self._route(device, STEP_POSITIONS[kind])
+                    busy.add(instrument)
+                    running[device] = (instrument, pool.submit(arg), time.monotonic())
+                    progressed = True
+
+                for device, (instrument, future, started) in list(running.items()):
+                    if future.done():
+                        del running[device]
+                        busy.discard(instrument)
+                        self.busy_time[instrument] += time.monotonic() - started
+                        advance(device, future.result())
+                        progressed = True
+
+                # rotate so that no device always gets the instruments first
+                order = order[1:] + order[:1]
+                if not progressed:
+                    time.sleep(self.poll_interval)
+
+        self.wall_time = time.monotonic() - t_start
+        return results
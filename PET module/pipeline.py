@@ -0,0 +1,158 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .PET_module import get_waveform_data, relays, setup_oscilloscope, setup_sequences, trigger
+
+
+class ShotPipeline:
+    """
+    Pipelined shots: the readout, compression and saving of a shot overlap with the SMU read that follows it and
+    with the preparation of the next shot, so the critical path of a shot is mostly hardware time.
+
+    After fire() has triggered, the scope worker transfers the waveform while the caller goes on with the SMU read,
+    and a writer thread compresses and saves it while the scope is set up for the next shot. The AWG worker
+    uploads the next waveform and sequence as soon as it is known, see stage(). Each instrument has one worker,
+    so the operations on one instrument keep their order: the scope is only set up again after its last
+    readout. The queue of shots waiting to be saved is bounded, so a slow disk holds the shots back instead of
+    filling the memory.
+
+    The data dependencies of write-verify loops stay with the caller: the SMU read runs in the calling thread,
+    and the next pulse is only prepared (or staged) once the decision that depends on it has been made.
+
+    Parameters:
+    - awg, scope: The AWG and the oscilloscope.
+    - ser: The ESP32 connection or a RelayController.
+    - max_pending (int): Maximum number of shots waiting to be saved.
+
+    Usage:
+    - pipeline = ShotPipeline(awg, scope, esp32)
+    - pipeline.prepare(SET_settings, [{"number": 1, "waveform": "SET"}], {"SET": SET})
+    - time_0 = pipeline.fire(generate_filename(f'SET_{V_SET}V', File_Path, '.npz'))
+    - R_read = measure_with_smu(smu, esp32, smu_read_params, filename)  # while the shot is read out and saved
+    - pipeline.close()
+    """
+
+    def __init__(self, awg, scope, ser, max_pending=4):
+        self.awg = awg
+        self.scope = scope
+        self.ser = ser
+        self._awg_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='awg')
+        self._scope_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scope')
+        self._awg_future = None
+        self._scope_future = None
+        self._readout = None
+        self._sequence = None
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write, name='shot-writer', daemon=True)
+        self._writer.start()
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                filename, (times_i, voltages_i, times_v, voltages_v) = item
+                np.savez_compressed(filename, times_v=times_v, voltages_v=voltages_v, times_i=times_i,
+                                    voltages_i=voltages_i)
+            except Exception as e:
+                print(f"Error saving {item[0]}: {e}")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"Failed to save shot data: {error}")
+
+    def stage(self, sequence_config, waveforms=None):
+        """
+        Uploads waveforms and sets up the sequence in the AWG worker, e.g. the next pulse while the SMU still reads.
+        Nothing is done if the sequence is already set up and no waveform is given.
+        """
+        if waveforms is None and sequence_config == self._sequence:
+            return
+        self._sequence = sequence_config
+
+        def upload():
+            for name, waveform in (waveforms or {}).items():
+                self.awg.waveforms[name] = waveform
+            setup_sequences(self.awg, sequence_config)
+        self._awg_future = self._awg_worker.submit(upload)
+
+    def prepare(self, scope_settings, sequence_config=None, waveforms=None, relay='switch'):
+        """
+        Makes the next shot ready to fire: stages the AWG (see stage), sets up the scope after the readout of the
+        previous shot and switches the relay, all in parallel. Returns when all are done.
+
+        Raises:
+        - RuntimeError: If the AWG, the scope or the readout of the previous shot failed.
+        """
+        self._check()
+        if sequence_config is not None:
+            self.stage(sequence_config, waveforms)
+        readout = self._scope_future
+        if scope_settings is not None:
+            self._scope_future = self._scope_worker.submit(setup_oscilloscope, self.scope, scope_settings)
+        relays(self.ser, relay)
+        futures = (('readout of the previous shot', readout), ('AWG', self._awg_future),
+                   ('oscilloscope', self._scope_future))
+        self._awg_future = self._scope_future = None
+        for name, future in futures:
+            try:
+                if future is not None:
+                    future.result()
+            except Exception as e:
+                print(f"Error in the {name}: {e}")
+                raise RuntimeError(f"Failed to prepare the shot, error in the {name}: {e}")
+
+    def fire(self, filename=None):
+        """
+        Fires the prepared shot and returns the trigger time once the scope has triggered. The waveform is read out
+        in the scope worker and, if filename is given, saved by the writer thread.
+        """
+        self._check()
+        self.awg.write("OUTPut1:STATe 1")
+        self.awg.enabled = True
+        time_0 = trigger(self.scope, self.awg)
+
+        def readout():
+            data = get_waveform_data(self.scope)
+            if filename is not None:
+                self._queue.put((filename, data))
+            return data
+        self._scope_future = self._readout = self._scope_worker.submit(readout)
+        return time_0
+
+    def traces(self):
+        """Waits for the readout of the last shot and returns (times_i, voltages_i, times_v, voltages_v)."""
+        return self._readout.result()
+
+    def flush(self):
+        """Waits until every shot has been read out and saved, e.g. before a RunJournal marks the unit complete."""
+        for future in (self._awg_future, self._scope_future):
+            if future is not None:
+                future.result()
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """Flushes the pending shots and stops the workers."""
+        try:
+            self.flush()
+        finally:
+            self._queue.put(None)
+            self._writer.join()
+            self._awg_worker.shutdown()
+            self._scope_worker.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
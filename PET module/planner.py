@@ -0,0 +1,214 @@
+import contextlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+from .engine import Experiment, InstrumentSession
+from .PET_module import SMU_CHUNK_OVERHEAD, early_abort_chunk_points
+
+# Rough per-operation durations in seconds, used until a CostProfile has been calibrated on the setup.
+# 'smu' is the overhead of one SMU measurement and 'plc' the time per point and NPLC (20 ms at 50 Hz).
+DEFAULT_COSTS = {
+    'upload': 0.5,
+    'sequence': 0.3,
+    'scope_setup': 1.0,
+    'scope_arm': 0.05,
+    'relay': 0.12,
+    'trigger': 0.3,
+    'transfer': 1.5,
+    'save': 0.5,
+    'record': 0.001,
+    'smu': 0.3,
+    'plc': 0.02,
+}
+
+
+class CostProfile:
+    """
+    Measured durations of the instrument operations of an experiment, the calibration of plan_experiment.
+
+    Pass the profile to an InstrumentSession to record the running mean of every operation ('upload', 'sequence',
+    'scope_setup', 'scope_arm', 'relay', 'trigger', 'transfer', 'save', 'record' and 'smu_<profile>' for every
+    SMU profile of the spec) during a real run, and save it for the next estimate.
+
+    Parameters:
+    - filename (str): JSON file of the profile; loaded if it exists, and the default of save().
+
+    Usage:
+    - costs = CostProfile('costs.json')
+    - Experiment(spec).run(InstrumentSession.connect(spec['instruments'], costs))
+    - costs.save()
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.costs = dict(DEFAULT_COSTS)
+        self.samples = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as file:
+                data = json.load(file)
+            self.costs.update(data.get('costs', {}))
+            self.samples.update(data.get('samples', {}))
+
+    def record(self, category, seconds):
+        """Adds a measured duration to the running mean of the category (replacing the default value)."""
+        n = self.samples.get(category, 0)
+        self.costs[category] = (self.costs[category] * n + seconds) / (n + 1) if n else seconds
+        self.samples[category] = n + 1
+
+    @contextlib.contextmanager
+    def timed(self, category):
+        """Context manager that records the duration of its block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(category, time.perf_counter() - start)
+
+    def cost(self, category):
+        """Duration of one operation of the category, 0 if it is unknown."""
+        return self.costs.get(category, 0.0)
+
+    def smu_cost(self, profile, params):
+        """
+        Duration of a measurement with an SMU profile: the calibrated 'smu_<profile>' if there is one, otherwise
+        the 'smu' overhead plus 'plc' per point and NPLC (points count twice for DOUB sweeps).
+        """
+        if f'smu_{profile}' in self.costs:
+            return self.costs[f'smu_{profile}']
+        points = int(params.get('points', 1)) * (2 if params.get('sweep_direction') == 'DOUB' else 1)
+        return self.costs['smu'] + points * float(params.get('NPLC', 1)) * self.costs['plc']
+
+    def save(self, filename=None):
+        """Writes the profile as JSON."""
+        with open(filename or self.filename, 'w') as file:
+            json.dump({'costs': self.costs, 'samples': self.samples}, file, indent=2)
+
+
+class DryRunSession(InstrumentSession):
+    """
+    Stand-in for InstrumentSession that touches no instrument and no file, but adds up the number and estimated
+    duration of every operation the experiment would perform, with the same upload and scope caching.
+
+    Parameters:
+    - costs (CostProfile): Durations of the operations; DEFAULT_COSTS if not given.
+    - outcome (callable): outcome(profile, params) returns the resistance a measurement reads. The default NaN
+      meets no verify condition and no threshold, so every loop runs to its limit (worst case).
+    """
+
+    dry_run = True
+
+    def __init__(self, costs=None, outcome=None):
+        super().__init__(None, None, None, None, costs if costs is not None else CostProfile())
+        self.outcome = outcome
+        self.position = None
+        self.counts = {}
+        self.seconds = {}
+
+    def add(self, category, seconds=None):
+        self.counts[category] = self.counts.get(category, 0) + 1
+        cost = self.costs.cost(category) if seconds is None else seconds
+        self.seconds[category] = self.seconds.get(category, 0.0) + cost
+
+    def _route(self, position):
+        if self.position != position:
+            self.add('relay')
+            self.position = position
+
+    def load_waveform(self, name, rise_time, hold_time, fall_time, amplitude, delay_time):
+        key = (rise_time, hold_time, fall_time, amplitude, delay_time)
+        uploaded = self._waveforms.get(name) != key
+        if uploaded:
+            self.add('upload')
+            self._waveforms[name] = key
+        if uploaded or self._sequence != name:
+            self.add('sequence')
+            self._sequence = name
+
+    def configure_scope(self, settings):
+        if settings == self._scope_settings:
+            self.add('scope_arm')
+        else:
+            self.add('scope_setup')
+            self._scope_settings = json.loads(json.dumps(settings))
+
+    def fire(self):
+        self._route('switch')
+        self.add('trigger')
+        self.add('transfer')
+        return np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0)
+
+    def measure(self, profile, params, filename, last_resistance=None):
+        self._route('measure')
+        self.add(f'smu_{profile}', self.costs.smu_cost(profile, params))
+        return float('nan') if self.outcome is None else self.outcome(profile, params)
+
+    def sweep_early_abort(self, profile, params, filename, options):
+        # worst case: the device never switches and the sweep runs to completion, one chunk after the other
+        self._route('measure')
+        chunks = np.ceil(int(params['points']) / (options.get('chunk_points') or early_abort_chunk_points(params)))
+        self.add(f'smu_{profile}', self.costs.smu_cost(profile, params) + chunks * SMU_CHUNK_OVERHEAD)
+        return None
+
+    def save_traces(self, filename, times_i, voltages_i, times_v, voltages_v):
+        self.add('save')
+
+    def record(self, file_name, voltage, resistance, event):
+        self.add('record')
+
+
+class Plan:
+    """Operation counts and estimated durations of a dry run, see plan_experiment."""
+
+    def __init__(self, counts, seconds):
+        self.counts = counts
+        self.seconds = seconds
+
+    @property
+    def total(self):
+        """Estimated wall time in seconds."""
+        return sum(self.seconds.values())
+
+    def cost_centers(self):
+        """(category, count, seconds, share) tuples, the most expensive first."""
+        total = self.total or 1.0
+        return [(category, self.counts[category], seconds, seconds / total)
+                for category, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])]
+
+    def report(self):
+        """Table of the cost centers and the total, for printing."""
+        hours, rest = divmod(int(self.total), 3600)
+        lines = [f'Estimated run time: {hours} h {rest // 60:02d} min ({self.total:.0f} s)',
+                 f"{'operation':<16}{'count':>8}{'time (s)':>12}{'share':>8}"]
+        for category, count, seconds, share in self.cost_centers():
+            lines.append(f'{category:<16}{count:>8}{seconds:>12.0f}{share:>8.1%}')
+        return '\n'.join(lines)
+
+
+def plan_experiment(spec, costs=None, variables=None, outcome=None):
+    """
+    Dry-runs an experiment to estimate its wall time before any probe time is spent.
+
+    All loops of the spec (grids, verify loops with their retries, threshold searches) are expanded exactly as in
+    a real run, against a DryRunSession instead of the instruments.
+
+    Parameters:
+    - spec (dict, str or Experiment): The experiment, as for Experiment.
+    - costs (CostProfile): Calibrated operation durations; DEFAULT_COSTS if not given.
+    - variables (dict): Overrides of the spec variables.
+    - outcome (callable): Resistance model of the measurements, see DryRunSession (worst case if not given).
+
+    Returns:
+    - Plan: Operation counts and durations; print(plan.report()) shows the dominant cost centers.
+
+    Examples:
+    - print(plan_experiment('experiments/PTE_write-verify.yaml', CostProfile('costs.json')).report())
+    """
+    experiment = spec if isinstance(spec, Experiment) else Experiment(spec)
+    session = DryRunSession(costs, outcome)
+    with contextlib.redirect_stdout(io.StringIO()):
+        experiment.run(session, variables)
+    return Plan(session.counts, session.seconds)
@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+
+# Starting values of each material, as set in the scripts of the material folders (standard/GST225, AIST, IST).
+MATERIAL_PRESETS = {
+    'GST225': {'V_RESET_0': 2, 'V_RESET_max': 3, 'V_sweep': 3, 'V_ini': 1.8, 'T_RESET': 5e-8, 'V_SET_min': 0.2,
+               'V_SET_max': 2, 'LRS_lim': 2.5e4, 'HRS_lim': 1.01e6},
+    'AIST': {'V_RESET_0': 2.7, 'V_RESET_max': 3, 'V_sweep': 4, 'V_ini': 1.8, 'T_RESET': 5e-8, 'V_SET_min': 0.2,
+             'V_SET_max': 2.5, 'LRS_lim': 2e4, 'HRS_lim': 1.6e5},
+    'IST': {'V_RESET_max': 2, 'V_sweep': 4, 'T_RESET': 5e-8, 'LRS_lim': 1.05e5, 'HRS_lim': 1.01e6},
+}
+
+# Variables seeded from earlier runs: variable -> (learned quantity, quantile of its values, offset).
+# The RESET ramps only step up, so they start at the low quartile of the voltages that reached the HRS before, and
+# the SET grids a margin below the low decile of the SET thresholds (robust against a single early switch); the
+# threshold searches are seeded with the median.
+LEARNED_PRIORS = {
+    'V_RESET_0': ('V_RESET', 0.25, 0),
+    'V_SET_threshold': ('V_SET', 0.5, 0),
+    'V_SET_min': ('V_SET', 0.1, -0.2),
+    'V_sweep': ('V_sweep', 0.5, 0),
+}
+
+# Learned variables that never go below their preset or spec value, so that the SET grids cannot drift down run
+# after run.
+LEARNED_FLOORS = ('V_SET_min',)
+
+# Learned variables that never go above their preset or spec value, so that the initialization sweeps cannot
+# drift up to voltages that damage the device.
+LEARNED_CEILINGS = ('V_sweep',)
+
+# Verify limits that are kept per die once a run has used them.
+LIMITS = ('LRS_lim', 'HRS_lim')
+
+
+class ProfileRegistry:
+    """
+    Material and device profiles: the presets of every material and what earlier runs learned per material and die,
+    so that a new run starts its RESET ramps, SET grids, threshold searches and sweeps from priors instead of cold.
+
+    Three quantities are learned from the resistance logs (see learn_resistance_log): the RESET voltages that
+    reached HRS_lim, the lowest SET voltage that brought the device from above LRS_lim to LRS_lim for every event
+    (i.e. every SET pulse width) and the sweep voltages that re-initialized the device to LRS_lim. The last 'window'
+    values are kept per die. A die with fewer than min_samples values uses those of all dies of its material.
+
+    Parameters:
+    - filename (str): JSON file of the registry; loaded if it exists, and the default of save().
+    - presets (dict): Starting values of each material; MATERIAL_PRESETS by default.
+    - window (int): Number of values kept per quantity and die.
+    - min_samples (int): Values a die needs before its own are used.
+
+    Usage:
+    - profiles = ProfileRegistry('experiments/profiles.json')
+    - variables = profiles.variables('GST225', '3-DIE-25')  # e.g. {'V_RESET_0': 2.2, 'V_SET_threshold': 0.9, ...}
+    - profiles.learn_resistance_log('GST225', '3-DIE-25', Record_file, LRS_lim, HRS_lim)
+    """
+
+    def __init__(self, filename=None, presets=None, window=50, min_samples=3):
+        self.filename = filename
+        self.presets = MATERIAL_PRESETS if presets is None else presets
+        self.window = window
+        self.min_samples = min_samples
+        self.data = {}
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as file:
+                self.data = json.load(file)
+
+    def _profile(self, material, die):
+        return self.data.setdefault(material, {}).setdefault(die, {'history': {}, 'limits': {}, 'logs': {}})
+
+    def samples(self, material, die, quantity):
+        """The learned values of a quantity for a die, or of all dies of the material if the die has too few."""
+        dies = self.data.get(material, {})
+        values = dies.get(die, {}).get('history', {}).get(quantity, [])
+        if len(values) >= self.min_samples:
+            return values
+        return [v for profile in dies.values() for v in profile['history'].get(quantity, [])]
+
+    def variables(self, material, die=None, defaults=None):
+        """
+        The prior variables of a die: the defaults (e.g. the variables of an experiment spec), overridden by the
+        material presets, the verify limits last used on the die and the values learned so far (see
+        LEARNED_PRIORS). The variables of LEARNED_FLOORS are not learned below their preset or default value, those
+        of LEARNED_CEILINGS not above it.
+
+        Raises:
+        - ValueError: If the material has neither presets nor learned values.
+        """
+        if material not in self.presets and material not in self.data:
+            raise ValueError(f"Unknown material '{material}'. Expected one of {sorted({*self.presets, *self.data})}.")
+        variables = dict(defaults or {})
+        variables.update(self.presets.get(material, {}))
+        variables.update(self.data.get(material, {}).get(die, {}).get('limits', {}))
+        for name, (quantity, quantile, offset) in LEARNED_PRIORS.items():
+            values = self.samples(material, die, quantity)
+            if values:
+                value = round(float(np.quantile(values, quantile)) + offset, 3)
+                if name in LEARNED_FLOORS and name in variables:
+                    value = max(value, variables[name])
+                if name in LEARNED_CEILINGS and name in variables:
+                    value = min(value, variables[name])
+                variables[name] = value
+        return variables
+
+    def learn(self, material, die, **values):
+        """
+        Adds learned values of a die, e.g. learn('GST225', '3-DIE-25', V_RESET=[2.2, 2.4], LRS_lim=1.6e4). Lists
+        are added to the history of their quantity; LRS_lim and HRS_lim replace the limits of the die.
+        """
+        profile = self._profile(material, die)
+        for name, value in values.items():
+            if name in LIMITS:
+                profile['limits'][name] = float(value)
+                continue
+            history = profile['history'].setdefault(name, [])
+            history.extend(float(v) for v in np.atleast_1d(value) if np.isfinite(v))
+            del history[:-self.window]
+
+    def learn_resistance_log(self, material, die, file_name, LRS_lim, HRS_lim):
+        """
+        Learns from a resistance log written by record_resistance. Only the records added since the last call for
+        the same file are read, so it can be called after every run on a pad. A SET read only counts if the read
+        before it was above LRS_lim, i.e. the pulse actually switched the device.
+
+        Returns:
+        - dict: Number of values learned per quantity.
+        """
+        profile = self._profile(material, die)
+        key = os.path.abspath(file_name)
+        start = profile['logs'].get(key, 0)
+        reset, sweep, set_voltages = [], [], {}
+        with open(file_name) as file:
+            lines = file.readlines()
+        previous = None
+        for number, line in enumerate(lines):
+            if number < start - 1:
+                continue
+            parts = line.strip().split(',')
+            try:
+                event, voltage, resistance = parts[1], float(parts[2]), float(parts[3])
+            except (IndexError, ValueError):
+                continue
+            # the record before the new ones only gives the state before the first of them
+            if number >= start:
+                if event.startswith('after_RESET') and resistance >= HRS_lim:
+                    reset.append(voltage)
+                elif event.startswith('after_sweep') and resistance <= LRS_lim:
+                    sweep.append(voltage)
+                elif event.startswith('after_SET') and resistance <= LRS_lim and (previous or 0) > LRS_lim:
+                    set_voltages[event] = min(voltage, set_voltages.get(event, voltage))
+            previous = resistance
+        profile['logs'][key] = len(lines)
+        self.learn(material, die, V_RESET=reset, V_SET=list(set_voltages.values()), V_sweep=sweep,
+                   LRS_lim=LRS_lim, HRS_lim=HRS_lim)
+        return {'V_RESET': len(reset), 'V_SET': len(set_voltages), 'V_sweep': len(sweep)}
+
+    def save(self, filename=None):
+        """Writes the registry as JSON."""
+        with open(filename or self.filename, 'w') as file:
+            json.dump(self.data, file, indent=1)
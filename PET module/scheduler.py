@@ -0,0 +1,160 @@
+from .PET_module import RELAY_DEVICE_MAP, RelayController
+from .multiplex import OPPOSITE_POSITION, STEP_POSITIONS
+
+# Relay position each kind of operation needs; a 'compute' operation (e.g. a verify decision) needs none.
+RELAY_POSITIONS = dict(STEP_POSITIONS, compute=None)
+
+
+class Operation:
+    """
+    One step of a protocol for the RelayScheduler.
+
+    Parameters:
+    - name (str): Unique name, used for dependencies and as key of the result.
+    - kind (str): 'pulse' (AWG through the RF path), 'read' (SMU) or 'compute' (no instrument, e.g. a decision).
+    - func (callable): Called with the dict of results obtained so far; its return value is stored as result.
+    - device (int): The device the operation acts on, a key of RELAY_DEVICE_MAP; ignored for 'compute'.
+    - depends_on (iterable of str): Names of operations that must have run before this one.
+
+    Attributes:
+    - after (set): Names of the operations of the same device that must run first, see RelayScheduler.add.
+    """
+
+    def __init__(self, name, kind, func, device=0, depends_on=()):
+        if kind not in RELAY_POSITIONS:
+            raise ValueError(f"Unknown operation kind '{kind}'. Expected one of {list(RELAY_POSITIONS)}.")
+        if device not in RELAY_DEVICE_MAP:
+            raise ValueError(f"Unknown device '{device}'. Expected one of {list(RELAY_DEVICE_MAP)}.")
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.device = device
+        self.depends_on = tuple(depends_on)
+        self.after = set()
+
+    def __repr__(self):
+        return f"Operation({self.name!r}, {self.kind!r}, device={self.device}, depends_on={self.depends_on})"
+
+
+class RelayScheduler:
+    """
+    Executes pulse and read operations in an order that minimises relay transitions.
+
+    Operations are added in program order. On top of the explicit dependencies, the order each device needs is
+    kept: a read runs after the pulse of its device added before it and before the pulse added after it, so it
+    measures the state it was added for, and the pulses of a device run in program order. Among the operations that
+    are ready, the one that needs the fewest relay commands runs first (the earliest added on a tie). So the pulses
+    of a device with no read between them, e.g. the cycles between two endurance checkpoints, the OTS cycles or the
+    pulses of a multi-pulse analog programming step, run as one batch on the 'switch' position, and operations of
+    several devices are interleaved where they share the relay positions: while a device is pulsed, the other
+    devices are routed to the SMU (as in MultiDeviceExecutor), so a pulse on one device and a read on another need
+    no transition.
+
+    Operations may add further operations while running (e.g. a verify decision that schedules another RESET),
+    which keeps write-verify loops data-dependent: an operation never runs before the operations it depends on.
+
+    Usage:
+    - sched = RelayScheduler(esp32)
+    - sched.add('RESET', 'pulse', lambda r: fire_reset())
+    - sched.add('read_RESET', 'read', lambda r: measure_with_smu(...))
+    - sched.add('verify', 'compute', lambda r: decide(r['read_RESET']), depends_on=['read_RESET'])
+    - results = sched.run()
+
+    Parameters:
+    - ser (serial.Serial or RelayController): Connection to the relay controller.
+
+    Attributes:
+    - order (list): Names of the operations in the order they ran.
+    - transitions (int): Number of relay commands sent by run().
+    """
+
+    def __init__(self, ser):
+        self.relay = ser if isinstance(ser, RelayController) else RelayController(ser)
+        self.operations = {}
+        self.results = {}
+        self.order = []
+        self.transitions = 0
+        self._devices = set()
+        self._last_pulse = {}
+        self._reads = {}
+
+    def add(self, name, kind, func, device=0, depends_on=()):
+        """
+        Adds an operation, see Operation. Dependencies may refer to operations added later.
+
+        A pulse runs after the previous pulse of its device and after the reads of the device added since then; a
+        read runs after the previous pulse of its device.
+
+        Returns:
+        - Operation: The added operation.
+        """
+        if name in self.operations or name in self.results:
+            raise ValueError(f"Duplicate operation name '{name}'.")
+        operation = Operation(name, kind, func, device, depends_on)
+        if kind != 'compute':
+            self._devices.add(device)
+            if device in self._last_pulse:
+                operation.after.add(self._last_pulse[device])
+        if kind == 'pulse':
+            operation.after.update(self._reads.pop(device, ()))
+            self._last_pulse[device] = name
+        elif kind == 'read':
+            self._reads.setdefault(device, []).append(name)
+        self.operations[name] = operation
+        return operation
+
+    def _moves(self, operation, positions):
+        # relay commands that route the device of operation, as MultiDeviceExecutor._route does
+        needed = RELAY_POSITIONS[operation.kind]
+        if needed is None:
+            return {}
+        moves = {other: OPPOSITE_POSITION[needed] for other in sorted(self._devices)
+                 if other != operation.device and positions.get(other) in (needed, None)}
+        if positions.get(operation.device) != needed:
+            moves[operation.device] = needed
+        return moves
+
+    def _next(self, pending, done, positions):
+        ready = [op for op in pending.values() if all(d in done for d in op.depends_on + tuple(op.after))]
+        if not ready:
+            raise ValueError(f"Unresolvable dependencies among {list(pending.values())}")
+        return min(ready, key=lambda op: len(self._moves(op, positions)))
+
+    def plan(self):
+        """
+        Returns the order in which the pending operations would run, without running them.
+
+        Returns:
+        - tuple: (list of operation names, number of relay commands).
+        """
+        pending = dict(self.operations)
+        done = set(self.results)
+        positions = dict(self.relay.positions)
+        order = []
+        transitions = 0
+        while pending:
+            op = self._next(pending, done, positions)
+            moves = self._moves(op, positions)
+            positions.update(moves)
+            transitions += len(moves)
+            order.append(op.name)
+            done.add(op.name)
+            del pending[op.name]
+        return order, transitions
+
+    def run(self):
+        """
+        Runs all pending operations, including the ones added while running.
+
+        Returns:
+        - dict: Results of all operations by name.
+        """
+        while self.operations:
+            op = self._next(self.operations, self.results, self.relay.positions)
+            for device, position in self._moves(op, self.relay.positions).items():
+                self.relay.set(position, device=device)
+                self.transitions += 1
+            del self.operations[op.name]
+            self.results[op.name] = op.func(self.results)
+            self.order.append(op.name)
+        return self.results
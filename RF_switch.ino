@@ -1,36 +1,142 @@
 #include <Arduino.h>
 
 // define 4 GPIO pins for relaies controlling
-const int relayPins[] = {13, 12, 14, 27};  // 
+const int relayPins[] = {13, 12, 14, 27};  //
+const int RELAY_PULSE_MS = 100;   // coil pulse to switch the latching relaies
+const int RELAY_SETTLE_MS = 20;   // contact bounce settle time after the pulse
+const int PROGRAM_MAX_STEPS = 32; // maximum number of steps in one PRG frame
+const char *FIRMWARE_VERSION = "RF_switch 1.4";  // reported by PING, bump when the protocol changes
 
 void setup() {
-  Serial.begin(115200);  // initial Serials communication 
+  Serial.begin(115200);  // initial Serials communication
   // initialize pins to low state
-  for (int i = 0; i < 4; i++) 
+  for (int i = 0; i < 4; i++)
   {
     pinMode(relayPins[i], OUTPUT);
-    digitalWrite(relayPins[i], LOW); 
+    digitalWrite(relayPins[i], LOW);
   }
+  Serial.println(String("READY ") + FIRMWARE_VERSION);
+}
+
+// pulse one relay and wait until its contacts have settled
+void pulseRelay(int i) {
+  digitalWrite(relayPins[i], HIGH);
+  delay(RELAY_PULSE_MS); // 100 ms pulse to switch relaies
+  digitalWrite(relayPins[i], LOW);
+  delay(RELAY_SETTLE_MS);
+}
+
+// parse the relay index of a step such as "ON2", -1 if invalid
+int stepChannel(const String &step, int prefixLength) {
+  if (step.length() != prefixLength + 1) return -1;
+  int i = step.charAt(prefixLength) - '0';
+  return (i >= 0 && i < 4) ? i : -1;
+}
+
+// check that a wait step "W<us>" has a plain decimal number of at most 9 digits (toInt() reads garbage as 0)
+bool validWait(const String &step) {
+  if (step.length() < 2 || step.length() > 10) return false;
+  for (unsigned int k = 1; k < step.length(); k++) {
+    if (!isDigit(step.charAt(k))) return false;
+  }
+  return true;
+}
+
+// Execute a relay program "PRG <step>;<step>;...", with the steps
+//   ON<i>   pulse relay i (as the ON<i> command)
+//   HI<i>   set pin i high
+//   LO<i>   set pin i low
+//   W<us>   wait the given number of microseconds, counted from the end of the previous wait, or from the
+//           moment the last ON<i> step has settled; HI/LO steps in between do not delay the schedule
+// and answer "DONE <t>,<t>,..." with the start time of every step in microseconds after the program start.
+void runProgram(String program) {
+  String steps[PROGRAM_MAX_STEPS];
+  int n = 0;
+  while (program.length() > 0) {
+    if (n == PROGRAM_MAX_STEPS) {
+      Serial.println("ERR PRG too many steps");
+      return;
+    }
+    int sep = program.indexOf(';');
+    steps[n++] = (sep < 0) ? program : program.substring(0, sep);
+    program = (sep < 0) ? String("") : program.substring(sep + 1);
+  }
+
+  // validate everything before touching a pin
+  for (int k = 0; k < n; k++) {
+    bool valid = (steps[k].startsWith("ON") && stepChannel(steps[k], 2) >= 0)
+              || (steps[k].startsWith("HI") && stepChannel(steps[k], 2) >= 0)
+              || (steps[k].startsWith("LO") && stepChannel(steps[k], 2) >= 0)
+              || (steps[k].startsWith("W") && validWait(steps[k]));
+    if (!valid) {
+      Serial.println(String("ERR PRG ") + steps[k]);
+      return;
+    }
+  }
+
+  unsigned long stamps[PROGRAM_MAX_STEPS];
+  unsigned long start = micros();
+  unsigned long target = 0;  // schedule of the waits, so execution time of the steps does not accumulate
+  for (int k = 0; k < n; k++) {
+    stamps[k] = micros() - start;
+    if (steps[k].startsWith("ON")) {
+      pulseRelay(stepChannel(steps[k], 2));
+      target = micros() - start;
+    } else if (steps[k].startsWith("HI")) {
+      digitalWrite(relayPins[stepChannel(steps[k], 2)], HIGH);
+    } else if (steps[k].startsWith("LO")) {
+      digitalWrite(relayPins[stepChannel(steps[k], 2)], LOW);
+    } else {
+      target += strtoul(steps[k].c_str() + 1, NULL, 10);
+      while (micros() - start < target) {}
+    }
+  }
+
+  String reply = "DONE ";
+  for (int k = 0; k < n; k++) {
+    if (k > 0) reply += ",";
+    reply += String(stamps[k]);
+  }
+  Serial.println(reply);
 }
 
 void loop() {
   // check if the serials port get data
   if (Serial.available() > 0) {
     String command = Serial.readStringUntil('\n');  // read one line of the input string
+    command.trim();
+    bool known = false;
+
+    // handshake, the host retries until it gets an answer
+    if (command == "PING") {
+      Serial.println(String("PONG ") + FIRMWARE_VERSION);
+      return;
+    }
+
+    if (command.startsWith("PRG ")) {
+      runProgram(command.substring(4));
+      return;
+    }
 
     // controlling the relaies according to the command
     for (int i = 0; i < 4; i++) {
-      if (command == String("ON") + String(i)) 
+      if (command == String("ON") + String(i))
       {
-        digitalWrite(relayPins[i], HIGH); 
-        delay(100); // 100 ms pulse to switch relaies
-        digitalWrite(relayPins[i], LOW);
-      } 
-      else if (command == String("OFF") + String(i)) 
+        pulseRelay(i);
+        known = true;
+      }
+      else if (command == String("OFF") + String(i))
       {
-        digitalWrite(relayPins[i], LOW); 
+        digitalWrite(relayPins[i], LOW);
+        known = true;
       }
     }
+
+    // acknowledge once the relay has switched and settled, the host blocks on this line
+    if (known) {
+      Serial.println(String("ACK ") + command);
+    } else if (command.length() > 0) {
+      Serial.println(String("ERR ") + command);
+    }
   }
 }
-
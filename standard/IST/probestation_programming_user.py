@@ -13,7 +13,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -190,9 +189,7 @@ for V_RESET in np.linspace(0.2,2,30):
     # RESET
     # Write waveforms
     RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
-    awg.waveforms["RESET"] = RESET
     sequence_config = [{"number": 1, "waveform": "RESET"}]
-    setup_sequences(awg, sequence_config)
 
     # setup oscilloscope
     RESET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.033, "voltage")
@@ -200,11 +197,8 @@ for V_RESET in np.linspace(0.2,2,30):
     RESET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.4, "voltage")
     RESET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.4, "voltage") * 3
     RESET_settings['Trigger Level']['Level'] = V_RESET * 0.7
-    setup_oscilloscope(scope, RESET_settings)
-
-    # setup relay
-    relays(esp32, 'switch')
-    time.sleep(0.1)
+    # upload waveform, setup oscilloscope and relay in parallel
+    prepare_shot(awg, scope, esp32, sequence_config, RESET_settings, {"RESET": RESET})
 
     # Output and Run
     awg.write("OUTPut1:STATe 1")
@@ -213,13 +207,12 @@ for V_RESET in np.linspace(0.2,2,30):
     # waiting for trigger:
     trigger(scope, awg)
     times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params,
-                     generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'))
+    # the shot is saved while the SMU measures
+    R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'), generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
     print('Resistance after RESET =', R_read)
     record_resistance(Record_file, V_RESET, R_read, f'after_RESET_{T_RESET}s')
 
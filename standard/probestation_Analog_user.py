@@ -14,7 +14,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -193,7 +192,6 @@ setup_oscilloscope(scope, RESET_settings)
 
 # setup relay
 relays(esp32, 'switch')
-time.sleep(1)
 
 # Output and Run
 awg.write("OUTPut1:STATe 1")
@@ -213,6 +211,61 @@ print(f'Resistance after RESET =', R_read)
 record_resistance(Record_file, V_RESET, R_read, f'after_RESET')
 
 
+#####################################################################
+
+# Analog programming of intermediate levels: the pulse is proposed by a model of the resistance change,
+# learned from the earlier shots of this pad and updated after every shot
+Target_levels = [2e4, 5e4, 1e5]
+Tolerance = 0.05  # relative
+
+model = PulseResponseModel(File_Root + '/' + File_SampleName + '/' + File_PadName + '_pulse_model.json')
+if model.samples('SET') + model.samples('RESET') == 0 and os.path.exists(Record_file):
+    print('shots learned from the resistance log:', model.fit_resistance_log(Record_file, fall_time=fall_time))
+
+candidates = (pulse_candidates('RESET', np.round(np.linspace(0.5, 2.5, 21), 2), [5e-8], [2e-9, 1e-8, 1e-7]) +
+              pulse_candidates('SET', np.round(np.linspace(0.5, 2, 16), 2), [1e-7, 1e-6], [1e-6]))
+
+
+def analog_pulse(kind, amplitude, width, fall_time):
+    waveform = create_waveform(rise_time, width, fall_time, amplitude, delay, sample_rate)
+    pulse_time = rise_time + width + fall_time
+
+    # setup oscilloscope for the amplitude and width of the pulse
+    settings = SET_settings if kind == 'SET' else RESET_settings
+    current_scale = 0.033 if kind == 'SET' else 0.02
+    settings['Timebase Scale'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase")
+    settings['Timebase Position'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase") * 2
+    settings['Channel 1 Scale'] = adjust_oscilloscope_scale(amplitude * current_scale, "voltage")
+    settings['Channel 1 Offset'] = adjust_oscilloscope_scale(amplitude * current_scale, "voltage") * 2.8
+    settings['Channel 2 Scale'] = adjust_oscilloscope_scale(amplitude * 0.33, "voltage")
+    settings['Channel 2 Offset'] = adjust_oscilloscope_scale(amplitude * 0.33, "voltage") * 3
+    settings['Trigger Level']['Level'] = amplitude * 0.7
+    prepare_shot(awg, scope, esp32, [{"number": 1, "waveform": kind}], settings, {kind: waveform})
+    awg.write("OUTPut1:STATe 1")
+    awg.enabled = True
+    trigger(scope, awg)
+    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
+    np.savez_compressed(generate_filename(f'{kind}_{amplitude}V_{width:.1e}s_{fall_time:.1e}s', File_Path, '.npz'),
+                        times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+
+
+def analog_read():
+    return measure_with_smu(smu, esp32, smu_read_params, generate_filename('read_analog', File_Path, '.npz'))
+
+
+for R_target in Target_levels:
+    reached, R_read, shots = program_resistance(analog_pulse, analog_read, model, R_target, candidates,
+                                                tolerance=Tolerance, max_tries=10)
+    for kind, amplitude, width, fall_time, R_before, R_shot in shots:
+        # the state before every pulse is logged too, so that fit_resistance_log learns from the exact pairs
+        record_resistance(Record_file, amplitude, R_before, f'before_{kind}_{width:.1e}s')
+        record_resistance(Record_file, amplitude, R_shot, f'after_{kind}_{width:.1e}s')
+    print(f'Level {R_target:.1e}: {R_read:.3e} ohm after {len(shots)} pulses, reached = {reached}')
+    record_resistance(Record_file, 0, R_read, f'level_{R_target:.1e}')
+
+model.save()
+
+
 ##
 ###RESET analog
 ##RESET = create_waveform(2e-9, 50e-9, 2e-9, 1.5, 1e-6, sample_rate)
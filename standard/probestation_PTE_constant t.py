@@ -12,7 +12,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -145,6 +144,61 @@ rise_time = 2e-9
 fall_time = 2e-9
 delay = 1e-6
 
+
+# Last read of the device; with the target of the pulse since then it fixes the SMU current range of the next read
+R_last = {}
+
+
+# Tries of the write-verify loops
+def sweep(V_sweep):
+    # initialization
+    measure_with_smu_early_abort(smu, esp32, smu_sweep_params,
+                                 generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'),
+                                 switching_resistance=LRS_lim)
+
+
+def sweep_attempt(V_sweep):
+    sweep(V_sweep)
+
+    # read
+    R_read = measure_with_smu(smu, esp32, smu_read_params,
+                              generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'),
+                              last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
+    print('Resistance after sweep =', R_read)
+    record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
+    return R_read
+
+
+def reset_attempt(V_RESET):
+    print('V_RESET = ', V_RESET)
+    RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
+    sequence_config = [{"number": 1, "waveform": "RESET"}]
+
+    # upload waveform, setup oscilloscope and relay in parallel
+    prepare_shot(awg, scope, esp32, sequence_config, RESET_settings, {"RESET": RESET})
+
+    # Output and Run
+    awg.write("OUTPut1:STATe 1")
+    awg.enabled = True
+
+    # waiting for trigger:
+    trigger(scope, awg)
+    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
+
+    # read
+    # the shot is saved while the SMU measures
+    R_read = measure_and_save(smu, esp32, smu_read_params,
+                              generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'),
+                              generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'),
+                              last_resistance=expected_resistance(R_last.get('read'), HRS_lim),
+                              times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+    R_last['read'] = R_read
+    print('Resistance after RESET =', R_read)
+    record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
+    return R_read
+
+
 for i in range(2):
     ###################### sample info ###########################
     File_Root = "C:/Users/lisaadmin/Desktop/data/test"
@@ -174,12 +228,15 @@ for i in range(2):
 
     # initialization
     smu_sweep_params['stop_voltage'] = V_sweep
-    measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+    measure_with_smu_early_abort(smu, esp32, smu_sweep_params,
+                                 generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'),
+                                 switching_resistance=LRS_lim)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+    R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
     print('Resistance after sweep =', R_read)
     record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
@@ -187,16 +244,10 @@ for i in range(2):
 
     # RESET
     RESET = create_waveform(2e-9, T_RESET, 2e-9, V_RESET_0, delay, sample_rate)
-    awg.waveforms["RESET"] = RESET
     sequence_config = [{"number": 1, "waveform": "RESET"}]
-    setup_sequences(awg, sequence_config)
-
-    # setup oscilloscope
-    setup_oscilloscope(scope, RESET_settings)
 
-    # setup relay
-    relays(esp32, 'switch')
-    time.sleep(0.5)
+    # upload waveform, setup oscilloscope and relay in parallel
+    prepare_shot(awg, scope, esp32, sequence_config, RESET_settings, {"RESET": RESET})
 
     # Output and Run
     awg.write("OUTPut1:STATe 1")
@@ -205,13 +256,13 @@ for i in range(2):
     # waiting for trigger:
     time_0 = trigger(scope, awg)
     times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-    np.savez_compressed(generate_filename(f'RESET_{V_RESET_0}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params,
-                     generate_filename(f'read_after_RESET_{V_RESET_0}V', File_Path, '.npz'))
+    # the shot is saved while the SMU measures
+    R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_RESET_{V_RESET_0}V', File_Path, '.npz'), generate_filename(f'RESET_{V_RESET_0}V', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), HRS_lim), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+    R_last['read'] = R_read
     print('Resistance after RESET =', R_read)
     record_resistance(Record_file, V_RESET_0, R_read, 'after_RESET')
 
@@ -235,9 +286,7 @@ for i in range(2):
             total_time = rise_time + T_SET + fall_time + 2*delay
 
             # write SET waveform
-            awg.waveforms["SET"] = SET
             sequence_config = [{"number": 1, "waveform": "SET"}]
-            setup_sequences(awg, sequence_config)
 
             # setup oscilloscope
             SET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_SET * 0.033, "voltage")
@@ -245,11 +294,8 @@ for i in range(2):
             SET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_SET * 0.33, "voltage")
             SET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_SET * 0.33, "voltage") * 3
             SET_settings['Trigger Level']['Level'] = V_SET*0.7
-            setup_oscilloscope(scope, SET_settings)
-
-            # setup relay
-            relays(esp32, 'switch')
-            time.sleep(0.5)
+            # upload waveform, setup oscilloscope and relay in parallel
+            prepare_shot(awg, scope, esp32, sequence_config, SET_settings, {"SET": SET})
 
             # Output and Run
             awg.write("OUTPut1:STATe 1")
@@ -259,80 +305,26 @@ for i in range(2):
             time_0 = trigger(scope, awg)
             times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
             #plot_waveform(times,voltages)
-            np.savez_compressed(generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
 
             #####################################################################
 
             # read
-            R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'))
+            # the shot is saved while the SMU measures
+            R_read = measure_and_save(smu, esp32, smu_read_params, generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'), generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim), times_v=times_v, voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+            R_last['read'] = R_read
             print('Resistance after SET =', R_read)
             record_resistance(Record_file, V_SET, R_read, f'after_SET_{tt}')
 
             #####################################################################
-            count = 0
-            LRS = 1e10
-            while LRS > LRS_lim:
-                
-                # initialization
-                measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-
-                #####################################################################
-
-                # read
-                R_read = measure_with_smu(smu, esp32, smu_read_params,
-                                 generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
-                print('Resistance after sweep =', R_read)
-                record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
-                LRS = R_read
-                count += 1
-                if count >= 3:
-                    print('initialiyation check break due to the cycle limit')
-                    break
+
+            # initialization, swept again until LRS (at most 3 sweeps)
+            write_verify(sweep_attempt, RepeatPolicy(V_sweep), high=LRS_lim, polarity='decrease', max_tries=3)
 
             #####################################################################
 
-            # RESET
-            HRS = 1e1
-            for V_RESET in np.linspace(V_RESET_0,2.5,10):
-                if HRS < HRS_lim:
-                    print('V_RESET = ', V_RESET)
-                    if not V_RESET == V_RESET_0:
-                        # initialization
-                        measure_with_smu(smu, esp32, smu_sweep_params,
-                                         generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-                        RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
-                        awg.waveforms["RESET"] = RESET
-                        time.sleep(0.1)
-
-                    sequence_config = [{"number": 1, "waveform": "RESET"}]
-                    setup_sequences(awg, sequence_config)
-
-                    # setup oscilloscope
-                    setup_oscilloscope(scope, RESET_settings)
-
-                    # setup relay
-                    relays(esp32, 'switch')
-                    time.sleep(0.5)
-
-                    # Output and Run
-                    awg.write("OUTPut1:STATe 1")
-                    awg.enabled = True
-
-                    # waiting for trigger:
-                    time_0 = trigger(scope, awg)
-                    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-                    # plot_waveform(times,voltages)
-                    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v,
-                                        voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
-
-                    # read
-                    R_read = measure_with_smu(smu, esp32, smu_read_params,
-                                              generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'))
-                    print('Resistance after RESET =', R_read)
-                    record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
-                    HRS = R_read
-                else:
-                    break
+            # RESET, V_RESET ramps from V_RESET_0 to 2.5 V in 10 steps until HRS, with a sweep before every retry
+            write_verify(reset_attempt, LinearPolicy(V_RESET_0, 2.5, step=(2.5 - V_RESET_0) / 9), low=HRS_lim,
+                         max_tries=10, restore=lambda: sweep(V_sweep))
             #####################################################################
 
 relays(esp32,'off')
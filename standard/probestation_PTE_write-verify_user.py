@@ -11,8 +11,7 @@ from PET import *
 awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
-esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
+esp32 = RelayController(connect_to_esp32('COM4', 115200))
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -145,15 +144,87 @@ rise_time = 2e-9
 fall_time = 2e-9
 delay = 1e-6
 
+###################### sample info ###########################
+File_Root = "C:/Users/lisaadmin/Desktop/data/test"
+File_SampleName = "3-DIE-25"
+File_PadName = "D1-3"
+Record_ext = '.txt'
+
+# Device profile: with a Material (e.g. 'GST225'), the RESET ramp and the sweep start from the values learned on the die
+Material = None
+profiles = ProfileRegistry("C:/Users/lisaadmin/Desktop/data/test/profiles.json")
+if Material:
+    priors = profiles.variables(Material, File_SampleName, {'V_RESET_0': V_RESET_0, 'V_sweep': V_sweep})
+    V_RESET_0, V_sweep = priors['V_RESET_0'], priors['V_sweep']
+    print('Priors:', priors)
+
+# Shot pipeline: readout and saving of each shot run in the background during the following SMU read
+pipeline = ShotPipeline(awg, scope, esp32)
+
+# Run journal: with Resume = True, completed PTE points are skipped after a crash. A point is keyed on its sub folder
+# and on the pulse parameters, so a new run (another sub folder, T_RESET or grid) never skips points of an old one
+Resume = False
+journal = RunJournal(File_Root + '/' + File_SampleName + '/' + File_PadName + '_PTE_write-verify_journal.jsonl', Resume)
+
+# Last read of the device; with the target of the pulse since then it fixes the SMU current range of the next read
+R_last = {}
+
+
+# Tries of the write-verify loops
+def sweep(V_sweep):
+    # initialization
+    measure_with_smu_early_abort(smu, esp32, smu_sweep_params, smu_store.entry(f'sweep_{V_sweep}V'),
+                                 switching_resistance=LRS_lim)
+
+
+def sweep_attempt(V_sweep):
+    sweep(V_sweep)
+
+    # read
+    R_read = measure_with_smu(smu, esp32, smu_read_params, smu_store.entry(f'read_after_sweep_{V_sweep}V'),
+                              last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
+    print('Resistance after sweep =', R_read)
+    record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
+    return R_read
+
+
+def reset_attempt(V_RESET):
+    print('V_RESET = ', V_RESET)
+    RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
+    sequence_config = [{"number": 1, "waveform": "RESET"}]
+
+    # upload waveform, setup oscilloscope and relay in parallel
+    pipeline.prepare(RESET_settings, sequence_config, {"RESET": RESET})
+
+    # Output and Run, the waveform is read out and saved in the background
+    pipeline.fire(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'))
+
+    # read
+    R_read = measure_with_smu(smu, esp32, smu_read_params, smu_store.entry(f'read_after_RESET_{V_RESET}V'),
+                              last_resistance=expected_resistance(R_last.get('read'), HRS_lim))
+    R_last['read'] = R_read
+    print('Resistance after RESET =', R_read)
+    record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
+    return R_read
+
+
+def pte_unit(T_SET, V_SET):
+    return unit_key(Sub_folder, T_RESET=T_RESET, V_RESET_0=V_RESET_0, V_sweep=V_sweep, T_SET=T_SET, V_SET=V_SET)
+
+
+# PTE grid
+T_SET_grid = np.logspace(-8.7, -5, 30)
+V_SET_grid = [float('{:.2f}'.format(V_SET)) for V_SET in np.linspace(0.2, 2.5, num=30)]
+
 for i in range(3):
-    ###################### sample info ###########################
-    File_Root = "C:/Users/lisaadmin/Desktop/data/test"
-    File_SampleName = "3-DIE-25"
-    File_PadName = "D1-3"
     Sub_folder = f'{i+4}th_SET'
     print(Sub_folder)
 
-    Record_ext = '.txt'
+    # on resume, a repetition whose points are all in the journal skips its initialization and RESET as well
+    if all(journal.is_done(pte_unit(T_SET, V_SET)) for T_SET in T_SET_grid for V_SET in V_SET_grid):
+        print(f'{Sub_folder} already completed')
+        continue
 
     if Sub_folder == '0':
         File_Path = File_Root + '/' + File_SampleName + '/' + File_PadName + '/'
@@ -165,6 +236,9 @@ for i in range(3):
 
     Record_file = File_Root + '/' + File_SampleName + '/' + File_PadName + Record_ext
 
+    # SMU reads and sweeps go to one store file instead of one .npz file each (see load_smu_results)
+    smu_store = SMUResultStore(File_Path + 'smu_results.npz')
+
     # Write-verify condition
     LRS_lim = 1.6e4
     HRS_lim = 5.1e5
@@ -174,12 +248,13 @@ for i in range(3):
 
     # initialization
     smu_sweep_params['stop_voltage'] = V_sweep
-    measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+    measure_with_smu_early_abort(smu, esp32, smu_sweep_params, smu_store.entry(f'sweep_{V_sweep}V'), switching_resistance=LRS_lim)
 
     #####################################################################
 
     # read
-    R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+    R_read = measure_with_smu(smu, esp32, smu_read_params, smu_store.entry(f'read_after_sweep_{V_sweep}V'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
     print('Resistance after sweep =', R_read)
     record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
@@ -187,31 +262,21 @@ for i in range(3):
 
     # RESET
     RESET = create_waveform(2e-9, T_RESET, 2e-9, V_RESET_0, delay, sample_rate)
-    awg.waveforms["RESET"] = RESET
     sequence_config = [{"number": 1, "waveform": "RESET"}]
-    setup_sequences(awg, sequence_config)
 
-    # setup oscilloscope
-    setup_oscilloscope(scope, RESET_settings)
+    # upload waveform, setup oscilloscope and relay in parallel
+    pipeline.prepare(RESET_settings, sequence_config, {"RESET": RESET})
 
-    # setup relay
-    relays(esp32, 'switch')
-    time.sleep(0.5)
-
-    # Output and Run
-    awg.write("OUTPut1:STATe 1")
-    awg.enabled = True
-
-    # waiting for trigger:
-    time_0 = trigger(scope, awg)
-    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-    np.savez_compressed(generate_filename(f'RESET_{V_RESET_0}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
+    # Output and Run, the waveform is read out and saved in the background
+    time_0 = pipeline.fire(generate_filename(f'RESET_{V_RESET_0}V', File_Path, '.npz'))
 
     #####################################################################
 
     # read
     R_read = measure_with_smu(smu, esp32, smu_read_params,
-                     generate_filename(f'read_after_RESET_{V_RESET_0}V', File_Path, '.npz'))
+                     smu_store.entry(f'read_after_RESET_{V_RESET_0}V'),
+                     last_resistance=expected_resistance(R_last.get('read'), HRS_lim))
+    R_last['read'] = R_read
     print('Resistance after RESET =', R_read)
     record_resistance(Record_file, V_RESET_0, R_read, 'after_RESET')
 
@@ -219,13 +284,13 @@ for i in range(3):
 
     # PTE measurement
 
-    for T_SET in np.logspace(-8.7, -5, 30):
+    for T_SET in T_SET_grid:
         tt = '{:.1e}'.format(T_SET)
         print(tt)
-        for V_SET in np.linspace(0.2, 2.5, num=30):
-            V_SET_str = '{:.2f}'.format(V_SET)
-            V_SET = float(V_SET_str)
+        for V_SET in V_SET_grid:
             print(V_SET)
+            if journal.is_done(pte_unit(T_SET, V_SET)):
+                continue
 
             #####################################################################
 
@@ -235,9 +300,7 @@ for i in range(3):
             total_time = rise_time + T_SET + fall_time + 2*delay
 
             # write SET waveform
-            awg.waveforms["SET"] = SET
             sequence_config = [{"number": 1, "waveform": "SET"}]
-            setup_sequences(awg, sequence_config)
 
             # setup oscilloscope
             SET_settings['Timebase Scale'] = adjust_oscilloscope_scale(pulse_time * 0.2, "timebase")
@@ -247,94 +310,42 @@ for i in range(3):
             SET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_SET * 0.33, "voltage")
             SET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_SET * 0.33, "voltage") * 3
             SET_settings['Trigger Level']['Level'] = V_SET*0.7
-            setup_oscilloscope(scope, SET_settings)
-
-            # setup relay
-            relays(esp32, 'switch')
-            time.sleep(0.5)
-
-            # Output and Run
-            awg.write("OUTPut1:STATe 1")
-            awg.enabled = True
+            # upload waveform, setup oscilloscope and relay in parallel
+            pipeline.prepare(SET_settings, sequence_config, {"SET": SET})
 
-            # waiting for trigger:
-            time_0 = trigger(scope, awg)
-            times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-            #plot_waveform(times,voltages)
-            np.savez_compressed(generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
+            # Output and Run, the waveform is read out and saved in the background
+            time_0 = pipeline.fire(generate_filename(f'SET_{V_SET}V_{tt}s', File_Path, '.npz'))
 
             #####################################################################
 
             # read
-            R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'))
+            R_read = measure_with_smu(smu, esp32, smu_read_params, smu_store.entry(f'read_after_SET_{V_SET}V'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+            R_last['read'] = R_read
             print('Resistance after SET =', R_read)
             record_resistance(Record_file, V_SET, R_read, f'after_SET_{tt}')
 
             #####################################################################
-            count = 0
-            LRS = 1e10
-            while LRS > LRS_lim:
-                
-                # initialization
-                measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-
-                #####################################################################
-
-                # read
-                R_read = measure_with_smu(smu, esp32, smu_read_params,
-                                 generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
-                print('Resistance after sweep =', R_read)
-                record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
-                LRS = R_read
-                count += 1
-                if count >= 3:
-                    print('initialiyation check break due to the cycle limit')
-                    break
+
+            # initialization, swept again until LRS (at most 3 sweeps)
+            write_verify(sweep_attempt, RepeatPolicy(V_sweep), high=LRS_lim, polarity='decrease', max_tries=3)
 
             #####################################################################
 
-            # RESET
-            HRS = 1e1
-            for V_RESET in np.linspace(V_RESET_0,3,10):
-                if HRS < HRS_lim:
-                    print('V_RESET = ', V_RESET)
-                    if not V_RESET == V_RESET_0:
-                        # initialization
-                        measure_with_smu(smu, esp32, smu_sweep_params,
-                                         generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-                        RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
-                        awg.waveforms["RESET"] = RESET
-                        time.sleep(0.1)
-
-                    sequence_config = [{"number": 1, "waveform": "RESET"}]
-                    setup_sequences(awg, sequence_config)
-
-                    # setup oscilloscope
-                    setup_oscilloscope(scope, RESET_settings)
-
-                    # setup relay
-                    relays(esp32, 'switch')
-                    time.sleep(0.5)
-
-                    # Output and Run
-                    awg.write("OUTPut1:STATe 1")
-                    awg.enabled = True
-
-                    # waiting for trigger:
-                    time_0 = trigger(scope, awg)
-                    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-                    # plot_waveform(times,voltages)
-                    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v,
-                                        voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
-
-                    # read
-                    R_read = measure_with_smu(smu, esp32, smu_read_params,
-                                              generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz'))
-                    print('Resistance after RESET =', R_read)
-                    record_resistance(Record_file, V_RESET, R_read, 'after_RESET')
-                    HRS = R_read
-                else:
-                    break
+            # RESET, V_RESET ramps from V_RESET_0 to 3 V in 10 steps until HRS, with a sweep before every retry
+            write_verify(reset_attempt, LinearPolicy(V_RESET_0, 3, step=(3 - V_RESET_0) / 9), low=HRS_lim,
+                         max_tries=10, restore=lambda: sweep(V_sweep))
+
+            # the point only counts as done once its traces and reads are on disk
+            pipeline.flush()
+            smu_store.flush()
+            journal.complete(pte_unit(T_SET, V_SET))
             #####################################################################
 
+    smu_store.close()
+
+pipeline.close()
 relays(esp32,'off')
+
+if Material:
+    profiles.learn_resistance_log(Material, File_SampleName, Record_file, LRS_lim, HRS_lim)
+    profiles.save()
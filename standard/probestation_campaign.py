@@ -0,0 +1,24 @@
+from PET import *
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+------------------------     Run Campaign      ----------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+# Jobs on several pads, see experiments/campaign.yaml
+Campaign_File = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiments', 'campaign.yaml')
+
+# Resume = True skips the grid points completed by an interrupted run of each job
+Resume = True
+
+# Device profiles: jobs with a material start from what earlier jobs learned on the die
+Profile_File = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiments', 'profiles.json')
+
+campaign = Campaign.from_spec(Campaign_File, profiles=ProfileRegistry(Profile_File))
+results = campaign.run(resume=Resume)
+
+for job, context, error in results:
+    print(job, 'failed: ' + str(error) if error else 'done')
@@ -13,8 +13,7 @@ from PET import *
 awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
-esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
+esp32 = RelayController(connect_to_esp32('COM4', 115200))
 
 
 '''------------------------------------------------------------------------
@@ -156,9 +155,18 @@ if not os.path.exists(File_Path):
 
 Record_file = File_Root + '/' + File_SampleName + '/' + File_PadName + Record_ext
 
+# Run journal: with Resume = True, completed checkpoints are skipped and V_RESET is restored after a crash. The journal
+# is kept per sub folder and a checkpoint is keyed on the SET pulse, so a new run never skips checkpoints of an old one
+Resume = False
+journal = RunJournal(File_Root + '/' + File_SampleName + '/' + File_PadName + '_' + Sub_folder
+                     + '_endurance_journal.jsonl', Resume)
+
+# SMU reads and sweeps go to one store file instead of one .npz file each (see load_smu_results)
+smu_store = SMUResultStore(File_Path + 'smu_results.npz')
+
 ###################### Basic parameters ###########################
 
-V_RESET = 1.8
+V_RESET = journal.get('V_RESET', 1.8)
 V_SET = 1.2
 V_sweep = 2
 V_read = 0.1
@@ -175,28 +183,87 @@ cycles, step = generate_logscale_integers(cycle_num,cycle_points)
 LRS_lim = 1e4
 HRS_lim = 1.0e6
 
+# Health rules: stop once the device is stuck in LRS, open, or its HRS/LRS window has collapsed. They see one
+# RESET read per cycle, the result of its write-verify ramp, so StuckRule counts ramps that failed to reach HRS.
+health = HealthMonitor([StuckRule(below=HRS_lim, event='after_RESET', count=3),
+                        OpenCircuitRule(limit=1e9, count=5),
+                        WindowCollapseRule(min_ratio=10, count=5)], raise_errors=False)
+
+# Last read of the device; with the target of the pulse since then it fixes the SMU current range of the next read
+R_last = {}
+
 ######################## Measurement ###############################
 
 # initialization
 smu_sweep_params['stop_voltage'] = V_sweep
-measure_with_smu(smu, esp32, smu_sweep_params, generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
+measure_with_smu(smu, esp32, smu_sweep_params, smu_store.entry(f'sweep_{V_sweep}V'))
 
 #####################################################################
 
 # read
-R_read = measure_with_smu(smu, esp32, smu_read_params, generate_filename(f'read_after_sweep_{V_sweep}V', File_Path, '.npz'))
+R_read = measure_with_smu(smu, esp32, smu_read_params, smu_store.entry(f'read_after_sweep_{V_sweep}V'), last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+R_last['read'] = R_read
 print('Resistance after sweep =', R_read)
 record_resistance(Record_file, V_sweep, R_read, 'after_sweep')
 
 #define initial waveform
 cycle_waveform(V_RESET,V_SET)
 
+
+# RESET try of the write-verify loops
+def reset_attempt(V_RESET, cycle):
+    RESET = create_waveform(rise_time, 50e-9, fall_time, V_RESET, delay, sample_rate)
+    awg.waveforms["RESET"] = RESET
+    sequence_config = [{"number": 1, "waveform": "RESET"}]
+    setup_sequences(awg, sequence_config)
+    awg.burst_count = int(1)
+
+    # setup oscilloscope
+    RESET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.02, "voltage")
+    RESET_settings['Channel 1 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.02, "voltage") * 2.8
+    RESET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage")
+    RESET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage") * 3
+    RESET_settings['Trigger Level']['Level'] = V_RESET * 0.7
+    setup_oscilloscope(scope, RESET_settings)
+
+    # setup relay
+    relays(esp32, 'switch')
+
+    # Output and Run
+    awg.write("OUTPut1:STATe 1")
+    awg.enabled = True
+
+    # waiting for trigger:
+    time_0 =trigger(scope, awg)
+    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
+    # plot_waveform(times,voltages)
+    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V_{cycle}', File_Path, '.npz'), times_v=times_v,
+                        voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
+
+    # read
+    R_read = measure_with_smu(smu, esp32, smu_read_params,
+                              smu_store.entry(f'read_after_RESET_{V_RESET}V_{cycle}'),
+                              last_resistance=expected_resistance(R_last.get('read'), HRS_lim))
+    R_last['read'] = R_read
+    print('Resistance after RESET =', R_read)
+    record_resistance(Record_file, V_RESET, R_read, f'after_RESET_{cycle}')
+    return R_read
+
+
+def reset_restore():
+    # initialization
+    measure_with_smu(smu, esp32, smu_sweep_params,
+                     smu_store.entry(f'sweep_{V_sweep}V'))
+    time.sleep(0.1)
+
+
 #####################################################################
 # setup relay
 relays(esp32, 'switch')
-time.sleep(1)
 
 for jj, ii in enumerate(step):
+    if journal.is_done(unit_key(jj, cycles=cycles[jj], V_SET=V_SET)):
+        continue
 
     # SET
     # define SET waveform
@@ -208,7 +275,6 @@ for jj, ii in enumerate(step):
 
     # setup relay
     relays(esp32, 'switch')
-    time.sleep(0.5)
 
     # Output and Run
     awg.write("OUTPut1:STATe 1")
@@ -225,69 +291,28 @@ for jj, ii in enumerate(step):
 
     # read
     R_read = measure_with_smu(smu, esp32, smu_read_params,
-                              generate_filename(f'read_after_SET_{V_SET}V', File_Path, '.npz'))
+                              smu_store.entry(f'read_after_SET_{V_SET}V'),
+                              last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
     print('Resistance after SET =', R_read)
-    record_resistance(Record_file, V_SET, R_read, f'after_SET_{cycles[jj]}')
+    health.record(Record_file, V_SET, R_read, f'after_SET_{cycles[jj]}')
+    if health.triggered:
+        print('endurance stopped:', health.triggered)
+        break
 
-    # RESET
-    HRS = 1e1
-    increase_num = 0
+    # RESET, V_RESET increases by 10 mV per try until HRS (at most 2.1 V)
     print(f'V_RESET:{V_RESET}')
-    while HRS < HRS_lim:
-        if increase_num != 0:
-            # initialization
-            measure_with_smu(smu, esp32, smu_sweep_params,
-                             generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-            time.sleep(0.1)
-
-        RESET = create_waveform(rise_time, 50e-9, fall_time, V_RESET, delay, sample_rate)
-        awg.waveforms["RESET"] = RESET
-        sequence_config = [{"number": 1, "waveform": "RESET"}]
-        setup_sequences(awg, sequence_config)
-        awg.burst_count = int(1)
-
-        # setup oscilloscope
-        RESET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.02, "voltage")
-        RESET_settings['Channel 1 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.02, "voltage") * 2.8
-        RESET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage")
-        RESET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage") * 3
-        RESET_settings['Trigger Level']['Level'] = V_RESET * 0.7
-        setup_oscilloscope(scope, RESET_settings)
-
-        # setup relay
-        relays(esp32, 'switch')
-        time.sleep(0.5)
-
-        # Output and Run
-        awg.write("OUTPut1:STATe 1")
-        awg.enabled = True
-
-        # waiting for trigger:
-        time_0 =trigger(scope, awg)
-        times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-        # plot_waveform(times,voltages)
-        np.savez_compressed(generate_filename(f'RESET_{V_RESET}V_{cycles[jj]}', File_Path, '.npz'), times_v=times_v,
-                            voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
-
-        # read
-        R_read = measure_with_smu(smu, esp32, smu_read_params,
-                                  generate_filename(f'read_after_RESET_{V_RESET}V_{cycles[jj]}', File_Path, '.npz'))
-        print('Resistance after RESET =', R_read)
-        record_resistance(Record_file, V_RESET, R_read, f'after_RESET_{cycles[jj]}')
-        HRS = R_read
-        
-        if HRS < HRS_lim:    
-            V_RESET += 0.01
-            increase_num += 1
-
-        if V_RESET > 2.1:
-            V_RESET = 2.1
-            break
+    reached, V_RESET, HRS, tries = write_verify(lambda V: reset_attempt(V, cycles[jj]),
+                                                LinearPolicy(V_RESET, 2.1, step=0.01), low=HRS_lim,
+                                                restore=reset_restore)
+    health.observe(V_RESET, HRS, f'after_RESET_{cycles[jj]}')
+    if health.triggered:
+        print('endurance stopped:', health.triggered)
+        break
 
     #cycle
     if ii !=0:
         relays(esp32, 'switch')
-        time.sleep(1)
 
         cycle_waveform(V_RESET,V_SET)
         setup_oscilloscope(scope, RESET_settings)
@@ -305,61 +330,22 @@ for jj, ii in enumerate(step):
         awg.enabled = False
         awg.write("OUTPut1:STATe 0")  # Ensure AWG is disabled
 
-#Last run
-
-# SET
-# define SET waveform
-sequence_config = [{"number": 1, "waveform": "SET"}]
-setup_sequences(awg, sequence_config)
-awg.burst_count = int(1)
-# setup oscilloscope
-setup_oscilloscope(scope, SET_settings)
-
-# setup relay
-relays(esp32, 'switch')
-time.sleep(0.5)
-
-# Output and Run
-awg.write("OUTPut1:STATe 1")
-awg.enabled = True
-
-# waiting for trigger:
-time_0 =trigger(scope, awg)
-times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
-# plot_waveform(times,voltages)
-np.savez_compressed(generate_filename(f'SET_{V_SET}V_{cycles[-1]}', File_Path, '.npz'), times_v=times_v,
-                    voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
-
-#####################################################################
-
-# read
-R_read = measure_with_smu(smu, esp32, smu_read_params,
-                          generate_filename(f'read_after_SET_{V_SET}V_{cycles[-1]}', File_Path, '.npz'))
-print('Resistance after SET =', R_read)
-record_resistance(Record_file, V_SET, R_read, f'after_SET_{cycles[-1]}')
-
-# RESET
-HRS = 1e1
-increase_num = 0
-while HRS < HRS_lim:
-    if increase_num != 0:
-        # initialization
-        measure_with_smu(smu, esp32, smu_sweep_params,
-                         generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz'))
-        time.sleep(0.1)
+    # the checkpoint only counts as done once its reads are on disk
+    smu_store.flush()
+    journal.complete(unit_key(jj, cycles=cycles[jj], V_SET=V_SET), V_RESET=V_RESET)
 
-    RESET = create_waveform(rise_time, 50e-9, fall_time, V_RESET, delay, sample_rate)
-    awg.waveforms["RESET"] = RESET
-    sequence_config = [{"number": 1, "waveform": "RESET"}]
+#Last run, unless a health rule stopped the device
+if not health.triggered:
+    # SET
+    # define SET waveform
+    sequence_config = [{"number": 1, "waveform": "SET"}]
     setup_sequences(awg, sequence_config)
     awg.burst_count = int(1)
-
     # setup oscilloscope
-    setup_oscilloscope(scope, RESET_settings)
+    setup_oscilloscope(scope, SET_settings)
 
     # setup relay
     relays(esp32, 'switch')
-    time.sleep(0.5)
 
     # Output and Run
     awg.write("OUTPut1:STATe 1")
@@ -369,23 +355,25 @@ while HRS < HRS_lim:
     time_0 =trigger(scope, awg)
     times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
     # plot_waveform(times,voltages)
-    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V_{cycles[-1]}', File_Path, '.npz'), times_v=times_v,
+    np.savez_compressed(generate_filename(f'SET_{V_SET}V_{cycles[-1]}', File_Path, '.npz'), times_v=times_v,
                         voltages_v=voltages_v, times_i=times_i, voltages_i=voltages_i)
 
+    #####################################################################
+
     # read
     R_read = measure_with_smu(smu, esp32, smu_read_params,
-                              generate_filename(f'read_after_RESET_{V_RESET}V_{cycles[-1]}', File_Path, '.npz'))
-    print('Resistance after RESET =', R_read)
-    record_resistance(Record_file, V_RESET, R_read, f'after_RESET_{cycles[-1]}')
-    HRS = R_read
+                              smu_store.entry(f'read_after_SET_{V_SET}V_{cycles[-1]}'),
+                              last_resistance=expected_resistance(R_last.get('read'), LRS_lim))
+    R_last['read'] = R_read
+    print('Resistance after SET =', R_read)
+    record_resistance(Record_file, V_SET, R_read, f'after_SET_{cycles[-1]}')
 
-    V_RESET += 0.05
-    increase_num += 1
+    # RESET, V_RESET increases by 50 mV per try until HRS (at most 3 V)
+    reached, V_RESET, HRS, tries = write_verify(lambda V: reset_attempt(V, cycles[-1]), LinearPolicy(V_RESET, 3, step=0.05),
+                                                low=HRS_lim, restore=reset_restore)
 
-    if V_RESET > 3:
-        V_RESET = 3
-        break
 
+smu_store.close()
 
 #plot_waveform(times, voltages)
 awg.enabled = False
@@ -0,0 +1,44 @@
+from PET import *
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+------------------------     Run Experiment Spec      ---------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+# Declarative protocol, see experiments/PTE_write-verify.yaml for the write-verify PTE map
+Spec_File = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiments', 'PTE_write-verify.yaml')
+
+# Resume = True skips the grid points completed by an interrupted run (see the journal next to the record file)
+Resume = True
+
+# Budget = probe time in seconds per pad (e.g. 2 * 3600 for two hours), None for the full raster. Every PTE map of
+# the pad gets an equal share of the time left and is measured coarse to fine within it, from the point durations
+# of earlier runs (see Cost_File).
+Budget = None
+
+# Dry_Run = True only estimates the run time from the operation durations measured in earlier runs
+Dry_Run = False
+Cost_File = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiments', 'costs.json')
+
+# Device profiles: with a material in the sample section, the run starts from what earlier runs learned on the die
+Profile_File = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'experiments', 'profiles.json')
+
+experiment = Experiment(Spec_File)
+costs = CostProfile(Cost_File)
+profiles = ProfileRegistry(Profile_File)
+
+if Dry_Run:
+    print(plan_experiment(experiment, costs, {'Budget_s': Budget} if Budget else None).report())
+else:
+    session = InstrumentSession.connect(experiment.spec['instruments'], costs)
+    try:
+        experiment.run(session, {'Budget_s': Budget} if Budget else None, Resume, profiles)
+    except NextJob as e:
+        # AbortPad included: a health rule gave up the device
+        print(f"Run ended by the health rules: {e}")
+    finally:
+        costs.save()
+        relays(session.esp32, 'off')
@@ -13,7 +13,6 @@ awg = connect_to_awg('169.254.42.153')
 scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
 smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
 esp32 = connect_to_esp32('COM4', 115200)
-time.sleep(1)
 
 '''------------------------------------------------------------------------
 ---------------------------------------------------------------------------
@@ -143,18 +142,26 @@ rise_time = 2e-9
 fall_time = 2e-9
 delay = 1e-6
 
+###################### sample info ###########################
+File_Root = "C:/Users/lisaadmin/Desktop/data/test"
+File_SampleName = "3-DIE-25"
+File_PadName = "C3-4"
+Record_ext = '_3.txt'
+
+# Run journal: with Resume = True, completed drift segments are skipped after a crash. A segment is keyed on its
+# sub folder and on the RESET pulse, so a new run never skips segments of an old one
+Resume = False
+journal = RunJournal(File_Root + '/' + File_SampleName + '/' + File_PadName + os.path.splitext(Record_ext)[0]
+                     + '_journal.jsonl', Resume)
+
 for i in range(3):
     for V_RESET in np.linspace(1.5,3,16):
         V_RESET_str = '{:.2f}'.format(V_RESET)
         V_RESET = float(V_RESET_str)
         print(V_RESET)
-        ###################### sample info ###########################
-        File_Root = "C:/Users/lisaadmin/Desktop/data/test"
-        File_SampleName = "3-DIE-25"
-        File_PadName = "C3-4"
         Sub_folder = f'{i+2}th_RESET_drift_after cycle_50ns'
-
-        Record_ext = '_3.txt'
+        if journal.is_done(unit_key(Sub_folder, T_RESET=T_RESET, V_RESET=V_RESET)):
+            continue
 
         if Sub_folder == '0':
             File_Path = File_Root + '/' + File_SampleName + '/' + File_PadName + '/'
@@ -214,9 +221,7 @@ for i in range(3):
         # RESET
         # Write waveforms
         RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
-        awg.waveforms["RESET"] = RESET
         sequence_config = [{"number": 1, "waveform": "RESET"}]
-        setup_sequences(awg, sequence_config)
 
         # setup oscilloscope
         RESET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.033, "voltage")
@@ -224,11 +229,8 @@ for i in range(3):
         RESET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage")
         RESET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage") * 3
         RESET_settings['Trigger Level']['Level'] = V_RESET * 0.7
-        setup_oscilloscope(scope, RESET_settings)
-
-        # setup relay
-        relays(esp32, 'switch')
-        time.sleep(0.5)
+        # upload waveform, setup oscilloscope and relay in parallel
+        prepare_shot(awg, scope, esp32, sequence_config, RESET_settings, {"RESET": RESET})
 
         # Output and Run
         awg.write("OUTPut1:STATe 1")
@@ -250,6 +252,8 @@ for i in range(3):
             delta_time_ms = (time_now-time_0).total_seconds()*1000
             record_resistance(Record_file, V_RESET, R_read, f'drift_{delta_time_ms:.2f} ms')
 
+        journal.complete(unit_key(Sub_folder, T_RESET=T_RESET, V_RESET=V_RESET))
+
 
 
         #######################################################################
@@ -0,0 +1,264 @@
+from PET import *
+
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+------------------------     Connect Instruments      ---------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+awg = connect_to_awg('169.254.42.153')
+scope = connect_to_scope('USB0::0x0957::0x179B::MY56273412::0::INSTR')
+smu = connect_to_smu('USB0::0x0957::0x8B18::MY51141455::0::INSTR')
+esp32 = RelayController(connect_to_esp32('COM4', 115200))
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+------------------------     Setting oscilloscope      --------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+RESET_settings = {
+    'Acquisition Type': 'NORM',
+    'Channel 1 Probe': 1,
+    'Channel 2 Probe': 10,
+    'Timebase Scale': '2e-8',
+    'Timebase Position': '4e-8',  
+    'Trigger Source': 'CHANNEL2',
+    'Trigger Level': {'Channel': 'CHANNEL2', 'Level': 1},
+    'Channel 1 Scale': 0.05,  
+    'Channel 1 Offset': 0.15,
+    'Channel 2 Scale': 1,  
+    'Channel 2 Offset': 3,
+    'Waveform Source': 'CHANNEL1',
+    'Waveform Byte Order': 'LSBFirst',
+    'Waveform Format': 'WORD',
+    'Waveform Points Mode': 'RAW',
+    'Waveform Points': 800000,
+    'Trigger Mode': ':SINGle',
+    'Wait for Operation Complete': '*WAI'
+}
+
+SET_settings = {
+    'Acquisition Type': 'NORM',
+    'Channel 1 Probe': 1,
+    'Channel 2 Probe': 10,
+    'Timebase Scale': '1e-7',  # 5 microseconds per division
+    'Timebase Position': '3e-7',  # 20 microseconds
+    'Trigger Source': 'CHANNEL2',
+    'Trigger Level': {'Channel': 'CHANNEL2', 'Level': 0.7},
+    'Channel 1 Scale': 0.02,  # 50 mV per division
+    'Channel 1 Offset': 0.056,  # 100 mV offset
+    'Channel 2 Scale': 0.2,  
+    'Channel 2 Offset': 0.6,
+    'Waveform Source': 'CHANNEL1',
+    'Waveform Byte Order': 'LSBFirst',
+    'Waveform Format': 'WORD',
+    'Waveform Points Mode': 'RAW',
+    'Waveform Points': 800000,
+    'Trigger Mode': ':SINGle',
+    'Wait for Operation Complete': '*WAI'
+}
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+------------------------     Setting SMU     ------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+smu_read_params = {
+    "start_voltage": "0",
+    "stop_voltage": "0.1",
+    "NPLC": "1",
+    "points": "51",
+    "compliance_current": "0.01",
+    "sweep_direction": "DOUB"
+}
+
+smu_read_list_params = {
+    "voltage": "0.1",
+    "NPLC": "1",
+    "points": "1000",
+    "compliance_current": "0.01",
+}
+
+smu_sweep_params = {
+    "start_voltage": "0",
+    "stop_voltage": "3",
+    "NPLC": "1",
+    "points": "151",
+    "compliance_current": "0.01",
+    "sweep_direction": "DOUB"
+}
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+--------------------     Setting default Waveform      --------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+# Calculate waveforms
+sample_rate = awg.sampling_rate
+RESET = create_waveform(2e-9, 5e-8, 2e-9, 0.5, 1e-6, sample_rate)
+SET = create_waveform(1e-7, 2e-7, 1e-7, 1, 1e-6, sample_rate)
+
+# Write waveforms
+awg.waveforms["RESET"] = RESET
+awg.waveforms["SET"] = SET
+
+sequence_config = [{"number": 1, "waveform": "RESET"}]
+
+setup_sequences(awg, sequence_config)
+
+# Set run mode to single Burst
+awg.setting_ch[1].enable = True
+awg.run_mode = "BURST"
+awg.trigger_source = 'MAN'  # Manual
+awg.burst_count = int(1)
+
+'''------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+--------------------     Setting Programming Measurement      -------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------
+---------------------------------------------------------------------------'''
+
+###################### Basic parameters ###########################
+
+V_sweep = 3
+points_sweep = 151  # 51 for time efficiency, 101 for Better resolution
+V_read = 0.1
+T_RESET = 50e-9     # > 1e-8 to get correct current response (BW limit from Oscilloscope)
+rise_time = 2e-9
+fall_time = 2e-9
+delay = 1e-6
+
+###################### sample info ###########################
+File_Root = "C:/Users/lisaadmin/Desktop/data/test"
+File_SampleName = "3-DIE-25"
+Record_ext = '_3.txt'
+
+# Pads measured together, by relay device (see RELAY_DEVICE_MAP): while the SMU follows the drift of one pad,
+# the AWG programs the other one. Device 1 needs a second probe on the relays ON2/ON3. The pulses and reads of
+# the other pad delay the drift reads, so they are not evenly spaced in time; for the drift timing of a single
+# pad use probestation_programming_drift_user.py.
+Pads = {0: "C3-4", 1: "C3-5"}
+
+# Write-verify condition
+LRS_lim = 1.01e6
+HRS_lim = 3.1e5
+
+# Run journal: with Resume = True, completed drift segments are skipped after a crash. A segment is keyed on its
+# sub folder and on the RESET pulse, so a new run never skips segments of an old one
+Resume = False
+journal = RunJournal(File_Root + '/' + File_SampleName + '/' + '_'.join(Pads.values())
+                     + os.path.splitext(Record_ext)[0] + '_journal.jsonl', Resume)
+
+
+def reset_shot(relay, V_RESET, File_Path):
+    # Write waveforms
+    RESET = create_waveform(rise_time, T_RESET, fall_time, V_RESET, delay, sample_rate)
+    sequence_config = [{"number": 1, "waveform": "RESET"}]
+
+    # setup oscilloscope
+    RESET_settings['Channel 1 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.033, "voltage")
+    RESET_settings['Channel 1 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.033, "voltage") * 2.9
+    RESET_settings['Channel 2 Scale'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage")
+    RESET_settings['Channel 2 Offset'] = adjust_oscilloscope_scale(V_RESET * 0.33, "voltage") * 3
+    RESET_settings['Trigger Level']['Level'] = V_RESET * 0.7
+    # upload waveform, setup oscilloscope and relay in parallel
+    prepare_shot(awg, scope, relay, sequence_config, RESET_settings, {"RESET": RESET})
+
+    # Output and Run
+    awg.write("OUTPut1:STATe 1")
+    awg.enabled = True
+
+    # waiting for trigger:
+    time_0 = trigger(scope, awg)
+    times_i, voltages_i, times_v, voltages_v = get_waveform_data(scope)
+    np.savez_compressed(generate_filename(f'RESET_{V_RESET}V', File_Path, '.npz'), times_v=times_v, voltages_v=voltages_v,times_i=times_i, voltages_i=voltages_i)
+    return time_0
+
+
+def drift(relay, File_PadName):
+    # protocol of one pad for MultiDeviceExecutor: every yield hands a pulse or a read to the shared instruments
+    for i in range(3):
+        for V_RESET in np.linspace(1.5,3,16):
+            V_RESET_str = '{:.2f}'.format(V_RESET)
+            V_RESET = float(V_RESET_str)
+            print(File_PadName, V_RESET)
+            Sub_folder = f'{i+2}th_RESET_drift_after cycle_50ns'
+            if journal.is_done(unit_key(File_PadName, Sub_folder, T_RESET=T_RESET, V_RESET=V_RESET)):
+                continue
+
+            if Sub_folder == '0':
+                File_Path = File_Root + '/' + File_SampleName + '/' + File_PadName + '/'
+            else:
+                File_Path = File_Root + '/' + File_SampleName + '/' + File_PadName + '/' + Sub_folder + '/'
+
+            if not os.path.exists(File_Path):
+                os.makedirs(File_Path)
+
+            Record_file = File_Root + '/' + File_SampleName + '/' + File_PadName + Record_ext
+
+            ######################## Measurement ###############################
+            count = 0
+            LRS = 1e10
+            while LRS > LRS_lim:
+
+                # initialization
+                sweep_params = dict(smu_sweep_params, stop_voltage=V_sweep, points=points_sweep)
+                yield ('read', lambda: measure_with_smu(smu, relay, sweep_params,
+                                                        generate_filename(f'sweep_{V_sweep}V', File_Path, '.npz')))
+
+                #####################################################################
+
+                # read
+                R_read = yield ('read', lambda: measure_with_smu(smu, relay, smu_read_params,
+                                                                 generate_filename(f'read_after_SET_{V_sweep}V', File_Path, '.npz')))
+                print('Resistance after sweep =', R_read)
+                record_resistance(Record_file, V_sweep, R_read, 'after_SET')
+                LRS = R_read
+                count += 1
+                if count >= 3:
+                    print('initialiyation check break due to the cycle limit')
+                    break
+
+            #####################################################################
+
+            # RESET
+            time_0 = yield ('pulse', lambda: reset_shot(relay, V_RESET, File_Path))
+
+            #####################################################################
+
+            # read, the other pad is pulsed between the reads
+            time_now = time_0
+            while time_now < time_0+timedelta(seconds=1100):
+                R_read, time_now = yield ('read', lambda: measure_with_smu_list(smu, relay, smu_read_list_params,
+                                                                                generate_filename(f'read_after_RESET_{V_RESET}V', File_Path, '.npz')))
+                print('Resistance after RESET =', R_read)
+                delta_time_ms = (time_now-time_0).total_seconds()*1000
+                record_resistance(Record_file, V_RESET, R_read, f'drift_{delta_time_ms:.2f} ms')
+
+            journal.complete(unit_key(File_PadName, Sub_folder, T_RESET=T_RESET, V_RESET=V_RESET))
+
+
+executor = MultiDeviceExecutor(esp32)
+for device, File_PadName in Pads.items():
+    executor.add_device(device, drift, File_PadName)
+executor.run()
+print(f"{executor.wall_time:.0f} s, SMU busy {executor.busy_time['smu']:.0f} s, AWG busy {executor.busy_time['awg']:.0f} s")
+
+#######################################################################
+
+for device in Pads:
+    relays(esp32, 'off', device=device)
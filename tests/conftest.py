@@ -0,0 +1,38 @@
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+import pytest
+
+# The PET package imports the instrument drivers; without them the tests are skipped.
+REQUIRED_MODULES = ('pyvisa', 'pymeasure', 'serial', 'pandas', 'matplotlib')
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'PET module')
+
+
+class _PETFinder(importlib.abc.MetaPathFinder):
+    # The scripts import the 'PET module' folder as the package PET; an installed PET takes precedence.
+
+    def find_spec(self, name, path, target=None):
+        if name != 'PET':
+            return None
+        return importlib.util.spec_from_file_location('PET', os.path.join(PACKAGE_DIR, '__init__.py'),
+                                                      submodule_search_locations=[PACKAGE_DIR])
+
+
+sys.meta_path.append(_PETFinder())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Module(pytest.Module):
+    # Skips a test module before it imports PET if a driver is missing.
+
+    def collect(self):
+        for module in REQUIRED_MODULES:
+            pytest.importorskip(module)
+        return super().collect()
+
+
+def pytest_pycollect_makemodule(module_path, parent):
+    return _Module.from_parent(parent, path=module_path)
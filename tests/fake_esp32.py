@@ -0,0 +1,117 @@
+import threading
+import time
+
+from PET.PET_module import RELAY_PROGRAM_MAX_STEPS
+
+
+class FakeESP32Serial:
+    """
+    Stand-in for the serial connection to the ESP32 running RF_switch.ino, for testing without hardware.
+
+    It accepts the same newline-terminated commands and PRG frames as the firmware, answers them the same way and
+    records every relay pulse in self.pulses as (time.monotonic(), pin index). The relay pulse and settle time are
+    simulated by delaying the acknowledgement. With acknowledge=False it behaves like the firmware before the
+    acknowledgements, which switches the relays but answers nothing.
+
+    Usage:
+    - esp32 = FakeESP32Serial()
+    - relays(esp32, 'switch')
+    """
+
+    version = 'RF_switch 1.4'
+
+    def __init__(self, pulse_time=0.1, settle_time=0.02, timeout=None, acknowledge=True):
+        self.pulse_time = pulse_time
+        self.acknowledge = acknowledge
+        self.settle_time = settle_time
+        self.timeout = timeout
+        self.is_open = True
+        self.baudrate = 115200
+        self.pulses = []
+        self._input = b''
+        self._output = []  # (ready time, line) pairs
+        self._busy_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            now = time.monotonic()
+            return sum(len(line) for ready, line in self._output if ready <= now)
+
+    def write(self, data):
+        with self._lock:
+            self._input += bytes(data)
+            while b'\n' in self._input:
+                line, self._input = self._input.split(b'\n', 1)
+                self._handle(line.decode().strip())
+        return len(data)
+
+    def _handle(self, command):
+        # mirrors loop() of RF_switch.ino; commands are executed one after the other
+        start = max(time.monotonic(), self._busy_until)
+        if command == 'PING':
+            self._reply(start, f'PONG {self.version}')
+            return
+        if command.startswith('PRG '):
+            self._run_program(start, command[4:])
+            return
+        for i in range(4):
+            if command == f'ON{i}':
+                self.pulses.append((start, i))
+                self._reply(start + self.pulse_time + self.settle_time, f'ACK {command}')
+                return
+            if command == f'OFF{i}':
+                self._reply(start, f'ACK {command}')
+                return
+        if command:
+            self._reply(start, f'ERR {command}')
+
+    def _run_program(self, start, program):
+        # mirrors runProgram() of RF_switch.ino, simulating the execution time of every step
+        steps = program.split(';') if program else []
+        if len(steps) > RELAY_PROGRAM_MAX_STEPS:
+            self._reply(start, 'ERR PRG too many steps')
+            return
+        for step in steps:
+            valid = (step[:2] in ('ON', 'HI', 'LO') and len(step) == 3 and step[2] in '0123') \
+                or (step[:1] == 'W' and step[1:].isdigit() and len(step) <= 10)
+            if not valid:
+                self._reply(start, f'ERR PRG {step}')
+                return
+        stamps = []
+        t = 0.0
+        target = 0.0
+        for step in steps:
+            stamps.append(t)
+            if step.startswith('ON'):
+                self.pulses.append((start + t, int(step[2])))
+                t += self.pulse_time + self.settle_time
+                target = t
+            elif step.startswith('W'):
+                target += int(step[1:]) * 1e-6
+                t = max(t, target)
+        self._reply(start + t, 'DONE ' + ','.join(str(int(round(x * 1e6))) for x in stamps))
+
+    def _reply(self, ready, line):
+        self._busy_until = ready
+        if self.acknowledge:
+            self._output.append((ready, (line + '\r\n').encode()))
+
+    def readline(self):
+        t_end = None if self.timeout is None else time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                if self._output and self._output[0][0] <= time.monotonic():
+                    return self._output.pop(0)[1]
+                wait = self._output[0][0] - time.monotonic() if self._output else 0.001
+            if t_end is not None and time.monotonic() >= t_end:
+                return b''
+            time.sleep(min(max(wait, 0.0005), 0.01))
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._output = [(ready, line) for ready, line in self._output if ready > time.monotonic()]
+
+    def close(self):
+        self.is_open = False
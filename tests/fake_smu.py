@@ -0,0 +1,90 @@
+import numpy as np
+
+# Value the B29xx reports for a reading that overflowed its fixed range.
+OVERFLOW = 9.9e37
+
+
+class FakeSMU:
+    """
+    Stand-in for a B29xx SMU driven through pyvisa, for testing without hardware.
+
+    It understands the SCPI commands written by the configure_smu_* functions, runs an acquisition on 'INIT' and
+    answers the FETC:ARR queries. The device is a resistor: resistance is a value in Ohm or a function of the
+    source voltage and of the index of the point within the whole run. The current is clamped at the
+    compliance, and on a fixed current range readings at or above the full scale overflow like on the
+    instrument. Every command is recorded in self.commands and every acquisition in self.acquisitions.
+
+    Usage:
+    - smu = FakeSMU(resistance=1e4)
+    - get_smu_measurement(smu, smu_read_params)
+    """
+
+    def __init__(self, resistance=1e4, timeout=5000):
+        self.resistance = resistance
+        self.timeout = timeout
+        self.commands = []
+        self.acquisitions = []
+        self.points = 0
+        self._sweep = {}
+        self._list = None
+        self._mode = 'FIX'
+        self._compliance = None
+        self._range = None
+        self._esr = 0
+        self._data = None
+
+    def write(self, command):
+        self.commands.append(command)
+        header, _, value = command.partition(' ')
+        if header == 'SOUR:VOLT:MODE':
+            self._mode = value
+        elif header == 'SOUR:LIST:VOLT':
+            self._list = np.array([float(x) for x in value.split(',')])
+        elif header in ('SOUR:VOLT:START', 'SOUR:VOLT:STOP', 'SOUR:VOLT:POIN', 'SOUR:SWE:STA'):
+            self._sweep[header] = value
+        elif header == 'SENS:CURR:PROT':
+            self._compliance = float(value)
+        elif command == 'SENS:CURR:RANG:AUTO ON':
+            self._range = None
+        elif header == 'SENS:CURR:RANG':
+            self._range = float(value)
+        elif command == 'INIT':
+            self._acquire()
+        elif command == '*CLS':
+            self._esr = 0
+        elif command == '*OPC':
+            self._esr = 1
+
+    def _source(self):
+        if self._mode == 'LIST':
+            return self._list
+        up = np.linspace(float(self._sweep['SOUR:VOLT:START']), float(self._sweep['SOUR:VOLT:STOP']),
+                         int(self._sweep['SOUR:VOLT:POIN']))
+        return np.concatenate([up, up[::-1]]) if self._sweep['SOUR:SWE:STA'] == 'DOUB' else up
+
+    def _acquire(self):
+        source = self._source()
+        index = self.points + np.arange(len(source))
+        self.points += len(source)
+        if callable(self.resistance):
+            resistance = np.array([self.resistance(v, k) for v, k in zip(source, index)], dtype=float)
+        else:
+            resistance = np.full(len(source), float(self.resistance))
+        current = np.clip(source / resistance, -self._compliance, self._compliance)
+        if self._range is not None:
+            current = np.where(np.abs(current) >= self._range, OVERFLOW, current)
+        self.acquisitions.append({'source': source, 'compliance': self._compliance, 'range': self._range})
+        self._data = {'TIME': index * 0.02, 'SOUR': source, 'VOLT': source, 'CURR': current,
+                      'RES': source / np.where(current == 0, np.nan, current)}
+
+    def query(self, command):
+        self.commands.append(command)
+        if command == '*ESR?':
+            return str(self._esr)
+        if command == '*OPC?':
+            return '1'
+        raise ValueError(f"FakeSMU does not answer {command}")
+
+    def query_ascii_values(self, command):
+        self.commands.append(command)
+        return list(self._data[command.split(':')[2].rstrip('?')])
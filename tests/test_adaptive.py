@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from PET.adaptive import LinearPolicy, ModelPolicy, RepeatPolicy, write_verify
+
+
+def reset(value):
+    # HRS rises steeply above 2.8 V
+    return 1e4 * 10 ** (2 * max(value - 2.3, 0)) * (100 if value >= 2.95 else 1)
+
+
+def test_model_policy_aims_inside_a_one_sided_window():
+    policy = ModelPolicy(2.3, 3, 0.05)
+    reached, value, resistance, history = write_verify(reset, policy, low=5.1e5)
+    assert reached
+    assert resistance >= 5.1e5
+    assert policy.target == pytest.approx(5.1e5 * 10 ** 0.1)
+
+
+def test_model_policy_steps_on_when_the_prediction_repeats():
+    policy = ModelPolicy(2.0, 3, 0.05, model=lambda value, resistance, target: value)
+    reached, value, resistance, history = write_verify(reset, policy, low=5.1e5)
+    assert reached
+    assert np.all(np.diff([v for v, _ in history]) == pytest.approx(0.0125, abs=1e-3))
+
+
+def test_write_verify_restores_before_every_retry_and_stops_at_the_budget():
+    restores = []
+    policy = LinearPolicy(2.0, 3, step=0.1)
+    reached, value, resistance, history = write_verify(
+        reset, policy, low=1e9, max_tries=3, restore=lambda: restores.append(True))
+    assert not reached
+    assert [v for v, _ in history] == pytest.approx([2.0, 2.1, 2.2])
+    assert len(restores) == 2
+    assert (value, resistance) == history[-1]
+
+
+def test_write_verify_raises_the_set_voltage_while_above_the_window():
+    def set_(value):
+        # LRS falls a decade per 0.5 V above 1 V
+        return 1e5 / 10 ** (2 * max(value - 1, 0))
+
+    policy = LinearPolicy(1.0, 2, step=0.1)
+    reached, value, resistance, history = write_verify(set_, policy, high=3e4, polarity='decrease')
+    assert reached
+    assert value == pytest.approx(1.3)
+    assert resistance <= 3e4
+
+
+def test_repeat_policy_sweeps_again_until_lrs_or_the_budget():
+    reads = iter([5e4, 3e4, 1e4, 1e4])
+    reached, value, resistance, history = write_verify(lambda value: next(reads), RepeatPolicy(4), high=2e4,
+                                                       polarity='decrease', max_tries=3)
+    assert reached and resistance == 1e4
+    assert [v for v, _ in history] == [4, 4, 4]
+    reached, value, resistance, history = write_verify(lambda value: 5e4, RepeatPolicy(4), high=2e4,
+                                                       polarity='decrease', max_tries=3)
+    assert not reached and len(history) == 3
+    with pytest.raises(ValueError):
+        write_verify(lambda value: 5e4, RepeatPolicy(4), high=2e4, polarity='decrease')
+
+
+def test_write_verify_rejects_an_unknown_polarity():
+    with pytest.raises(ValueError):
+        write_verify(reset, LinearPolicy(2.0, 3, step=0.1), low=1e5, polarity='up')
@@ -0,0 +1,15 @@
+from PET.analog import PulseResponseModel
+from PET.PET_module import record_resistance
+
+
+def test_fit_resistance_log_learns_only_from_known_pre_pulse_states(tmp_path):
+    log = str(tmp_path / 'pad.txt')
+    record_resistance(log, 2, 1e4, 'after_sweep')
+    record_resistance(log, 1.8, 2e5, 'after_RESET')   # from the sweep read
+    record_resistance(log, 1.9, 1e6, 'after_RESET')   # retry after an unlogged restore: skipped
+    record_resistance(log, 1.0, 2e4, 'after_SET_1.0e-07s')   # from the RESET read
+    record_resistance(log, 0.9, 2e4, 'before_SET_1.0e-07s')
+    record_resistance(log, 0.9, 1.5e4, 'after_SET_1.0e-07s')   # from the explicit pre-pulse read
+    model = PulseResponseModel()
+    assert model.fit_resistance_log(log) == 3
+    assert (model.samples('SET'), model.samples('RESET')) == (2, 1)
@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+from PET.asynchronous import AsyncSession
+
+
+def test_calls_overlap_across_instruments_and_queue_on_one():
+    intervals = []
+
+    def busy(name):
+        start = time.monotonic()
+        time.sleep(0.05)
+        intervals.append((name, start, time.monotonic()))
+
+    async def main():
+        async with AsyncSession() as session:
+            await asyncio.gather(session.call(['awg'], busy, 'awg'), session.call(['smu'], busy, 'smu'),
+                                 session.call(['smu', 'esp32'], busy, 'smu+esp32'))
+
+    asyncio.run(main())
+    spans = {name: (start, stop) for name, start, stop in intervals}
+    # the AWG runs alongside the SMU, the two SMU calls run one after the other
+    assert spans['awg'][0] < spans['smu'][1] and spans['smu'][0] < spans['awg'][1]
+    first, second = sorted([spans['smu'], spans['smu+esp32']])
+    assert second[0] >= first[1]
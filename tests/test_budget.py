@@ -0,0 +1,19 @@
+import os
+
+import pytest
+
+import PET
+from PET.budget import TimeBudget
+
+
+def test_time_budget_blends_the_prior_with_the_points():
+    budget = TimeBudget(100, 10, clock=lambda: 0.0)
+    budget.add(20)
+    assert budget.estimate == pytest.approx(15)
+    budget.pending = 4
+    assert budget.share() == pytest.approx(25)
+
+
+def test_nested_grids_share_the_budget_of_the_pad():
+    spec = os.path.join(os.path.dirname(__file__), '..', 'standard', 'experiments', 'PTE_write-verify.yaml')
+    assert PET.plan_experiment(spec, variables={'Budget_s': 7200}).total == pytest.approx(7200, rel=0.05)
@@ -0,0 +1,42 @@
+from fake_esp32 import FakeESP32Serial
+
+from PET.campaign import Campaign
+from PET.planner import DryRunSession
+
+
+def protocol(root):
+    return {'sample': {'root': str(root), 'sample': 'die', 'pad': 'pad'},
+            'smu': {'read': {'start_voltage': '0', 'stop_voltage': '0.1', 'NPLC': '1', 'points': '51'}},
+            'steps': [{'grid': {'V': {'linspace': [1, 2, 3]}},
+                       'steps': [{'read': 'read', 'label': 'read_{V}V', 'event': 'read', 'voltage': 'V'}]}]}
+
+
+def session():
+    session = DryRunSession()
+    session.esp32 = FakeESP32Serial(pulse_time=0, settle_time=0)
+    return session
+
+
+def test_every_repetition_of_a_job_runs_and_resumes_on_its_own(tmp_path):
+    first = session()
+    campaign = Campaign(first)
+    campaign.add('die', 'pad', protocol(tmp_path), repeat=2)
+    campaign.run(resume=True)
+    assert first.counts['smu_read'] == 6
+    assert len(list((tmp_path / 'die').glob('pad_*_journal.jsonl'))) == 2
+
+    # resuming the finished campaign skips every point of both repetitions
+    second = session()
+    campaign.session = second
+    campaign.run(resume=True)
+    assert 'smu_read' not in second.counts
+
+
+def test_protocols_on_the_same_pad_keep_their_own_journal(tmp_path):
+    other = protocol(tmp_path)
+    other['name'] = 'other'
+    campaign = Campaign(session())
+    campaign.add('die', 'pad', protocol(tmp_path))
+    campaign.add('die', 'pad', other)
+    campaign.run(resume=True)
+    assert campaign.session.counts['smu_read'] == 6
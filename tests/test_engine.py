@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+
+import PET.engine as engine
+from PET.engine import InstrumentSession, compile_step, evaluate, render
+from fake_smu import FakeSMU
+
+
+def test_evaluate_runs_restricted_expressions():
+    assert evaluate('np.log10(R) * 2 if R > 1 else -1', {'R': 100}) == pytest.approx(4)
+    assert evaluate(['V_SET * 0.7', 2], {'V_SET': 1.0}) == [pytest.approx(0.7), 2]
+    assert render('SET_{V_SET}V_{T_SET:.1e}s', {'V_SET': 1.2, 'T_SET': 5e-8}) == 'SET_1.2V_5.0e-08s'
+
+
+@pytest.mark.parametrize('expression', ['__import__("os")', 'np.load("x.npy")', '(1).__class__', 'DOUB',
+                                        '[x for x in R]', 'lambda: 0'])
+def test_evaluate_rejects_code_and_unknown_names(expression):
+    with pytest.raises(ValueError):
+        evaluate(expression, {'R': [1]})
+
+
+def test_verify_policy_needs_a_budget():
+    verify = {'variable': 'V_sweep', 'target': [None, 'LRS_lim'], 'policy': {'repeat': {'start': 4}}}
+    with pytest.raises(ValueError, match='max_tries'):
+        compile_step({'verify': verify, 'steps': []})
+    compile_step({'verify': dict(verify, max_tries=3), 'steps': []})
+
+
+def test_fire_without_esp32_only_triggers(monkeypatch):
+    monkeypatch.setattr(engine, 'relays', lambda *args: pytest.fail('relays called without an ESP32'))
+    monkeypatch.setattr(engine, 'trigger', lambda scope, awg: None)
+    monkeypatch.setattr(engine, 'get_waveform_data', lambda scope: {'time': [0.0]})
+    awg = SimpleNamespace(sampling_rate=1e9, write=lambda command: None)
+    assert InstrumentSession(awg, None, None, None).fire() == {'time': [0.0]}
+    assert awg.enabled
+
+
+def test_measurements_without_esp32_skip_the_relays(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, 'relays', lambda *args: pytest.fail('relays called without an ESP32'))
+    session = InstrumentSession(None, None, FakeSMU(resistance=lambda v, k: 1e7 if k < 10 else 1e3), None)
+    params = {'start_voltage': '0', 'stop_voltage': '2', 'NPLC': '1', 'points': '51', 'compliance_current': '0.01',
+              'sweep_direction': 'DOUB'}
+    assert session.sweep_early_abort('sweep', params, str(tmp_path / 'sweep.npz'), {}) == pytest.approx(0.4)
+    read = dict(params, stop_voltage='0.1')
+    assert session.measure('read', read, str(tmp_path / 'read.npz')) == pytest.approx(1e3)
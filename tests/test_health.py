@@ -0,0 +1,74 @@
+import pytest
+from fake_esp32 import FakeESP32Serial
+
+from PET.campaign import Campaign
+from PET.engine import Experiment
+from PET.health import AbortPad, WindowCollapseRule
+from PET.planner import DryRunSession
+
+
+def test_window_collapse_counts_a_reset_ramp_as_one_cycle():
+    rule = WindowCollapseRule(min_ratio=10, count=2)
+    # one cycle whose RESET ramp needed three tries, the last one reaching the HRS
+    history = [(1.2, 1e4, 'after_SET_1'), (1.8, 2e4, 'after_RESET_1'), (1.81, 3e4, 'after_RESET_1'),
+               (1.82, 1e6, 'after_RESET_1'), (1.2, 1e4, 'after_SET_2')]
+    assert rule.check(history) is None
+    history += [(1.82, 5e4, 'after_RESET_2'), (1.2, 1e4, 'after_SET_3'),
+                (1.82, 6e4, 'after_RESET_3'), (1.2, 1e4, 'after_SET_4')]
+    assert rule.check(history) is not None
+
+
+class Session(DryRunSession):
+    """Dry-run instruments whose reads return the given resistances, one after the other; health rules apply."""
+
+    dry_run = False
+
+    def __init__(self, resistances):
+        resistances = iter(resistances)
+        super().__init__(outcome=lambda profile, params: next(resistances))
+        self.esp32 = FakeESP32Serial(pulse_time=0, settle_time=0)
+
+
+def spec(root, health, steps):
+    return {'sample': {'root': str(root), 'sample': 'die', 'pad': 'pad'},
+            'smu': {'read': {'start_voltage': '0', 'stop_voltage': '0.1', 'NPLC': '1', 'points': '51'}},
+            'variables': {'HRS_lim': 1e6}, 'health': health, 'steps': steps}
+
+
+READ = {'read': 'read', 'label': 'read_{V}V', 'event': 'after_RESET', 'voltage': 'V'}
+RAMP = {'verify': {'until': 'R >= HRS_lim', 'vary': {'V': {'linspace': [1, 2, 3]}}}, 'steps': [READ]}
+
+
+def test_skip_row_ends_only_the_innermost_loop(tmp_path):
+    session = Session([1e4] * 4)
+    health = [{'stuck': {'below': 'HRS_lim', 'event': 'after_RESET', 'count': 2, 'action': 'skip_row'}}]
+    Experiment(spec(tmp_path, health, [{'grid': {'T': {'range': [2]}, 'V': {'range': [3]}}, 'steps': [READ]}])
+               ).run(session)
+    assert session.counts['smu_read'] == 4
+
+
+def test_a_verify_loop_counts_once_in_the_health_rules(tmp_path):
+    # two RESET ramps reaching HRS_lim on their last try do not trigger, although four tries in a row failed
+    session = Session([1e4, 1e4, 2e6] * 2)
+    health = [{'stuck': {'below': 'HRS_lim', 'event': 'after_RESET', 'count': 2, 'action': 'abort_pad'}}]
+    Experiment(spec(tmp_path, health, [{'grid': {'i': {'range': [2]}}, 'steps': [RAMP]}])).run(session)
+    assert session.counts['smu_read'] == 6
+
+    # two failed ramps in a row do
+    session = Session([1e4] * 9)
+    with pytest.raises(AbortPad):
+        Experiment(spec(tmp_path, health, [{'grid': {'i': {'range': [3]}}, 'steps': [RAMP]}])).run(session)
+    assert session.counts['smu_read'] == 6
+
+
+def test_abort_pad_skips_the_other_jobs_on_the_pad(tmp_path):
+    health = [{'open': {'limit': 1e9, 'count': 2, 'action': 'abort_pad'}}]
+    protocol = spec(tmp_path, health, [{'grid': {'V': {'range': [3]}}, 'steps': [READ]}])
+    campaign = Campaign(Session([float('inf')] * 2 + [1e4] * 3), prompt=lambda message: None)
+    campaign.add('die', 'pad', protocol, repeat=2)
+    campaign.add('die', 'other pad', protocol)
+    (first, _, error), (second, context, skipped), (other, done, _) = campaign.run()
+    assert isinstance(error, AbortPad)
+    assert (context, skipped) == (None, None)
+    assert done.variables['R'] == 1e4
+    assert campaign.session.counts['smu_read'] == 5
@@ -0,0 +1,28 @@
+import numpy as np
+
+from PET.journal import RunJournal, unit_key
+
+
+def test_unit_key_prints_numpy_scalars_like_floats():
+    assert unit_key(0, T_SET=np.float64(2e-9), V_SET=0.2) == '0/T_SET=2e-09/V_SET=0.2'
+
+
+def test_journal_resumes_the_completed_units_and_their_state(tmp_path):
+    filename = str(tmp_path / 'pad_journal.jsonl')
+    journal = RunJournal(filename)
+    journal.complete(unit_key(0, cycles=10), V_RESET=np.float64(1.8))
+    journal.complete(unit_key(1, cycles=100), V_RESET=1.85)
+    with open(filename, 'a') as file:
+        # the line written during the crash
+        file.write('{"unit": "2/cycles=1000", "sta')
+
+    resumed = RunJournal(filename)
+    assert resumed.is_done('0/cycles=10') and resumed.is_done('1/cycles=100')
+    assert not resumed.is_done('2/cycles=1000')
+    assert resumed.get('V_RESET') == 1.85
+
+    fresh = RunJournal(filename, resume=False)
+    assert not fresh.is_done('0/cycles=10')
+    assert fresh.get('V_RESET', 1.8) == 1.8
+    # a later resume continues the fresh run, not the one before it
+    assert not RunJournal(filename).is_done('0/cycles=10')
@@ -0,0 +1,34 @@
+import pytest
+
+from PET.planner import DEFAULT_COSTS, CostProfile, plan_experiment
+
+
+def spec(steps):
+    return {'sample': {'root': 'data', 'sample': 'die', 'pad': 'pad'},
+            'smu': {'read': {'start_voltage': '0', 'stop_voltage': '0.1', 'NPLC': '1', 'points': '51',
+                             'compliance_current': '0.01', 'sweep_direction': 'DOUB'}},
+            'scope': {'SET': {}}, 'waveform': {'rise_time': 2e-9, 'fall_time': 2e-9, 'delay': 1e-6},
+            'variables': {'HRS_lim': 1e6}, 'steps': steps}
+
+
+SHOT = [{'pulse': 'SET', 'amplitude': 'V', 'width': 1e-7, 'scope': 'SET', 'label': 'SET_{V}V'},
+        {'read': 'read', 'label': 'read_after_SET', 'event': 'after_SET', 'voltage': 'V'}]
+
+
+def test_plan_counts_every_operation_of_a_grid():
+    plan = plan_experiment(spec([{'grid': {'V': {'linspace': [1, 2, 3]}}, 'steps': SHOT}]))
+    assert plan.counts['trigger'] == plan.counts['smu_read'] == 3
+    # the relay switches twice per point, the scope is set up once and re-armed after
+    assert plan.counts['relay'] == 6
+    assert (plan.counts['scope_setup'], plan.counts['scope_arm']) == (1, 2)
+    smu_read = DEFAULT_COSTS['smu'] + 102 * DEFAULT_COSTS['plc']
+    assert plan.seconds['smu_read'] == pytest.approx(3 * smu_read)
+
+
+def test_plan_runs_verify_loops_to_their_limit_and_uses_the_calibration():
+    steps = [{'set': {'V': 1}}, {'verify': {'until': 'R >= HRS_lim', 'max_tries': 4}, 'steps': SHOT}]
+    assert plan_experiment(spec(steps)).counts['trigger'] == 4
+    assert plan_experiment(spec(steps), outcome=lambda profile, params: 2e6).counts['trigger'] == 1
+    costs = CostProfile()
+    costs.record('smu_read', 2.0)
+    assert plan_experiment(spec(steps), costs).seconds['smu_read'] == pytest.approx(8.0)
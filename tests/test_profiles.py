@@ -0,0 +1,41 @@
+import pytest
+
+from PET.PET_module import record_resistance
+from PET.profiles import ProfileRegistry
+
+
+def test_variables_prefer_presets_and_die_limits_over_spec_defaults():
+    profiles = ProfileRegistry()
+    assert profiles.variables('GST225', 'die', {'HRS_lim': 5.1e5, 'V_read': 0.1})['HRS_lim'] == 1.01e6
+    profiles.learn('GST225', 'die', HRS_lim=8e5)
+    variables = profiles.variables('GST225', 'die', {'HRS_lim': 5.1e5, 'V_read': 0.1})
+    assert (variables['HRS_lim'], variables['V_read']) == (8e5, 0.1)
+
+
+def test_v_set_min_stays_above_the_preset():
+    profiles = ProfileRegistry()
+    profiles.learn('GST225', 'die', V_SET=[0.25, 0.3, 1.0, 1.1, 1.2])
+    assert profiles.variables('GST225', 'die')['V_SET_min'] == 0.2
+
+
+def test_set_reads_of_a_device_already_in_lrs_are_not_learned(tmp_path):
+    log = str(tmp_path / 'pad.txt')
+    record_resistance(log, 2, 1e4, 'after_sweep')
+    record_resistance(log, 0.3, 1e4, 'after_SET_1.0e-07')   # already LRS before the pulse
+    record_resistance(log, 2.2, 1e6, 'after_RESET')
+    record_resistance(log, 0.9, 1e4, 'after_SET_1.0e-07')
+    profiles = ProfileRegistry()
+    assert profiles.learn_resistance_log('GST225', 'die', log, 2.5e4, 1.01e6)['V_SET'] == 1
+    assert profiles.samples('GST225', 'die', 'V_SET') == [0.9]
+
+
+def test_v_sweep_stays_below_the_spec_default():
+    profiles = ProfileRegistry(presets={'GST225': {}})
+    profiles.learn('GST225', 'die', V_sweep=[3.5, 4, 4.5])
+    assert profiles.variables('GST225', 'die', {'V_sweep': 3})['V_sweep'] == 3
+    assert profiles.variables('GST225', 'die', {'V_sweep': 5})['V_sweep'] == 4
+
+
+def test_unknown_material_raises():
+    with pytest.raises(ValueError):
+        ProfileRegistry().variables('GeTe', 'die')
@@ -0,0 +1,150 @@
+import time
+
+import pytest
+
+import PET.PET_module as pm
+from fake_esp32 import FakeESP32Serial
+from fake_smu import FakeSMU
+
+
+def elapsed(function, *args, **kwargs):
+    start = time.monotonic()
+    result = function(*args, **kwargs)
+    return result, time.monotonic() - start
+
+
+def test_relays_waits_for_the_acknowledgement():
+    esp32 = FakeESP32Serial(pulse_time=0.05, settle_time=0.01)
+    acknowledged, seconds = elapsed(pm.relays, esp32, 'measure')
+    assert acknowledged
+    assert seconds >= 0.06
+    assert [pin for _, pin in esp32.pulses] == [1]
+
+
+def test_relays_discards_a_stale_acknowledgement():
+    esp32 = FakeESP32Serial(pulse_time=0.1, settle_time=0.01)
+    # late ACK of an earlier ON0 that timed out
+    esp32._output.append((time.monotonic(), b'ACK ON0\r\n'))
+    acknowledged, seconds = elapsed(pm.relays, esp32, 'switch')
+    assert acknowledged
+    assert seconds >= 0.11
+
+
+def test_relays_falls_back_to_the_settle_time(monkeypatch):
+    monkeypatch.setattr(pm, 'RELAY_SETTLE_TIME', 0.05)
+    esp32 = FakeESP32Serial(pulse_time=0.01, settle_time=0.01, acknowledge=False)
+    acknowledged, seconds = elapsed(pm.relays, esp32, 'switch', timeout=0.3)
+    assert not acknowledged and seconds >= 0.3
+    # the fallback counts the relay as switched once the settle time has passed
+    switched, seconds = elapsed(pm.relays, esp32, 'measure', timeout=0.3)
+    assert switched and 0.05 <= seconds < 0.2
+    assert [pin for _, pin in esp32.pulses] == [0, 1]
+    # acknowledging firmware leaves the fallback
+    esp32.acknowledge = True
+    assert pm.relays(esp32, 'switch', timeout=0.3)
+    assert esp32 not in pm._relays_without_ack
+
+
+def test_relays_to_smu_sends_again_and_raises_without_acknowledgement(monkeypatch):
+    monkeypatch.setattr(pm, 'RELAY_SETTLE_TIME', 0.01)
+    esp32 = FakeESP32Serial(pulse_time=0.01, settle_time=0.01)
+    pm.relays_to_smu(esp32)
+    esp32.acknowledge = False
+    with pytest.raises(RuntimeError):
+        pm.relays_to_smu(esp32, retries=0)
+    assert [pin for _, pin in esp32.pulses] == [1, 1]
+
+
+def test_measure_with_smu_on_firmware_without_acknowledgements(tmp_path, monkeypatch):
+    monkeypatch.setattr(pm, 'RELAY_SETTLE_TIME', 0.01)
+    esp32 = FakeESP32Serial(pulse_time=0.01, settle_time=0.01, acknowledge=False)
+    params = {'start_voltage': '0', 'stop_voltage': '0.1', 'NPLC': '1', 'points': '51',
+              'compliance_current': '0.01', 'sweep_direction': 'DOUB'}
+    # the first command times out, the one sent again is accepted after the settle time
+    assert pm.measure_with_smu(FakeSMU(resistance=5e3), esp32, params, str(tmp_path / 'read.npz')) == \
+        pytest.approx(5e3)
+    assert esp32 in pm._relays_without_ack
+    _, seconds = elapsed(pm.measure_with_smu, FakeSMU(resistance=5e3), esp32, params, str(tmp_path / 'read.npz'))
+    assert seconds < 0.5
+    assert [pin for _, pin in esp32.pulses] == [1, 1, 1]
+
+
+def test_relays_rejects_unknown_status_and_device():
+    esp32 = FakeESP32Serial()
+    with pytest.raises(ValueError):
+        pm.relays(esp32, 'sideways')
+    with pytest.raises(ValueError):
+        pm.relays(esp32, 'switch', device=5)
+
+
+def test_relay_controller_skips_the_current_position():
+    esp32 = pm.RelayController(FakeESP32Serial(pulse_time=0.01, settle_time=0.0))
+    assert pm.relays(esp32, 'switch')
+    assert pm.relays(esp32, 'switch')
+    assert pm.relays(esp32, 'measure')
+    assert (esp32.switch_count, esp32.skipped_count) == (2, 1)
+    assert [pin for _, pin in esp32.ser.pulses] == [0, 1]
+
+
+def test_run_relay_program_times_the_steps_on_the_esp32():
+    esp32 = pm.RelayController(FakeESP32Serial(pulse_time=0.01, settle_time=0.0))
+    stamps = pm.run_relay_program(esp32, [('pulse', 0), ('wait', 0.05), ('pulse', 1)])
+    assert len(stamps) == 3 and stamps[0] == 0
+    assert [pin for _, pin in esp32.ser.pulses] == [0, 1]
+    assert esp32.position == 'measure'
+
+
+def test_build_relay_program_validates_the_steps():
+    assert pm.build_relay_program([('pulse', 0), ('wait', 2e-3), ('pulse', 1)]) == 'PRG ON0;W2000;ON1'
+    with pytest.raises(ValueError):
+        pm.build_relay_program([('pulse', 7)])
+    with pytest.raises(ValueError):
+        pm.build_relay_program([('wait', 0.001)] * (pm.RELAY_PROGRAM_MAX_STEPS + 1))
+
+
+def test_relay_program_waits_follow_the_last_pulse():
+    esp32 = FakeESP32Serial(pulse_time=0.02, settle_time=0.01)
+    stamps = pm.run_relay_program(esp32, [('pulse', 0), ('wait', 0.05), ('high', 2), ('wait', 0.01), ('pulse', 1)])
+    # the first wait starts once the pulse has settled, the second one right after the first
+    assert stamps == pytest.approx([0, 0.03, 0.08, 0.08, 0.09], abs=1e-4)
+
+
+@pytest.mark.parametrize('step', ['W', 'W12x', 'W-5', 'W1234567890'])
+def test_relay_program_rejects_malformed_waits(step):
+    esp32 = FakeESP32Serial(timeout=1)
+    esp32.write(f'PRG ON0;{step}\n'.encode())
+    assert esp32.readline().decode().strip() == f'ERR PRG {step}'
+    assert esp32.pulses == []
+
+
+def test_relay_controller_for_device_shares_the_state():
+    esp32 = pm.RelayController(FakeESP32Serial(pulse_time=0.01, settle_time=0.0))
+    device_1 = esp32.for_device(1)
+    assert pm.relays(device_1, 'measure')
+    assert pm.relays(esp32, 'measure')
+    assert pm.relays(device_1, 'measure')
+    assert esp32.positions == {0: 'measure', 1: 'measure'}
+    assert (device_1.switch_count, esp32.skipped_count) == (2, 1)
+    assert [pin for _, pin in esp32.ser.pulses] == [3, 1]
+    esp32.invalidate()
+    assert device_1.position is None
+
+
+def test_relay_async_tracks_the_position_and_keeps_the_reply():
+    worker = pm.SerialWorker(FakeESP32Serial(pulse_time=0.02, settle_time=0.0, timeout=0.01))
+    esp32 = pm.RelayController(worker, position='measure')
+    try:
+        future = esp32.relay_async('switch')
+        assert esp32.position is None
+        assert future.result(timeout=1)
+        assert esp32.position == 'switch'
+        assert esp32.relay_async('switch').result(timeout=1)
+        assert esp32.skipped_count == 1
+        # the acknowledgement of the async command must not answer the next relays()
+        acknowledged, seconds = elapsed(pm.relays, esp32, 'measure')
+        assert acknowledged
+        assert seconds >= 0.02
+        assert esp32.position == 'measure'
+        assert [pin for _, pin in worker.ser.pulses] == [0, 1]
+    finally:
+        worker.close()
@@ -0,0 +1,85 @@
+import pytest
+
+from PET.PET_module import RelayController
+from PET.scheduler import RelayScheduler
+from fake_esp32 import FakeESP32Serial
+
+
+def scheduler():
+    return RelayScheduler(RelayController(FakeESP32Serial(pulse_time=0.001, settle_time=0.0)))
+
+
+def record(log, name):
+    def func(results):
+        log.append(name)
+        return name
+    return func
+
+
+def test_reads_stay_between_the_pulses_around_them():
+    sched = scheduler()
+    log = []
+    for k in (1, 2):
+        sched.add(f'P{k}', 'pulse', record(log, f'P{k}'))
+        sched.add(f'R{k}', 'read', record(log, f'R{k}'))
+    assert sched.plan() == (['P1', 'R1', 'P2', 'R2'], 4)
+    sched.run()
+    assert log == sched.order == ['P1', 'R1', 'P2', 'R2']
+    assert [pin for _, pin in sched.relay.ser.pulses] == [0, 1, 0, 1]
+
+
+def test_pulses_between_checkpoints_run_as_one_batch():
+    sched = scheduler()
+    for checkpoint in range(2):
+        for cycle in range(3):
+            sched.add(f'P{checkpoint}{cycle}', 'pulse', lambda r: None)
+        sched.add(f'R{checkpoint}', 'read', lambda r: None)
+    sched.run()
+    assert sched.order == ['P00', 'P01', 'P02', 'R0', 'P10', 'P11', 'P12', 'R1']
+    assert sched.transitions == sched.relay.switch_count == 4
+
+
+def test_devices_are_interleaved_on_shared_relay_positions():
+    sched = scheduler()
+    for device in (0, 1):
+        for k in (1, 2):
+            sched.add(f'P{device}{k}', 'pulse', lambda r: None, device=device)
+            sched.add(f'R{device}{k}', 'read', lambda r: None, device=device)
+    order, transitions = sched.plan()
+    # the program order would need 14 relay commands
+    assert transitions == 10
+    for device in (0, 1):
+        assert [name for name in order if name[1] == str(device)] == [f'P{device}1', f'R{device}1', f'P{device}2',
+                                                                      f'R{device}2']
+    sched.run()
+    assert (sched.order, sched.transitions) == (order, transitions)
+    assert sched.relay.switch_count == transitions
+
+
+def test_verify_decisions_add_operations_while_running():
+    sched = scheduler()
+    resistance = iter([1e3, 5e4, 2e6])
+
+    def verify(results, k):
+        if results[f'read_{k}'] < 1e6:
+            sched.add(f'RESET_{k + 1}', 'pulse', lambda r: None)
+            sched.add(f'read_{k + 1}', 'read', lambda r: next(resistance))
+            sched.add(f'verify_{k + 1}', 'compute', lambda r: verify(r, k + 1), depends_on=[f'read_{k + 1}'])
+
+    sched.add('read_0', 'read', lambda r: next(resistance))
+    sched.add('verify_0', 'compute', lambda r: verify(r, 0), depends_on=['read_0'])
+    results = sched.run()
+    assert sched.order == ['read_0', 'verify_0', 'RESET_1', 'read_1', 'verify_1', 'RESET_2', 'read_2', 'verify_2']
+    assert results['read_2'] == 2e6
+
+
+def test_unresolvable_dependencies_raise():
+    sched = scheduler()
+    sched.add('a', 'compute', lambda r: None, depends_on=['b'])
+    sched.add('b', 'compute', lambda r: None, depends_on=['a'])
+    with pytest.raises(ValueError):
+        sched.run()
+    with pytest.raises(ValueError):
+        sched.add('c', 'measure', lambda r: None)
+    with pytest.raises(ValueError):
+        sched.add('a', 'read', lambda r: None)
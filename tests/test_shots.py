@@ -0,0 +1,76 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import PET.PET_module as pm
+from fake_esp32 import FakeESP32Serial
+
+
+def slow(seconds, log, name, error=None):
+    def step(*args):
+        time.sleep(seconds)
+        log.append(name)
+        if error:
+            raise error
+    return step
+
+
+def test_prepare_shot_takes_as_long_as_the_slowest_instrument(monkeypatch):
+    log = []
+    monkeypatch.setattr(pm, 'setup_sequences', slow(0.1, log, 'sequence'))
+    monkeypatch.setattr(pm, 'setup_oscilloscope', slow(0.1, log, 'scope'))
+    awg = SimpleNamespace(waveforms={})
+    esp32 = FakeESP32Serial(pulse_time=0.1, settle_time=0)
+    start = time.monotonic()
+    pm.prepare_shot(awg, None, esp32, [{"number": 1, "waveform": "SET"}], {}, {'SET': [0.0]})
+    assert time.monotonic() - start < 0.25
+    assert sorted(log) == ['scope', 'sequence'] and list(awg.waveforms) == ['SET']
+    assert [pin for _, pin in esp32.pulses] == [0]
+
+
+def test_prepare_shot_reports_a_failure_after_the_others_finished(monkeypatch):
+    log = []
+    monkeypatch.setattr(pm, 'setup_sequences', slow(0.01, log, 'sequence', ValueError('upload failed')))
+    monkeypatch.setattr(pm, 'setup_oscilloscope', slow(0.1, log, 'scope'))
+    with pytest.raises(RuntimeError, match='AWG: upload failed'):
+        pm.prepare_shot(SimpleNamespace(waveforms={}), None, FakeESP32Serial(pulse_time=0, settle_time=0), [], {})
+    assert log == ['sequence', 'scope']
+
+
+def pipeline_with_fakes(monkeypatch, log, readout_time=0.05):
+    import PET.pipeline as pipeline
+
+    def get_waveform_data(scope):
+        time.sleep(readout_time)
+        log.append('readout')
+        return np.zeros(3), np.ones(3), np.zeros(3), np.ones(3)
+    monkeypatch.setattr(pipeline, 'trigger', lambda scope, awg: log.append('trigger') or 0.0)
+    monkeypatch.setattr(pipeline, 'get_waveform_data', get_waveform_data)
+    monkeypatch.setattr(pipeline, 'setup_oscilloscope', lambda scope, settings: log.append('scope'))
+    monkeypatch.setattr(pipeline, 'setup_sequences', lambda awg, config: log.append('sequence'))
+    awg = SimpleNamespace(waveforms={}, enabled=False, write=lambda command: None)
+    return pipeline.ShotPipeline(awg, None, FakeESP32Serial(pulse_time=0, settle_time=0))
+
+
+def test_shot_pipeline_saves_while_the_caller_goes_on(tmp_path, monkeypatch):
+    log = []
+    with pipeline_with_fakes(monkeypatch, log) as shots:
+        shots.prepare({}, [{"number": 1, "waveform": "SET"}], {'SET': [0.0]})
+        shots.fire(str(tmp_path / 'SET.npz'))
+        log.append('read')  # the SMU read runs while the scope is read out
+        shots.prepare({})
+        shots.flush()
+        with np.load(str(tmp_path / 'SET.npz')) as data:
+            assert list(data['voltages_v']) == [1, 1, 1]
+    # the scope is only set up again after its readout
+    assert log == ['sequence', 'scope', 'trigger', 'read', 'readout', 'scope']
+
+
+def test_shot_pipeline_raises_a_failed_save(tmp_path, monkeypatch):
+    shots = pipeline_with_fakes(monkeypatch, [], readout_time=0)
+    shots.prepare({})
+    shots.fire(str(tmp_path / 'missing' / 'SET.npz'))
+    with pytest.raises(RuntimeError, match='Failed to save shot data'):
+        shots.close()
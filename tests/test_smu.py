@@ -0,0 +1,151 @@
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+
+from PET import PET_module
+from fake_esp32 import FakeESP32Serial
+from fake_smu import FakeSMU
+
+
+def test_measure_and_save_saves_the_shot_while_the_smu_reads(tmp_path, monkeypatch):
+    calls = []
+
+    def measure_with_smu_async(smu, ser, params, filename, last_resistance=None):
+        calls.append((filename, last_resistance))
+        future = Future()
+        future.set_result(1234.0)
+        return future
+    monkeypatch.setattr(PET_module, 'measure_with_smu_async', measure_with_smu_async)
+    shot_file = str(tmp_path / 'SET.npz')
+    resistance = PET_module.measure_and_save(None, None, {}, 'read.npz', shot_file, last_resistance=1e4,
+                                             times_v=np.arange(3), voltages_v=np.ones(3))
+    assert resistance == 1234.0
+    assert calls == [('read.npz', 1e4)]
+    with np.load(shot_file) as data:
+        assert list(data['times_v']) == [0, 1, 2]
+
+
+def test_segments_with_different_compliance_run_as_separate_acquisitions():
+    params = {'segments': PET_module.bipolar_sweep_segments(2, -2, 11, (1e-3, 1e-2), read_voltage=0.1,
+                                                            read_points=5),
+              'NPLC': 1}
+    groups = PET_module.group_smu_segments(params)
+    assert [len(group['segments']) for group in groups] == [2, 2, 1]
+    assert [group['compliance_current'] for group in groups] == [1e-3, 1e-2, 1e-3]
+    smu = FakeSMU(resistance=1e3)
+    results = PET_module.get_smu_segment_measurement(smu, params)
+    assert [acquisition['compliance'] for acquisition in smu.acquisitions] == [1e-3, 1e-2, 1e-3]
+    assert [len(result[0]) for result in results] == [11, 11, 11, 11, 5]
+    # 2 V on 1 kOhm needs 2 mA: only the positive branch is clamped
+    assert PET_module.smu_segment_compliance(params, results) == [True, True, False, False, False]
+
+
+def test_output_is_held_in_fixed_mode_between_acquisitions():
+    params = {'segments': [{'start_voltage': 0, 'stop_voltage': 1, 'points': 5, 'compliance_current': 1e-3},
+                           {'voltage': 0.1, 'points': 5, 'compliance_current': 1e-2}],
+              'NPLC': 1}
+    smu = FakeSMU(resistance=1e4)
+    PET_module.get_smu_segment_measurement(smu, params)
+    fetched = smu.commands.index('FETC:ARR:RES?')
+    between = smu.commands[fetched + 1:smu.commands.index('INIT', fetched)]
+    assert between[:2] == ['SOUR:VOLT:MODE FIX', 'SOUR:VOLT 1.0']
+    assert 'OUTP1 OFF' not in between
+    assert smu.commands[-2:] == ['OUTP1 OFF', '*WAI']
+
+
+def sweep_params(points=51):
+    return {'start_voltage': '0', 'stop_voltage': '5', 'points': str(points), 'NPLC': '1',
+            'compliance_current': '0.01', 'sweep_direction': 'DOUB'}
+
+
+def test_early_abort_chunks_amortise_their_overhead():
+    assert PET_module.early_abort_chunk_points(sweep_params()) == 23
+    assert PET_module.early_abort_chunk_points(sweep_params(3)) == 3
+
+
+def test_early_abort_finds_a_jump_across_two_chunks():
+    # the device switches at the first point of the second chunk
+    smu = FakeSMU(resistance=lambda v, k: 1e7 if k < 10 else 1e3)
+    data, switching_index = PET_module.get_smu_sweep_early_abort(smu, sweep_params(), chunk_points=10)
+    assert switching_index == 10
+    assert data[2][switching_index] == pytest.approx(1.0)
+    # two chunks of the up-ramp and the ramp down instead of the 102 points of the whole sweep
+    assert len(data[0]) == 25
+    assert smu.commands.count('SOUR:VOLT:MODE FIX') == 2
+
+
+def test_early_abort_runs_the_whole_sweep_without_switching():
+    smu = FakeSMU(resistance=1e6)
+    data, switching_index = PET_module.get_smu_sweep_early_abort(smu, sweep_params())
+    assert switching_index is None
+    assert len(data[0]) == 102
+    assert len(smu.acquisitions) == 4
+
+
+READ_PARAMS = {'start_voltage': '0', 'stop_voltage': '0.1', 'NPLC': '1', 'points': '51', 'compliance_current': '0.01',
+               'sweep_direction': 'DOUB'}
+
+
+def test_current_range_is_predicted_from_the_state_after_the_pulse():
+    assert PET_module.predict_smu_current_range(1e4, 0.1) == 1e-4
+    assert PET_module.predict_smu_current_range(1e6, 0.1) == 1e-6
+    assert PET_module.predict_smu_current_range(None, 0.1) is None
+    # a SET from the HRS may have switched: the range must hold the LRS current
+    assert PET_module.expected_resistance(1e6, 2e3) == 2e3
+    assert PET_module.expected_resistance(1e3, 1e6) == 1e3
+    assert PET_module.expected_resistance(None, 2e3) is None
+
+
+def test_read_on_the_predicted_range(tmp_path):
+    smu = FakeSMU(resistance=5e3)
+    resistance = PET_module.measure_with_smu(smu, FakeESP32Serial(pulse_time=0, settle_time=0), READ_PARAMS,
+                                             str(tmp_path / 'read.npz'), last_resistance=2e3)
+    assert resistance == pytest.approx(5e3)
+    assert [acquisition['range'] for acquisition in smu.acquisitions] == [1e-4]
+
+
+def test_read_overflowing_the_predicted_range_is_repeated_with_auto_range(tmp_path):
+    # switched below the target: 0.1 V on 500 Ohm overflows the 100 uA range predicted for 2 kOhm
+    smu = FakeSMU(resistance=500)
+    resistance = PET_module.measure_with_smu(smu, FakeESP32Serial(pulse_time=0, settle_time=0), READ_PARAMS,
+                                             str(tmp_path / 'read.npz'), last_resistance=2e3)
+    assert resistance == pytest.approx(500)
+    assert [acquisition['range'] for acquisition in smu.acquisitions] == [1e-4, None]
+
+
+def test_smu_result_store_round_trip(tmp_path):
+    filename = str(tmp_path / 'smu_results.npz')
+    smu = FakeSMU(resistance=lambda v, k: 1e3 if k < 102 else 1e6)
+    esp32 = FakeESP32Serial(pulse_time=0, settle_time=0)
+    with PET_module.SMUResultStore(filename, flush_every=1) as store:
+        PET_module.measure_with_smu(smu, esp32, READ_PARAMS, store.entry('read_after_SET'))
+        PET_module.measure_with_smu(smu, esp32, READ_PARAMS, store.entry('read_after_RESET'))
+    # a second run appends to the same file and profile
+    with PET_module.SMUResultStore(filename) as store:
+        PET_module.measure_with_smu(smu, esp32, READ_PARAMS, store.entry('read_after_SET'))
+    profiles = PET_module.load_smu_results(filename)
+    assert list(profiles) == [0]
+    profile = profiles[0]
+    assert profile['params'] == READ_PARAMS
+    assert list(profile['label']) == ['read_after_SET', 'read_after_RESET', 'read_after_SET']
+    assert profile['resistance'].shape == (3, 102)
+    assert profile['resistance'][:, 51] == pytest.approx([1e3, 1e6, 1e6], rel=1e-6)
+    assert profile['source_voltage'][51] == pytest.approx(0.1)
+
+
+def test_segments_and_early_abort_save_to_a_store(tmp_path):
+    filename = str(tmp_path / 'smu_results.npz')
+    esp32 = FakeESP32Serial(pulse_time=0, settle_time=0)
+    params = {'segments': [{'start_voltage': 0, 'stop_voltage': 1, 'points': 5, 'compliance_current': 1e-3},
+                           {'voltage': 0.1, 'points': 3, 'compliance_current': 1e-2}],
+              'NPLC': 1}
+    with PET_module.SMUResultStore(filename) as store:
+        PET_module.measure_with_smu_segments(FakeSMU(resistance=1e4), esp32, params, store.entry('segments'))
+        PET_module.measure_with_smu_early_abort(FakeSMU(resistance=lambda v, k: 1e7 if k < 10 else 1e3), esp32,
+                                                sweep_params(), store.entry('sweep'), chunk_points=10)
+    segments, sweep = PET_module.load_smu_results(filename).values()
+    assert list(segments['segment'][0]) == [0] * 5 + [1] * 3
+    assert list(segments['compliance_reached'][0]) == [False, False]
+    assert list(sweep['label']) == ['sweep']
+    assert sweep['switching_voltage'] == pytest.approx([1.0])